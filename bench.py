@@ -0,0 +1,427 @@
+# bench.py — قياس أداء دورة الجمع كاملة بدون إنترنت
+# -*- coding: utf-8 -*-
+"""
+Offline benchmark لـ news_bot
+------------------------------
+• خادم محلي (Fixture) يقدّم: RSS عربي مُولّد، صفحات مقالات مع og:image، وصور PNG.
+• بدائل محلية لـ Telegram (sendMessage) و OpenAI (/v1/responses) و Ollama (/api/generate)
+  مع تأخير قابل للضبط و 429 كل N رسالة.
+• يشغّل Bot.collect_once على مئات المصادر ثم يفرغ صندوق الصادر، لعدة دورات.
+• مع --push N: الملفات تعلن عن hub محلي (WebSub) يتحقق من اشتراك البوت ثم يدفع N خبرًا جديدًا
+  إلى مستقبِل البوت (PushReceiver)؛ يُقاس الزمن من النشر حتى الإرسال لتيليجرام بالثواني.
+• النتيجة: items/sec، p50/p95 لكل مرحلة (fetch, extract, relevance, dedup, llm, send, facebook)،
+  أقصى RSS للذاكرة، وحجم قواعد البيانات — في ملف JSON للمقارنة بين التغييرات.
+
+أمثلة:
+    python bench.py --sources 200 --items 20
+    python bench.py --sources 500 --items 30 --pipeline 1 --llm ollama --llm-latency 0.3 --out after.json --compare before.json
+    python bench.py --sources 20 --cycles 1 --push 30
+
+الخادم يعمل في عملية مستقلة حتى لا يشارك البوت الـ GIL. مع --hosts > 1 تتوزع المصادر على
+عناوين 127.0.0.x (لينكس) ليعمل حد التزامن لكل موقع كما في الواقع.
+"""
+
+import os, sys, json, time, hmac, random, socket, struct, zlib, shutil, tempfile, resource, argparse, subprocess
+import http.server, multiprocessing, urllib.request
+from urllib.parse import urlparse, parse_qs, urlencode
+
+# ====== توليد البيانات ======
+CITIES = ["الرمادي", "الفلوجة", "هيت", "القائم", "حديثة", "الرطبة", "الكرمة", "الحبانية"]
+OTHER = ["البصرة", "الموصل", "كربلاء", "النجف", "أربيل", "كركوك", "بابل", "ديالى"]
+WORDS = ("الشرطة المحافظ مجلس قرار مشروع الطريق الجسر الكهرباء الماء المدرسة المستشفى الزراعة "
+         "السوق الأمن العشائر الانتخابات الموازنة الوزارة افتتاح تأهيل إعمار تطوير إنشاء مجمع "
+         "سكني الطلبة الامتحانات الحصة التموينية الرواتب المتقاعدين الاستثمار النقل المطار الحدود").split()
+_LETTERS = "ابتثجحخدذرزسشصضطظعغفقكلمنهوي"
+# مفردات كبيرة بتوزيع Zipf: بمفردات قليلة تتشابه كل النصوص فيصبح كل خبر مرشحًا في فهرس التشابه
+_r0 = random.Random(0)
+VOCAB = WORDS + ["".join(_r0.choice(_LETTERS) for _ in range(_r0.randint(3, 8))) for _ in range(6000)]
+_ZIPF = [1.0 / (i + 1) for i in range(len(VOCAB))]
+
+def words(r: random.Random, n: int) -> str:
+    return " ".join(r.choices(VOCAB, weights=_ZIPF, k=n))
+
+def _rng(*key) -> random.Random:
+    return random.Random("/".join(map(str, key)))
+
+def article(seed: int, k: int, i: int, relevant: float, dup: float, burst: float = 0.0) -> dict:
+    # الخبر i من المصدر k؛ نسبة dup منها نسخة من خبر المصدر 0 (نفس نص الوكالة في موقعين)
+    r = _rng(seed, k, i)
+    if k and r.random() < dup:
+        k = 0; r = _rng(seed, 0, i)
+    if r.random() < burst:
+        # تغطية حدث جارٍ: عنوان ومقدمة مشتركة مع بقية المصادر بصياغة مختلفة (ليست نسخة)
+        e = _rng(seed, "event", i // 10 % 3)
+        place, core, lead = e.choice(CITIES), words(e, 4), words(e, 30).split()
+        lead = " ".join(w for w in lead if r.random() < 0.7)
+        title = f"{core} {words(r, 2)} في {place}"
+        body = f"{lead} {words(r, r.randint(150, 400))} {place}"
+        return {"title": title, "body": body, "summary": body[:r.choice([60, 600])], "img": r.randrange(20)}
+    place = r.choice(CITIES) if r.random() < relevant else r.choice(OTHER)
+    title = f"{words(r, 6)} في {place}"
+    body = f"{words(r, r.randint(150, 400))} {place} {words(r, 40)}"
+    # نصف الأخبار بملخص قصير حتى يُختبر مسار الاستخراج الكسول
+    summary = body[:r.choice([60, 600])]
+    return {"title": title, "body": body, "summary": summary, "img": r.randrange(20)}
+
+def png(w: int, h: int, shade: int) -> bytes:
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+    raw = b"".join(b"\x00" + bytes([shade, 80, 120]) * w for _ in range(h))
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b""))
+
+# ====== خادم الـ Fixture + بدائل Telegram/LLM + hub WebSub ======
+PUSH_BASE = 100000
+def _serve(opts: dict, cycle, port_out, ready):
+    import threading
+    seed, n_items, new_per_cycle = opts["seed"], opts["items"], opts["new_per_cycle"]
+    t0 = int(time.time())  # أزمنة النشر قبل بدء القياس بساعات (داخل FEED_MAX_AGE_HOURS)
+    images = {s: png(400 + s, 300, s * 12 % 256) for s in range(20)}
+    counters = {"tg": 0, "tg_429": 0, "llm": 0, "feeds": 0, "feeds_304": 0, "pages": 0, "images": 0,
+                "hub_subscribed": 0, "hub_pushes": 0}
+    lock = threading.Lock()
+    subs = {}  # topic -> (callback, secret) بعد نجاح التحقق
+
+    def rel(i):  # أخبار الدفع (i ≥ PUSH_BASE) تخص الأنبار دائمًا حتى تصل للقناة
+        return (1.0, 0.0, 0.0) if i >= PUSH_BASE else (opts["relevant"], opts["dup"], opts["burst"])
+
+    def rss_item(host, k, i, a, ts):
+        return (f"<item><title>{a['title']}</title><link>http://{host}/a/{k}/{i}.html</link>"
+                f"<description>{a['summary']}</description><guid>g{k}-{i}</guid>"
+                f"<pubDate>{time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime(ts))}</pubDate></item>")
+
+    def rss(host, k, rows):
+        hub = (f'<atom:link rel="hub" href="http://{host}/hub"/><atom:link rel="self" href="http://{host}/feed/{k}.xml"/>'
+               if opts["hub"] else "")
+        return (f'<?xml version="1.0" encoding="utf-8"?><rss version="2.0" xmlns:atom="http://www.w3.org/2005/Atom">'
+                f'<channel><title>bench {k}</title>{hub}{"".join(rows)}</channel></rss>').encode()
+
+    def hub_verify(form):
+        # تحقق WebSub: GET للـ callback مع challenge؛ الاشتراك يُعتمد فقط إن أعاده المشترك كما هو
+        challenge = f"c{random.random()}"
+        q = urlencode({"hub.mode": "subscribe", "hub.topic": form["hub.topic"], "hub.challenge": challenge,
+                       "hub.lease_seconds": form.get("hub.lease_seconds", "3600")})
+        try:
+            with urllib.request.urlopen(f"{form['hub.callback']}?{q}", timeout=5) as r:
+                ok = r.read().decode() == challenge
+        except Exception:
+            ok = False
+        if ok:
+            with lock: subs[form["hub.topic"]] = (form["hub.callback"], form.get("hub.secret", "")); counters["hub_subscribed"] += 1
+
+    def bump(key):
+        with lock: counters[key] += 1; return counters[key]
+
+    class H(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        def log_message(self, *a): pass
+
+        def reply(self, code, body: bytes, ctype="text/plain", headers=None):
+            self.send_response(code)
+            self.send_header("Content-Type", ctype); self.send_header("Content-Length", str(len(body)))
+            for k, v in (headers or {}).items(): self.send_header(k, v)
+            self.end_headers(); self.wfile.write(body)
+
+        def do_GET(self):
+            parts = urlparse(self.path).path.strip("/").split("/")
+            host = self.headers.get("Host", "127.0.0.1")
+            if parts[0] == "feed":
+                k, c = int(parts[1].split(".")[0]), cycle.value
+                etag = f'"c{c}"'
+                if self.headers.get("If-None-Match") == etag:
+                    bump("feeds_304"); return self.reply(304, b"")
+                bump("feeds"); time.sleep(opts["feed_latency"])
+                first = c * new_per_cycle
+                rows = [rss_item(host, k, i, article(seed, k, i, *rel(i)), t0 - (5000 - i) * 30)
+                        for i in range(first + n_items - 1, first - 1, -1)]
+                return self.reply(200, rss(host, k, rows), "application/rss+xml; charset=utf-8", {"ETag": etag})
+            if parts[0] == "a":
+                bump("pages"); time.sleep(opts["page_latency"])
+                k, i = int(parts[1]), int(parts[2].split(".")[0])
+                a = article(seed, k, i, *rel(i))
+                body = (f'<html><head><meta charset="utf-8"><title>{a["title"]}</title>'
+                        f'<meta property="og:image" content="/img/{a["img"]}.png"></head><body>'
+                        f'<nav>{" ".join(WORDS[:30])}</nav><article><h1>{a["title"]}</h1><p>{a["body"]}</p>'
+                        f'<img src="/img/{(a["img"] + 1) % 20}.png"></article><footer>جميع الحقوق محفوظة</footer>'
+                        f'</body></html>').encode()
+                return self.reply(200, body, "text/html; charset=utf-8")
+            if parts[0] == "img":
+                bump("images")
+                return self.reply(200, images[int(parts[1].split(".")[0]) % 20], "image/png")
+            if parts[0] == "_stats":
+                with lock: body = json.dumps(counters).encode()
+                return self.reply(200, body, "application/json")
+            self.reply(404, b"")
+
+        def do_POST(self):
+            raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            path = urlparse(self.path).path
+            if path == "/hub":
+                form = {k: v[0] for k, v in parse_qs(raw.decode()).items()}
+                if form.get("hub.mode") != "subscribe" or not form.get("hub.callback"): return self.reply(400, b"")
+                threading.Thread(target=hub_verify, args=(form,), daemon=True).start()
+                return self.reply(202, b"")
+            if path == "/_publish":
+                # خبر جديد في المصدر k يُدفع فورًا لكل مشتركي ملفه (X-Hub-Signature: sha256=HMAC)
+                j = json.loads(raw); k, i = j["k"], j["i"]
+                host = self.headers.get("Host", "127.0.0.1"); topic = f"http://{host}/feed/{k}.xml"
+                t = time.time()
+                body = rss(host, k, [rss_item(host, k, i, article(seed, k, i, *rel(i)), t)])
+                with lock: sub = subs.get(topic)
+                delivered = 0
+                if sub:
+                    sig = "sha256=" + hmac.new(sub[1].encode(), body, "sha256").hexdigest()
+                    req = urllib.request.Request(sub[0], data=body, method="POST", headers={
+                        "Content-Type": "application/rss+xml", "X-Hub-Signature": sig})
+                    try:
+                        with urllib.request.urlopen(req, timeout=5) as r: delivered = int(r.status < 300)
+                    except Exception: pass
+                    bump("hub_pushes")
+                out = {"t": t, "url": f"http://{host}/a/{k}/{i}.html", "delivered": delivered}
+                return self.reply(200, json.dumps(out).encode(), "application/json")
+            if path.endswith("/sendMessage"):
+                time.sleep(opts["tg_latency"])
+                n = bump("tg")
+                if opts["tg_429_every"] and n % opts["tg_429_every"] == 0:
+                    bump("tg_429")
+                    body = json.dumps({"ok": False, "error_code": 429, "parameters": {"retry_after": 1}}).encode()
+                    return self.reply(429, body, "application/json")
+                return self.reply(200, b'{"ok":true,"result":{}}', "application/json")
+            bump("llm"); time.sleep(opts["llm_latency"])
+            j = json.loads(raw or b"{}")
+            text = "📰 خبر محلي\n• " + words(_rng(raw), 40)
+            if path.endswith("/api/generate"):
+                out = {"response": text, "prompt_eval_count": len(j.get("prompt", "")) // 4, "eval_count": 120}
+            else:
+                out = {"id": "resp_bench", "object": "response", "created_at": 0, "model": j.get("model", "m"),
+                       "status": "completed", "parallel_tool_calls": True, "tool_choice": "auto", "tools": [],
+                       "output": [{"type": "message", "id": "msg_bench", "role": "assistant", "status": "completed",
+                                   "content": [{"type": "output_text", "text": text, "annotations": []}]}],
+                       "usage": {"input_tokens": len(raw) // 4, "output_tokens": 120, "total_tokens": len(raw) // 4 + 120,
+                                 "input_tokens_details": {"cached_tokens": 0}, "output_tokens_details": {"reasoning_tokens": 0}}}
+            self.reply(200, json.dumps(out).encode(), "application/json")
+
+    bind = "0.0.0.0" if opts["hosts"] > 1 else "127.0.0.1"
+    srv = http.server.ThreadingHTTPServer((bind, opts["port"]), H)
+    srv.daemon_threads = True
+    port_out.value = srv.server_address[1]; ready.set()
+    srv.serve_forever()
+
+class FixtureServer:
+    def __init__(self, **opts):
+        self.opts = opts
+        self.cycle = multiprocessing.Value("i", 0)
+        self._port = multiprocessing.Value("i", 0)
+        self._ready = multiprocessing.Event()
+        self.proc = None
+
+    def start(self):
+        self.proc = multiprocessing.Process(target=_serve, args=(self.opts, self.cycle, self._port, self._ready), daemon=True)
+        self.proc.start()
+        if not self._ready.wait(10): raise RuntimeError("fixture server did not start")
+        return self
+
+    def url(self, k: int = 0) -> str:
+        host = f"127.0.0.{1 + k % self.opts['hosts']}"
+        return f"http://{host}:{self._port.value}"
+
+    def stats(self) -> dict:
+        with urllib.request.urlopen(f"{self.url()}/_stats", timeout=5) as r:
+            return json.loads(r.read())
+
+    def publish(self, k: int, i: int) -> dict:
+        req = urllib.request.Request(f"{self.url(k)}/_publish", data=json.dumps({"k": k, "i": i}).encode(), method="POST")
+        with urllib.request.urlopen(req, timeout=10) as r:
+            return json.loads(r.read())
+
+    def stop(self):
+        if self.proc: self.proc.terminate(); self.proc.join(5)
+
+# ====== القياس ======
+def _pcts(xs: list) -> dict:
+    xs = sorted(xs)
+    if not xs: return {"n": 0}
+    at = lambda q: xs[min(len(xs) - 1, int(q * len(xs)))]
+    return {"n": len(xs), "p50": at(0.50), "p95": at(0.95), "max": xs[-1]}
+
+def _size(*paths) -> int:
+    total = 0
+    for p in paths:
+        for f in (p, p + "-wal", p + "-shm"):
+            if os.path.exists(f): total += os.path.getsize(f)
+    return total
+
+def _dir_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, fs in os.walk(path) for f in fs)
+
+def _peak_rss_mb() -> float:
+    kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(kb / 1024 / (1024 if sys.platform == "darwin" else 1), 1)
+
+def _git_rev() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return ""
+
+def run(args) -> dict:
+    work = tempfile.mkdtemp(prefix="newsbot-bench-")
+    srv = FixtureServer(seed=args.seed, items=args.items, new_per_cycle=args.new_per_cycle, relevant=args.relevant,
+                        dup=args.dup, burst=args.burst, hosts=args.hosts, port=args.port, feed_latency=args.feed_latency,
+                        page_latency=args.page_latency, tg_latency=args.tg_latency, tg_429_every=args.tg_429_every,
+                        llm_latency=args.llm_latency, hub=bool(args.push)).start()
+    base = srv.url()
+    # الإعداد يُقرأ عند استيراد news_bot، لذا تُضبط البيئة أولًا
+    os.environ.update({
+        "NEWS_DB": os.path.join(work, "bench.db"), "OUT_DIR": os.path.join(work, "out"),
+        "PAGE_CACHE_DB": os.path.join(work, "cache.db"), "AUTO_PIP": "0", "DRY_RUN": "0",
+        "TG_TOKEN": "bench", "TG_CHAT_ID": "-100", "TG_API_BASE": base,
+        "TG_CHAT_PER_MIN": str(args.tg_per_min), "TG_CHAT_BURST": str(args.tg_burst), "TG_GLOBAL_PER_SEC": "1000",
+        "LLM_BACKEND": args.llm, "OPENAI_API_KEY": "bench", "OPENAI_BASE_URL": f"{base}/v1", "OLLAMA_URL": base,
+        "PIPELINE": str(args.pipeline), "FACEBOOK_MODE": str(args.facebook),
+        "MAX_ITEMS_PER_SOURCE": str(args.items), "ADAPTIVE_POLL": "0",
+    })
+    if args.push:
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0)); rx_port = s.getsockname()[1]
+        os.environ.update({"WEBSUB_PORT": str(rx_port), "WEBSUB_CALLBACK": f"http://127.0.0.1:{rx_port}"})
+    for kv in args.env:
+        k, _, v = kv.partition("="); os.environ[k] = v
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import news_bot as nb
+    if not args.verbose: nb.logger.disabled = True
+    bot = nb.Bot(nb.Config(log_stdout=args.verbose)).start()
+    sources = [{"name": f"bench-{k}", "lang": "ar", "type": "rss", "url": f"{srv.url(k)}/feed/{k}.xml"}
+               for k in range(args.sources)]
+
+    cycles = []
+    try:
+        for c in range(args.cycles):
+            srv.cycle.value = c
+            t0 = time.perf_counter()
+            new = bot.collect_once(sources) or 0
+            t1 = time.perf_counter()
+            nb.DISPATCHER.drain(args.drain_seconds)
+            t2 = time.perf_counter()
+            cycles.append({"cycle": c, "new_items": new, "collect_s": round(t1 - t0, 3), "drain_s": round(t2 - t1, 3),
+                           "items_per_sec": round(new / (t1 - t0), 2) if t1 > t0 else 0.0,
+                           "end_to_end_items_per_sec": round(new / (t2 - t0), 2) if t2 > t0 else 0.0})
+            print(f"cycle {c}: {new} new items, collect {t1 - t0:.2f}s, drain {t2 - t1:.2f}s", file=sys.stderr)
+        push = run_push(args, srv, nb, len(sources)) if args.push else None
+        with nb.db_lock:
+            lat = [r[0] for r in nb.conn.execute("SELECT latency_ms FROM outbox WHERE status='sent' AND latency_ms IS NOT NULL")]
+            outbox = dict(nb.conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+        total_new = sum(c["new_items"] for c in cycles)
+        total_s = sum(c["collect_s"] for c in cycles)
+        result = {
+            "bench": "news_bot.collect_once", "git_rev": _git_rev(),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "python": sys.version.split()[0],
+            "params": {k: v for k, v in vars(args).items() if k not in ("out", "compare", "verbose", "keep")},
+            "cycles": cycles,
+            "items_per_sec": round(total_new / total_s, 2) if total_s else 0.0,
+            "stages": nb.TIMINGS.summary(),
+            "outbox": {"status": outbox, "latency_ms": _pcts(lat)},
+            "llm": {b: dict(st) for b, st in nb.LLM.stats.items()},
+            "coalesce": dict(nb.COALESCER.stats),
+            "peak_rss_mb": _peak_rss_mb(),
+            "db_bytes": _size(os.environ["NEWS_DB"]),
+            "page_cache_bytes": _size(os.environ["PAGE_CACHE_DB"]),
+            "out_dir_bytes": _dir_size(os.environ["OUT_DIR"]),
+            "push": push,
+            "server": srv.stats(),
+            "metrics": nb.METRICS.snapshot(),
+        }
+    finally:
+        bot.close(drain=False)
+        srv.stop()
+        if not args.keep: shutil.rmtree(work, ignore_errors=True)
+        else: print(f"work dir kept: {work}", file=sys.stderr)
+    return result
+
+def run_push(args, srv, nb, n_sources: int) -> dict:
+    # الدورات السابقة اكتشفت الـ hubs؛ المستقبِل يشترك، ثم يُنشر خبر كل push_interval ويُقاس النشر → الإرسال
+    rx = nb.PushReceiver().start()
+    nb.DISPATCHER.start()
+    deadline = time.time() + 15
+    while srv.stats()["hub_subscribed"] < n_sources and time.time() < deadline:
+        time.sleep(0.1)
+    subscribed = srv.stats()["hub_subscribed"]
+    published = []
+    for j in range(args.push):
+        published.append(srv.publish(j % n_sources, PUSH_BASE + j))
+        time.sleep(args.push_interval)
+    by_url = {p["url"]: p["t"] for p in published}
+    lat, deadline = {}, time.time() + args.drain_seconds
+    while len(lat) < len(by_url) and time.time() < deadline:
+        with nb.db_lock:
+            rows = nb.conn.execute("""SELECT i.url, o.sent_ts FROM outbox o JOIN items i ON i.id = o.item_id
+                                      WHERE o.status='sent' AND i.url IN (%s)""" % ",".join("?" * len(by_url)),
+                                   list(by_url)).fetchall()
+        lat = {u: ts - by_url[u] for u, ts in rows}
+        time.sleep(0.1)
+    rx.stop(); nb.DISPATCHER.stop()
+    out = {"published": len(published), "subscribed": subscribed, "delivered": sum(p["delivered"] for p in published),
+           "sent": len(lat), "publish_to_send_s": {k: round(v, 3) if isinstance(v, float) else v
+                                                    for k, v in _pcts(list(lat.values())).items()}}
+    print(f"push: {out['sent']}/{out['published']} sent, publish→send {out['publish_to_send_s']}", file=sys.stderr)
+    return out
+
+def compare(new: dict, old: dict):
+    # جدول مختصر: الفرق النسبي لـ items/sec و p95 لكل مرحلة
+    def delta(a, b):
+        return f"{(a - b) / b * 100:+.1f}%" if b else "n/a"
+    print(f"{'metric':<22}{'before':>12}{'after':>12}{'delta':>12}")
+    rows = [("items_per_sec", old.get("items_per_sec", 0), new.get("items_per_sec", 0)),
+            ("peak_rss_mb", old.get("peak_rss_mb", 0), new.get("peak_rss_mb", 0)),
+            ("db_bytes", old.get("db_bytes", 0), new.get("db_bytes", 0))]
+    for stage in sorted(set(new.get("stages", {})) | set(old.get("stages", {}))):
+        rows.append((f"{stage}.p95_ms", old.get("stages", {}).get(stage, {}).get("p95_ms", 0),
+                     new.get("stages", {}).get(stage, {}).get("p95_ms", 0)))
+    for name, b, a in rows:
+        print(f"{name:<22}{b:>12}{a:>12}{delta(a, b):>12}")
+
+def main():
+    ap = argparse.ArgumentParser(description="Offline benchmark for news_bot collect cycle")
+    ap.add_argument("--sources", type=int, default=100, help="عدد المصادر")
+    ap.add_argument("--items", type=int, default=20, help="أخبار في كل RSS")
+    ap.add_argument("--cycles", type=int, default=2, help="عدد الدورات (الثانية تقيس 304 + الأخبار الجديدة)")
+    ap.add_argument("--new-per-cycle", type=int, default=3, help="أخبار جديدة لكل مصدر في كل دورة لاحقة")
+    ap.add_argument("--relevant", type=float, default=0.3, help="نسبة الأخبار التي تخص الأنبار")
+    ap.add_argument("--dup", type=float, default=0.1, help="نسبة الأخبار المنسوخة من مصدر آخر")
+    ap.add_argument("--burst", type=float, default=0.0, help="نسبة الأخبار التي تغطي حدثًا جاريًا (لقياس COALESCE_WINDOW)")
+    ap.add_argument("--hosts", type=int, default=1, help="توزيع المصادر على 127.0.0.1..N (لينكس)")
+    ap.add_argument("--port", type=int, default=0)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--feed-latency", type=float, default=0.05)
+    ap.add_argument("--page-latency", type=float, default=0.05)
+    ap.add_argument("--tg-latency", type=float, default=0.05)
+    ap.add_argument("--tg-429-every", type=int, default=0, help="كل N رسالة ترجع 429 (0 = أبدًا)")
+    ap.add_argument("--tg-per-min", type=float, default=6000, help="TG_CHAT_PER_MIN أثناء القياس")
+    ap.add_argument("--tg-burst", type=int, default=50)
+    ap.add_argument("--llm", choices=["openai", "ollama", "none"], default="none")
+    ap.add_argument("--llm-latency", type=float, default=0.2)
+    ap.add_argument("--pipeline", type=int, choices=[0, 1], default=1)
+    ap.add_argument("--facebook", type=int, choices=[0, 1], default=0)
+    ap.add_argument("--drain-seconds", type=float, default=300)
+    ap.add_argument("--push", type=int, default=0, help="بعد الدورات: عدد الأخبار المدفوعة عبر hub WebSub محلي")
+    ap.add_argument("--push-interval", type=float, default=0.5, help="ثوانٍ بين الأخبار المدفوعة")
+    ap.add_argument("--env", action="append", default=[], metavar="KEY=VAL", help="متغير بيئة إضافي للبوت")
+    ap.add_argument("--out", default="bench_results.json")
+    ap.add_argument("--compare", help="ملف نتائج سابق للمقارنة")
+    ap.add_argument("--keep", action="store_true", help="إبقاء مجلد العمل المؤقت")
+    ap.add_argument("--verbose", action="store_true", help="إظهار لوج البوت")
+    args = ap.parse_args()
+
+    result = run(args)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(json.dumps({k: result[k] for k in ("items_per_sec", "peak_rss_mb", "db_bytes")}, ensure_ascii=False))
+    for stage, st in sorted(result["stages"].items()):
+        print(f"  {stage:<10} n={st['n']:<6} p50={st['p50_ms']:>8.1f}ms  p95={st['p95_ms']:>8.1f}ms")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(result, json.load(f))
+
+if __name__ == "__main__":
+    main()
@@ -12,16 +12,44 @@ IraqNews Bot — جامع أخبار العراق بدون أي API للمواق
 • مُركّب منشورات فيسبوك (Facebook Composer) + تنزيل صور og:image تلقائياً.
 • ملفات جاهزة: نص المنشور + الصور في مجلدات منظمة حسب التاريخ.
 • ملف مصادر خارجي اختياري: sources.json.
+• ملف توجيه اختياري profiles.json: عدة مناطق/قنوات من جلب واحد.
 
 ENV:
 - TG_TOKEN / TG_CHAT_ID             : لإرسال تيليجرام (اختياري)
 - DRY_RUN=1                         : يمنع الإرسال ويكتب ملفات فقط
+- TG_API_BASE=https://api.telegram.org : عنوان Bot API (مثلاً خادم محلي للتجربة)
+- TG_CHAT_PER_MIN=20 / TG_CHAT_BURST=3 : حد الرسائل لكل قناة (Token Bucket)
+- TG_GLOBAL_PER_SEC=25              : حد الرسائل الكلي في الثانية
+- OUTBOX_MAX_ATTEMPTS=8             : بعدها تُحفظ الرسالة في latest.md
+- OUTBOX_DRAIN_SECONDS=120          : مهلة تفريغ صندوق الصادر قبل الخروج في --once
 - MAX_ITEMS_PER_SOURCE=30           : حد جلب لكل مصدر
-- POLL_SECONDS=900                  : فترة التكرار عند التشغيل المستمر
+- FEED_MAX_AGE_HOURS=72             : أخبار أقدم من هذا تُهمل قبل أي معالجة (0 = بلا حد؛ الافتراضي = DEDUP_WINDOW_HOURS)
+- HWM_GUIDS=300                     : عدد المعرّفات الأخيرة المحفوظة لكل مصدر (تُتخطى دون معالجة)
+- POLL_SECONDS=900                  : فترة التكرار عند التشغيل المستمر (والفترة الأولى لكل مصدر)
 - AUTO_PIP=1                        : تثبيت تلقائي للحزم الناقصة
-- SIMILARITY_THRESH=0.92            : عتبة تشابه العناوين
+- SIMILARITY_THRESH=0.92            : عتبة تشابه العناوين/النصوص
+- DEDUP_WINDOW_HOURS=72             : نافذة فهرس التشابه (MinHash/LSH) بالساعات
+- DEDUP_BLOOM=1                     : مرشّح Bloom في الذاكرة للروابط/البصمات: "جديد قطعًا" بدون سؤال SQLite
+- BLOOM_ERROR_RATE=0.01             : نسبة الإيجابيات الكاذبة المقبولة (تعني فقط سؤال SQLite)
+- RETENTION_DAYS=0                  : أرشفة الأخبار الأقدم من N يوم إلى ARCHIVE_DB وحذفها؛ 0 = بلا حد
+- ARCHIVE_DB=news_archive.db        : قاعدة الأرشيف (فارغ = حذف بلا أرشفة)
+- VACUUM_DAYS=0                     : VACUUM للقاعدة كل N يوم (0 = أبدًا؛ يحجب الكتابة طوال مدته)؛ python news_bot.py --compact للتشغيل الآن
 - OUT_DIR=news_out                  : مجلد المخرجات
 - FETCH_TIMEOUT=20                  : مهلة الجلب HTTP
+- FEED_MAX_BYTES=5000000            : أقصى حجم يُنزّل من ملف RSS، وأقصى جسم POST يقبله المستقبِل (413)
+- HTTP_POOL_SIZE=10                 : اتصالات keep-alive محفوظة لكل موقع
+- HTTP_PER_HOST=4                   : أقصى طلبات متزامنة لنفس الموقع (كل المسارات)
+- BREAKER_WINDOW=20                 : قاطع لكل موقع (RSS + مقالات + صور): آخر N طلبًا تُحسب منها نسبة الفشل
+- BREAKER_ERROR_RATE=0.5 / BREAKER_MIN_CALLS=5 : يُفتح القاطع عند هذه النسبة (مع حد أدنى من الطلبات)
+- BREAKER_SLOW_SECONDS=10           : طلب أبطأ من هذا يُحتسب فشلًا
+- BREAKER_COOLDOWN=60 / BREAKER_MAX_COOLDOWN=3600 : تبريد أُسّي (×2 لكل فشل للطلب التجريبي) مع تذبذب عشوائي
+- EXTRACT_PROCS=0                   : عمليات الاستخراج (trafilatura/BeautifulSoup) للجهاز كله؛ 0 = تلقائي (الأنوية-1، ولا مجمع على نواة واحدة)، -1 = معطّل
+                                      مع --workers N تُقسم على العمال (تلقائي: (الأنوية-N)/N لكل عامل، أو بلا مجمع)
+- EXTRACT_TIMEOUT=30                : مهلة استخراج الصفحة الواحدة؛ بعدها تُستبدل العمليات (صفحة مرضية)
+- EXTRACT_MAX_TASKS=200             : تُستبدل كل عملية بعد هذا العدد من الصفحات (تسرب الذاكرة)
+  python news_bot.py --extract-dir pages/  : استخراج مجلد صفحات HTML محفوظة إلى JSONL (بدون قاعدة ولا شبكة)
+- PAGE_CACHE_DB=news_cache.db       : كاش صفحات المقالات (HTML مضغوط + النص المستخرج)
+- PAGE_CACHE_TTL=86400 / PAGE_CACHE_MB=200 : عمر الصفحة المخزنة وحجم الكاش الكلي (LRU)
 
 فلترة الأنبار/الرمادي:
 - ANBAR_FILTER=1                    : تفعيل الفلترة
@@ -30,51 +58,150 @@ ENV:
 - STRICT_CITY_ONLY=0                : لو 1 ينشر فقط إن وُجدت مدينة محددة
 - PREFIX_LOCALITY=1                 : يضيف سطر 📍المدينة أعلى البوست إن غابت
 
+ملفات التوجيه (profiles.json، اختياري — بدونه يُبنى ملف واحد من متغيرات الفلترة أعلاه):
+- PROFILES_FILE=profiles.json      : قائمة مثل
+    [{"name": "anbar", "keywords": ["الأنبار", "الرمادي"], "cities": ["الرمادي", "الفلوجة"],
+      "chat_id": "-100...", "facebook_template": "summary", "hashtags": "#أخبار_الأنبار",
+      "dedup_scope": "anbar", "strict_city": false, "default_locality": "الأنبار"}, ...]
+  كل خبر يُطابق كل الملفات بمسح واحد؛ الجلب والاستخراج والصياغة بالذكاء الاصطناعي مرة واحدة للخبر.
+  dedup_scope: الملفات ذات النطاق الواحد لا تنشر نفس الخبر مرتين (الافتراضي = اسم الملف).
+  ملف بلا keywords يقبل كل الأخبار.
+
 ذكاء اصطناعي (اختياري):
 - LLM_BACKEND=openai|ollama|none
 - OPENAI_API_KEY=...               : عند اختيار openai
 - OPENAI_MODEL=gpt-4o-mini         : موديل افتراضي
 - OLLAMA_MODEL=llama3.1            : عند اختيار ollama
+- OPENAI_BASE_URL= / OLLAMA_URL=http://localhost:11434 : عناوين الخدمة (مثلاً خادم محلي للتجربة)
+- LLM_TIMEOUT=60                   : مهلة الطلب الواحد بالثواني
+- LLM_CACHE_DAYS=14 / LLM_CACHE_MAX=5000 : عمر وحجم كاش الصياغات
+- LLM_CYCLE_SECONDS=0 / LLM_CYCLE_TOKENS=0 : ميزانية كل دورة (0 = بلا حد)؛ بعدها يُستخدم القالب الثابت
 
 فيسبوك:
 - FACEBOOK_MODE=1                  : تفعيل توليد منشورات فيسبوك وحفظها
 - FACEBOOK_TEMPLATE=short|summary|qa|bilingual
 - FACEBOOK_MAX_IMAGES=3            : أقصى عدد صور تُرفق
+- IMAGE_MAX_BYTES=8388608          : أقصى حجم للصورة الواحدة
+- IMAGE_MAX_PIXELS=40000000        : أقصى عدد بكسلات (العرض × الارتفاع)
+- IMAGE_CONCURRENCY=4              : تنزيلات صور متزامنة
+  الصور تُحفظ مرة واحدة في images/store حسب sha256 وتُربط (hard link) في مجلد كل منشور
+
+جدولة تكيفية لكل مصدر:
+- ADAPTIVE_POLL=1                  : كل مصدر يُجلب حسب معدل نشره (في --once تُجلب المصادر المستحقة فقط)
+- SCHED_MIN_SECONDS=120 / SCHED_MAX_SECONDS=21600 : حدود الفترة بين جلبين لنفس المصدر
+- SCHED_JITTER=0.15                : تذبذب عشوائي ± على موعد الجلب التالي
+- SCHED_TARGET_RATIO=0.05          : نسبة العناصر الجديدة (قبل الفلترة) المستهدفة في كل جلب (أعلى = الفترة تقصر، أقل = تطول)
+
+خط المعالجة المتوازي (Pipeline):
+- PIPELINE=1                       : جلب ← فلترة ← منع تكرار ← صياغة ← نشر كمراحل متوازية
+- FETCH_CONCURRENCY=8              : أقصى عدد مصادر تُجلب في نفس الوقت
+- PER_HOST_CONCURRENCY=2           : أقصى جلب متزامن لنفس الموقع
+- LLM_CONCURRENCY=2                : أقصى طلبات صياغة متزامنة (في كل الأوضاع)
+- QUEUE_SIZE=50                    : سعة الطوابير بين المراحل (ضغط عكسي)
+- DB_BATCH_ITEMS=20                : عمليات كتابة SQLite لكل commit
+- DB_BATCH_MS=500                  : أقصى تأخير commit بالملّي ثانية
+
+مراقبة الأداء:
+- METRICS_PORT=0                   : منفذ محلي لـ /metrics (Prometheus) و /stats.json؛ 0 = معطّل
+- METRICS_HOST=127.0.0.1           : عنوان الاستماع
+- METRICS_JSON=1                   : كتابة metrics.json في OUT_DIR بعد كل دورة
+- PROFILE_CYCLE=0                  : لو 1 تُحفظ cProfile لكل دورة في OUT_DIR/profiles (أوضح مع PIPELINE=0)
+- PROFILE_KEEP=10                  : عدد ملفات profile المحفوظة
+
+عدة عمّال (نفس الجهاز أو عدة أجهزة على نفس ملف القاعدة):
+- python news_bot.py --workers 4    : 4 عمليات تتقاسم المصادر عبر عقود إيجار في SQLite
+- WORKER_ID=                        : اسم العامل (افتراضيًا host:pid)
+- LEASE_SECONDS=900                 : مدة عقد المصدر؛ بعدها يأخذه عامل آخر إن توقف صاحبه
+- LEASE_REFETCH_SECONDS=60          : لا يجلب عامل آخر المصدر خلال هذه المدة بعد انتهاء جلبه
+- OUTBOX_CLAIM_SECONDS=120          : حجز رسالة الصادر أثناء إرسالها (تُستعاد بعده إن توقف المُرسِل)
+- OUTBOX_SENDER=1                   : 0 = هذا العامل لا يرسل (حدود تيليجرام لكل عملية مُرسِلة)
+  أي نسختين تعملان معًا (مثلاً GitHub Actions + خادم) لا تكرران الجلب ولا النشر.
+
+استقبال الدفع (python news_bot.py --receiver: خادم دائم + الجدولة كاحتياط):
+- WEBSUB_PORT=8088 / WEBSUB_HOST=127.0.0.1 : عنوان المستقبِل
+- WEBSUB_CALLBACK=                  : العنوان العام للمستقبِل (مثل https://bot.example.com)؛ بدونه لا اشتراك في hubs
+- WEBSUB_SECRET=                    : مفتاح HMAC لـ POST /notify (X-Hub-Signature-256: sha256=...)؛ بدونه /notify معطّل (403)
+- WEBSUB_LEASE_SECONDS=864000       : مدة الاشتراك المطلوبة من الـ hub (يُجدَّد قبل انتهائه)
+- WEBSUB_POLL_SECONDS=10800         : أقل فترة جلب دوري لمصدر عليه اشتراك فعّال
+  POST /websub/<id> : تحديثات الـ hub (RSS/Atom موقّع بـ hub.secret)
+  POST /notify      : {"url": "...", "title": "...", "source": "..."} أو {"source": "اسم"} أو RSS خام (?source=اسم)
+
+دمج الأخبار المتلاحقة (Digest):
+- COALESCE_WINDOW=0                : ثوانٍ ينتظرها الخبر المحجوز (مثلاً 90)؛ أخبار نفس المنطقة والحدث خلالها
+                                     تُصاغ بطلب واحد وتُرسل رسالة واحدة بروابط كل المصادر. 0 = معطّل
+- COALESCE_MAX=6                   : أقصى عدد أخبار في الرسالة الواحدة (تُرسل فور الامتلاء)
+- COALESCE_SIMILARITY=0.2          : أقل تشابه كلمات (Jaccard للعنوان + بداية النص) مع أحد أخبار المجموعة
+  في --once تُرسل المجموعات المنتظرة عند نهاية الدورة.
+
+الاستخراج الكسول (النص الكامل يُنزّل بعد الفلترة ومنع التكرار فقط):
+- LAZY_MIN_SUMMARY=120             : ملخص أقصر من هذا لا يكفي لرفض الخبر قبل الاستخراج
+- SKIP_EXTRACT_ON_MATCH=0          : لو 1 لا يُنزّل المقال إن طابق الملخصُ الفلترةَ
 """
 
-import os, re, sys, time, json, html, random, hashlib, sqlite3, logging, difflib, unicodedata
+import os, re, sys, math, time, json, html, hmac, random, hashlib, secrets, sqlite3, logging, difflib, unicodedata, socket
+import asyncio, threading, struct, shutil, zlib, heapq, importlib, bisect, functools, calendar
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
 from urllib.parse import urlparse, urlunparse, parse_qs, urljoin
+_T_START = time.perf_counter()
 
-# ====== تثبيت تلقائي للحزم عند نقصها ======
+# ====== تثبيت تلقائي للحزم عند نقصها (تُستورد عند أول استخدام) ======
 AUTO_PIP = os.getenv("AUTO_PIP", "1") == "1"
+_import_lock = threading.Lock()
+
 def _try_import(name, pip_pkg=None):
     try:
-        return __import__(name)
+        return importlib.import_module(name)
     except Exception:
         if not AUTO_PIP:
             raise
         import subprocess
         pkg = pip_pkg or name
         subprocess.check_call([sys.executable, "-m", "pip", "install", pkg])
-        return __import__(name)
-
-requests   = _try_import("requests")
-feedparser = _try_import("feedparser")
-bs4        = _try_import("bs4", pip_pkg="beautifulsoup4")
-BeautifulSoup = bs4.BeautifulSoup
-try:
-    _try_import("lxml")
-    PARSER = "lxml"
-except Exception:
-    PARSER = "html.parser"
-
-dtparser = _try_import("dateutil.parser", pip_pkg="python-dateutil").parser
-try:
-    trafilatura = _try_import("trafilatura")
-    HAS_TRAF = True
-except Exception:
-    HAS_TRAF = False
+        return importlib.import_module(name)
+
+class LazyModule:
+    # دورة بلا مصادر مستحقة لا تحتاج trafilatura/feedparser/requests، فلا نستوردها إلا عند أول وصول
+    def __init__(self, name: str, pip_pkg: str = None):
+        self._name, self._pip, self._mod = name, pip_pkg, None
+
+    def _load(self):
+        if self._mod is None:
+            with _import_lock:
+                if self._mod is None:
+                    self._mod = _try_import(self._name, self._pip)
+        return self._mod
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+requests    = LazyModule("requests")
+feedparser  = LazyModule("feedparser")
+bs4         = LazyModule("bs4", pip_pkg="beautifulsoup4")
+dtparser    = LazyModule("dateutil.parser", pip_pkg="python-dateutil")
+trafilatura = LazyModule("trafilatura")
+
+_optional = {}
+def _has(name: str) -> bool:
+    # حزم اختيارية: تُفحص مرة واحدة بدون تثبيت تلقائي
+    if name not in _optional:
+        try: importlib.import_module(name); _optional[name] = True
+        except Exception: _optional[name] = False
+    return _optional[name]
+
+def html_parser() -> str:
+    return "lxml" if _has("lxml") else "html.parser"
+
+def BeautifulSoup(markup, features: str = None, **kw):
+    return bs4.BeautifulSoup(markup, features or html_parser(), **kw)
+
+def has_trafilatura() -> bool:
+    if "trafilatura" not in _optional:
+        try: trafilatura._load(); _optional["trafilatura"] = True
+        except Exception: _optional["trafilatura"] = False
+    return _optional["trafilatura"]
 
 # ====== إعدادات عامة ======
 TZ = timezone(timedelta(hours=+3))  # Asia/Baghdad
@@ -85,22 +212,38 @@ USER_AGENTS = [
     "Mozilla/5.0 (X11; Linux x86_64) Gecko/20100101 Firefox/126.0",
 ]
 FETCH_TIMEOUT = int(os.getenv("FETCH_TIMEOUT", "20"))
+FEED_MAX_BYTES = int(os.getenv("FEED_MAX_BYTES", "5000000"))
 POLL_SECONDS = int(os.getenv("POLL_SECONDS", "900"))
 MAX_ITEMS_PER_SOURCE = int(os.getenv("MAX_ITEMS_PER_SOURCE", "30"))
 SIMILARITY_THRESH = float(os.getenv("SIMILARITY_THRESH", "0.92"))
+DEDUP_WINDOW_HOURS = int(os.getenv("DEDUP_WINDOW_HOURS", "72"))
 
 TG_TOKEN = os.getenv("TG_TOKEN", "")
 TG_CHAT_ID = os.getenv("TG_CHAT_ID", "")
 DRY_RUN = os.getenv("DRY_RUN", "0") == "1"
+TG_API_BASE = os.getenv("TG_API_BASE", "https://api.telegram.org").rstrip("/")
+TG_CHAT_PER_MIN = float(os.getenv("TG_CHAT_PER_MIN", "20"))
+TG_CHAT_BURST = int(os.getenv("TG_CHAT_BURST", "3"))
+TG_GLOBAL_PER_SEC = float(os.getenv("TG_GLOBAL_PER_SEC", "25"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_DRAIN_SECONDS = float(os.getenv("OUTBOX_DRAIN_SECONDS", "120"))
+OUTBOX_CLAIM_SECONDS = float(os.getenv("OUTBOX_CLAIM_SECONDS", "120"))
 
 OUT_DIR = os.getenv("OUT_DIR", "news_out")
-os.makedirs(OUT_DIR, exist_ok=True)
 
 # ====== ذكاء اصطناعي ======
 LLM_BACKEND   = os.getenv("LLM_BACKEND", "openai").lower()  # openai|ollama|none
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 OPENAI_MODEL   = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 OLLAMA_MODEL   = os.getenv("OLLAMA_MODEL", "llama3.1")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "")
+OLLAMA_URL     = os.getenv("OLLAMA_URL", "http://localhost:11434").rstrip("/")
+LLM_TIMEOUT    = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_CONCURRENCY = max(1, int(os.getenv("LLM_CONCURRENCY", "2")))
+LLM_CACHE_DAYS = int(os.getenv("LLM_CACHE_DAYS", "14"))
+LLM_CACHE_MAX  = int(os.getenv("LLM_CACHE_MAX", "5000"))
+LLM_CYCLE_SECONDS = float(os.getenv("LLM_CYCLE_SECONDS", "0"))
+LLM_CYCLE_TOKENS  = int(os.getenv("LLM_CYCLE_TOKENS", "0"))
 
 # ====== فلترة الأنبار/الرمادي ======
 ANBAR_FILTER = os.getenv("ANBAR_FILTER", "1") == "1"
@@ -116,40 +259,425 @@ REQUIRED_KEYWORDS = [w.strip() for w in REQ_ENV.split(",") if w.strip()] or [
 CITY_ALIASES = [w.strip() for w in CITY_ENV.split(",") if w.strip()] or REQUIRED_KEYWORDS
 
 # ====== لوج إلى ملف + كونسول ======
+# المعالجات (stdout + bot.log) تُضاف في Bot.start؛ الاستيراد كمكتبة لا يكتب شيئًا
 logger = logging.getLogger("iraqnews")
 logger.setLevel(logging.INFO)
 fmt = logging.Formatter('[%(asctime)s] %(levelname)s: %(message)s')
-ch = logging.StreamHandler(sys.stdout); ch.setFormatter(fmt); logger.addHandler(ch)
-fh = logging.FileHandler(os.path.join(OUT_DIR, 'bot.log'), encoding='utf-8'); fh.setFormatter(fmt); logger.addHandler(fh)
 
 # ====== قاعدة البيانات ======
-conn = sqlite3.connect(DB_PATH)
-conn.execute("PRAGMA journal_mode=WAL;")
-conn.execute("""
-CREATE TABLE IF NOT EXISTS items (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    source TEXT,
-    title TEXT,
-    url TEXT,
-    published_at TEXT,
-    title_hash TEXT,
-    content_hash TEXT,
-    created_at TEXT
-);""")
-conn.execute("CREATE INDEX IF NOT EXISTS idx_items_url ON items(url);")
-conn.execute("CREATE INDEX IF NOT EXISTS idx_items_titlehash ON items(title_hash);")
-conn.execute("""
-CREATE TABLE IF NOT EXISTS sources (
-    name TEXT PRIMARY KEY,
-    failures INTEGER DEFAULT 0,
-    disabled_until TEXT
-);""")
-conn.execute("""
-CREATE TABLE IF NOT EXISTS meta (
-    key TEXT PRIMARY KEY,
-    val TEXT
-);""")
-conn.commit()
+# الاتصال مشترك بين خيوط الـ pipeline؛ كل وصول للقاعدة يمر عبر db_lock. يُفتح في Bot.start
+conn = None
+db_lock = threading.RLock()
+
+def init_db(path: str = DB_PATH) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        source TEXT,
+        title TEXT,
+        url TEXT,
+        published_at TEXT,
+        title_hash TEXT,
+        content_hash TEXT,
+        created_at TEXT,
+        status TEXT DEFAULT 'sent'
+    );""")
+    if "status" not in [r[1] for r in conn.execute("PRAGMA table_info(items)")]:
+        # pending = محجوز قبل الإرسال، sent = أُرسل، md = فشل الإرسال وحُفظ في latest.md
+        # queued = في الصادر، held = في نافذة الدمج، recovering = أعاده recover_claimed بعد توقف عامل
+        conn.execute("ALTER TABLE items ADD COLUMN status TEXT DEFAULT 'sent';")
+    if "scope" not in [r[1] for r in conn.execute("PRAGMA table_info(items)")]:
+        # نطاق منع التكرار (profiles.json)؛ '' = الملف الافتراضي
+        conn.execute("ALTER TABLE items ADD COLUMN scope TEXT DEFAULT '';")
+    if "digest_id" not in [r[1] for r in conn.execute("PRAGMA table_info(items)")]:
+        # خبر أُرسل ضمن رسالة مجمّعة (COALESCE_WINDOW): معرّف الخبر الأول فيها؛ حالته تتبع حالتها
+        conn.execute("ALTER TABLE items ADD COLUMN digest_id INTEGER;")
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name='ux_items_url_scope'").fetchone():
+        # قيود UNIQUE تسمح بـ INSERT OR IGNORE بدل قراءة ثم كتابة؛ تُحذف أي نسخ قديمة مكررة أولًا.
+        # العمود الأول هو البصمة حتى يخدم الفهرس البحث بها عبر كل النطاقات
+        for col in ("url", "title_hash", "content_hash"):
+            conn.execute(f"""DELETE FROM items WHERE {col} IS NOT NULL AND id NOT IN
+                             (SELECT MIN(id) FROM items WHERE {col} IS NOT NULL GROUP BY {col}, scope)""")
+        for old in ("idx_items_url", "idx_items_titlehash", "ux_items_url", "ux_items_titlehash", "ux_items_contenthash"):
+            conn.execute(f"DROP INDEX IF EXISTS {old};")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_items_url_scope ON items(url, scope);")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_items_titlehash_scope ON items(title_hash, scope);")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_items_contenthash_scope ON items(content_hash, scope);")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_items_created ON items(created_at);")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_items_digest ON items(digest_id) WHERE digest_id IS NOT NULL;")
+    # محجوز لم يصل للصادر بعد (held = في نافذة الدمج)؛ يخدم recover_claimed دون مسح الجدول
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_items_unsent ON items(created_at)
+                    WHERE status IN ('pending','held','recovering');""")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS sources (
+        name TEXT PRIMARY KEY,
+        failures INTEGER DEFAULT 0,
+        disabled_until TEXT
+    );""")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS feed_state (
+        url TEXT PRIMARY KEY,
+        etag TEXT,
+        last_modified TEXT,
+        checked_at TEXT
+    );""")
+    # فهرس التشابه: نص الخبر المُطبّع + مفاتيح أحزمة LSH لكل من العنوان (t) والنص (b)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS nd_docs (
+        item_id INTEGER PRIMARY KEY,
+        title TEXT,
+        body TEXT,
+        created_at TEXT
+    );""")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS nd_bands (
+        band_key INTEGER,
+        item_id INTEGER
+    );""")
+    if "scope" not in [r[1] for r in conn.execute("PRAGMA table_info(nd_docs)")]:
+        conn.execute("ALTER TABLE nd_docs ADD COLUMN scope TEXT DEFAULT '';")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_nd_bands_key ON nd_bands(band_key);")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_nd_bands_item ON nd_bands(item_id);")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_nd_docs_created ON nd_docs(created_at);")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS llm_cache (
+        key TEXT PRIMARY KEY,
+        text TEXT,
+        source TEXT,
+        url TEXT,
+        created_at TEXT,
+        used_at TEXT
+    );""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_used ON llm_cache(used_at);")
+    # صندوق صادر تيليجرام: الجمع يكتب هنا والمُرسِل (Dispatcher) يرسل بمعدل تيليجرام
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        item_id INTEGER,
+        chat_id TEXT,
+        text TEXT,
+        status TEXT DEFAULT 'pending',
+        attempts INTEGER DEFAULT 0,
+        next_ts REAL,
+        created_ts REAL,
+        sent_ts REAL,
+        latency_ms INTEGER,
+        last_error TEXT
+    );""")
+    if "owner" not in [r[1] for r in conn.execute("PRAGMA table_info(outbox)")]:
+        # status='sending' + owner + next_ts = مهلة الحجز: عامل واحد فقط يرسل الرسالة
+        conn.execute("ALTER TABLE outbox ADD COLUMN owner TEXT;")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox(status, next_ts);")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_item ON outbox(item_id);")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS host_breakers (
+        host TEXT PRIMARY KEY,
+        state TEXT,
+        cooldown REAL,
+        open_until REAL,
+        trips INTEGER DEFAULT 0,
+        updated_at REAL
+    );""")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS websub_subs (
+        topic TEXT PRIMARY KEY,
+        source TEXT,
+        hub TEXT,
+        sid TEXT,
+        secret TEXT,
+        state TEXT,
+        lease_until REAL,
+        updated_at REAL
+    );""")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS source_leases (
+        name TEXT PRIMARY KEY,
+        owner TEXT,
+        expires REAL,
+        done_at REAL
+    );""")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS source_hwm (
+        name TEXT PRIMARY KEY,
+        last_guid TEXT,
+        last_published REAL,
+        guids TEXT,
+        updated_at REAL
+    );""")
+    if "retry" not in [r[1] for r in conn.execute("PRAGMA table_info(source_hwm)")]:
+        # {gid: محاولات} لأخبار فشل تنزيل مقالها قبل الحكم عليها: تُعاد في الجلب التالي
+        conn.execute("ALTER TABLE source_hwm ADD COLUMN retry TEXT;")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS source_sched (
+        name TEXT PRIMARY KEY,
+        interval_s REAL,
+        next_due REAL,
+        new_ratio REAL DEFAULT 0,
+        pub_gap REAL,
+        fetches INTEGER DEFAULT 0,
+        last_fetch REAL
+    );""")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        val TEXT
+    );""")
+    conn.commit()
+    return conn
+
+# ====== كاتب SQLite مُجمّع ======
+# الكتابات تُنفَّذ فورًا داخل معاملة مفتوحة (فتراها القراءات على نفس الاتصال) والـ commit
+# (أي fsync) يحدث مرة لكل دفعة: نهاية مصدر، أو DB_BATCH_ITEMS عملية، أو DB_BATCH_MS ملّي ثانية
+DB_BATCH_ITEMS = max(1, int(os.getenv("DB_BATCH_ITEMS", "20")))
+DB_BATCH_MS = int(os.getenv("DB_BATCH_MS", "500"))
+
+class DbWriter:
+    def __init__(self, conn, lock, max_ops: int = DB_BATCH_ITEMS, max_ms: int = DB_BATCH_MS):
+        self.conn, self.lock = conn, lock
+        self.max_ops, self.max_ms = max_ops, max_ms
+        self.ops, self.started = 0, 0.0
+
+    def execute(self, sql: str, params=()):
+        with self.lock:
+            if not self.ops: self.started = time.monotonic()
+            self.ops += 1
+            return self.conn.execute(sql, params)
+
+    def executemany(self, sql: str, rows):
+        with self.lock:
+            if not self.ops: self.started = time.monotonic()
+            self.ops += 1
+            return self.conn.executemany(sql, rows)
+
+    def begin_immediate(self):
+        # يحجز قفل الكتابة قبل "فحص ثم إدراج" فلا تُدخل عملية أخرى نفس الخبر بينهما؛ يُحرر مع flush
+        # (المستدعي يثبّت فورًا: لا تبقى المعاملة مفتوحة أثناء أي تنزيل)
+        with self.lock:
+            if not self.conn.in_transaction:
+                self.conn.execute("BEGIN IMMEDIATE")
+            if not self.ops: self.started = time.monotonic()
+            self.ops += 1
+
+    def due(self) -> bool:
+        return bool(self.ops) and (self.ops >= self.max_ops or (time.monotonic() - self.started) * 1000 >= self.max_ms)
+
+    def maybe_flush(self) -> bool:
+        with self.lock:
+            if not self.due(): return False
+            self.flush(); return True
+
+    def flush(self):
+        with self.lock:
+            if self.ops:
+                self.conn.commit()
+                self.ops = 0
+
+WRITER = None  # يُنشأ في Bot.start
+
+# ====== مقاييس: عدّادات + هستوغرامات (Prometheus / JSON) ======
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_JSON = os.getenv("METRICS_JSON", "1") == "1"
+PROFILE_CYCLE = os.getenv("PROFILE_CYCLE", "0") == "1"
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "10"))
+HIST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _labels(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _prom_labels(labels, extra: str = "") -> str:
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+    parts = [f'{k}="{esc(v)}"' for k, v in labels]
+    if extra: parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Metrics:
+    # أسماء بدون بادئة؛ عند التصدير تصبح newsbot_<name>. عدّاد = ينتهي بـ _total
+    def __init__(self, prefix: str = "newsbot", buckets: tuple = HIST_BUCKETS):
+        self.prefix, self.buckets = prefix, buckets
+        self.counters = defaultdict(float)  # (name, labels) -> value
+        self.hists = {}                     # (name, labels) -> {"b": [..], "sum", "count"}
+        self.gauges = {}                    # name -> fn() -> رقم أو [(labels dict, رقم)]
+        self.lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        with self.lock:
+            self.counters[(name, _labels(labels))] += value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, _labels(labels))
+        with self.lock:
+            h = self.hists.get(key)
+            if h is None:
+                h = self.hists[key] = {"b": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            h["b"][bisect.bisect_left(self.buckets, seconds)] += 1
+            h["sum"] += seconds; h["count"] += 1
+
+    @contextmanager
+    def time(self, name: str, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0, **labels)
+
+    def gauge(self, name: str, fn):
+        self.gauges[name] = fn
+
+    def _gauge_rows(self, fn) -> list:
+        try: v = fn()
+        except Exception: return []
+        return [(_labels(l), x) for l, x in v] if isinstance(v, list) else [((), v)]
+
+    def _quantile(self, h: dict, q: float) -> float:
+        # الحد الأعلى للسلة التي تقع فيها النسبة المئوية (تقدير Prometheus نفسه)
+        need, seen = q * h["count"], 0
+        for i, n in enumerate(h["b"]):
+            seen += n
+            if n and seen >= need:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return 0.0
+
+    def counter_values(self) -> dict:
+        with self.lock:
+            return dict(self.counters)
+
+    def snapshot(self, since: dict = None) -> dict:
+        # since: counter_values() سابقة لحساب فرق الدورة الحالية
+        since = since or {}
+        with self.lock:
+            counters = [{"name": n, "labels": dict(l), "value": v - since.get((n, l), 0)}
+                        for (n, l), v in sorted(self.counters.items())]
+            hists = [{"name": n, "labels": dict(l), "count": h["count"], "sum": round(h["sum"], 4),
+                      "p50": self._quantile(h, 0.5), "p95": self._quantile(h, 0.95)}
+                     for (n, l), h in sorted(self.hists.items())]
+        gauges = [{"name": n, "labels": dict(l), "value": v}
+                  for n, fn in sorted(self.gauges.items()) for l, v in self._gauge_rows(fn)]
+        return {"counters": [c for c in counters if c["value"]], "histograms": hists, "gauges": gauges}
+
+    def prometheus(self) -> str:
+        out, p = [], self.prefix
+        with self.lock:
+            counters = sorted(self.counters.items()); hists = sorted((k, dict(h, b=list(h["b"]))) for k, h in self.hists.items())
+        typed = set()
+        for (n, l), v in counters:
+            if n not in typed: out.append(f"# TYPE {p}_{n} counter"); typed.add(n)
+            out.append(f"{p}_{n}{_prom_labels(l)} {v:g}")
+        for (n, l), h in hists:
+            if n not in typed: out.append(f"# TYPE {p}_{n} histogram"); typed.add(n)
+            acc = 0
+            for le, c in zip([f"{b:g}" for b in self.buckets] + ["+Inf"], h["b"]):
+                acc += c
+                out.append(f"{p}_{n}_bucket{_prom_labels(l, 'le=' + json.dumps(le))} {acc}")
+            out.append(f"{p}_{n}_sum{_prom_labels(l)} {h['sum']:.6f}")
+            out.append(f"{p}_{n}_count{_prom_labels(l)} {h['count']}")
+        for n, fn in sorted(self.gauges.items()):
+            out.append(f"# TYPE {p}_{n} gauge")
+            for l, v in self._gauge_rows(fn):
+                out.append(f"{p}_{n}{_prom_labels(l)} {v:g}")
+        return "\n".join(out) + "\n"
+
+METRICS = Metrics()
+
+def timed(name: str = None):
+    # مُزخرف: هستوغرام call_seconds{fn} + عدّاد call_errors_total{fn}
+    def deco(fn):
+        label = name or fn.__name__
+        @functools.wraps(fn)
+        def wrapper(*a, **kw):
+            t0 = time.perf_counter()
+            try:
+                return fn(*a, **kw)
+            except Exception:
+                METRICS.inc("call_errors_total", fn=label); raise
+            finally:
+                METRICS.observe("call_seconds", time.perf_counter() - t0, fn=label)
+        return wrapper
+    return deco
+
+def metrics_serve(host: str = METRICS_HOST, port: int = METRICS_PORT):
+    # خادم محلي في خيط: /metrics (نص Prometheus) و /stats.json
+    import http.server
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def log_message(self, *a): pass
+        def do_GET(self):
+            if self.path.startswith("/metrics"):
+                body, ctype = METRICS.prometheus().encode(), "text/plain; version=0.0.4; charset=utf-8"
+            elif self.path.startswith("/stats.json"):
+                body, ctype = json.dumps(METRICS.snapshot(), ensure_ascii=False).encode(), "application/json"
+            else:
+                self.send_response(404); self.end_headers(); return
+            self.send_response(200)
+            self.send_header("Content-Type", ctype); self.send_header("Content-Length", str(len(body)))
+            self.end_headers(); self.wfile.write(body)
+    srv = http.server.ThreadingHTTPServer((host, port), Handler)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, name="metrics", daemon=True).start()
+    logger.info(f"[METRICS] http://{host}:{srv.server_address[1]}/metrics")
+    return srv
+
+def metrics_write_cycle(since: dict, cycle: dict):
+    if not METRICS_JSON: return
+    snap = {"cycle": cycle, "at": datetime.now(TZ).isoformat(), **METRICS.snapshot(since)}
+    path = os.path.join(OUT_DIR, "metrics.json")
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(snap, f, ensure_ascii=False, indent=1)
+    os.replace(path + ".tmp", path)
+
+def profile_dump(prof):
+    import pstats, io
+    d = os.path.join(OUT_DIR, "profiles"); ensure_dir(d)
+    stamp = datetime.now(TZ).strftime("%Y%m%d-%H%M%S")
+    prof.dump_stats(os.path.join(d, f"cycle-{stamp}.prof"))
+    buf = io.StringIO()
+    pstats.Stats(prof, stream=buf).sort_stats("cumulative").print_stats(40)
+    with open(os.path.join(d, f"cycle-{stamp}.txt"), "w", encoding="utf-8") as f:
+        f.write(buf.getvalue())
+    for old in sorted(os.listdir(d))[:-2 * PROFILE_KEEP]:
+        os.remove(os.path.join(d, old))
+    logger.info(f"[PROFILE] {d}/cycle-{stamp}.prof")
+
+# ====== توقيت المراحل (لـ bench.py ومقارنة التغييرات) ======
+STAGE_SAMPLES = int(os.getenv("STAGE_SAMPLES", "5000"))
+
+class StageTimings:
+    # آخر STAGE_SAMPLES قياسًا لكل مرحلة: fetch, relevance, dedup, extract, llm, send, facebook
+    def __init__(self, keep: int = STAGE_SAMPLES):
+        self.keep = keep
+        self.samples = defaultdict(lambda: deque(maxlen=self.keep))
+        self.lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float):
+        with self.lock:
+            self.samples[stage].append(seconds)
+        METRICS.observe("stage_seconds", seconds, stage=stage)
+
+    @contextmanager
+    def time(self, stage: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - t0)
+
+    def summary(self) -> dict:
+        out = {}
+        with self.lock:
+            for stage, xs in self.samples.items():
+                xs = sorted(xs)
+                if not xs: continue
+                pct = lambda q: xs[min(len(xs) - 1, int(q * len(xs)))] * 1000
+                out[stage] = {"n": len(xs), "p50_ms": round(pct(0.50), 2), "p95_ms": round(pct(0.95), 2),
+                              "max_ms": round(xs[-1] * 1000, 2), "total_s": round(sum(xs), 3)}
+        return out
+
+    def reset(self):
+        with self.lock:
+            self.samples.clear()
+
+TIMINGS = StageTimings()
 
 # ====== أدوات ======
 def ensure_dir(p: str): os.makedirs(p, exist_ok=True)
@@ -168,7 +696,9 @@ def text_hash(s: str) -> str:
 
 def is_similar(a: str, b: str, thresh: float = SIMILARITY_THRESH) -> bool:
     try:
-        return difflib.SequenceMatcher(None, a.strip(), b.strip()).ratio() >= thresh
+        sm = difflib.SequenceMatcher(None, a.strip(), b.strip())
+        # الحدود العليا الرخيصة أولًا؛ ratio() مكلفة على النصوص الطويلة
+        return sm.real_quick_ratio() >= thresh and sm.quick_ratio() >= thresh and sm.ratio() >= thresh
     except Exception:
         return False
 
@@ -193,217 +723,1455 @@ def slugify(s: str, maxlen: int = 60) -> str:
     return (s[:maxlen]).strip("-") or "post"
 
 # ====== صحة المصادر ======
+# تُحمّل كل الصفوف مرة في بداية الدورة؛ التحديثات تُكتب للذاكرة وعبر WRITER
+_health = {}
+
+def health_load():
+    with db_lock:
+        rows = conn.execute("SELECT name, failures, disabled_until FROM sources").fetchall()
+    _health.clear()
+    for name, fails, until in rows:
+        try: until = dtparser.parse(until) if until else None
+        except Exception: until = None
+        _health[name] = [fails or 0, until]
+
 def source_is_disabled(name: str) -> bool:
-    row = conn.execute("SELECT disabled_until FROM sources WHERE name=?", (name,)).fetchone()
-    if not row or not row[0]: return False
-    try: return dtparser.parse(row[0]) > datetime.now(TZ)
-    except Exception: return False
+    until = _health.get(name, [0, None])[1]
+    return bool(until and until > datetime.now(TZ))
 
 def source_mark_ok(name: str):
-    conn.execute("""INSERT INTO sources(name, failures, disabled_until) VALUES(?,0,NULL)
-                    ON CONFLICT(name) DO UPDATE SET failures=0, disabled_until=NULL""",(name,))
-    conn.commit()
+    _health[name] = [0, None]
+    WRITER.execute("""INSERT INTO sources(name, failures, disabled_until) VALUES(?,0,NULL)
+                      ON CONFLICT(name) DO UPDATE SET failures=0, disabled_until=NULL""",(name,))
 
 def source_mark_fail(name: str, cool_minutes: int = 180):
-    row = conn.execute("SELECT failures FROM sources WHERE name=?", (name,)).fetchone()
-    fails = (row[0] if row else 0) + 1
+    fails = _health.get(name, [0, None])[0] + 1
     disabled_until = None
     if fails >= 3:
-        disabled_until = (datetime.now(TZ) + timedelta(minutes=cool_minutes)).isoformat()
+        disabled_until = datetime.now(TZ) + timedelta(minutes=cool_minutes)
         logger.warning(f"[SOURCE] تعطيل مؤقت '{name}' لـ {cool_minutes} دقيقة بعد {fails} فشل")
-    conn.execute("""INSERT INTO sources(name, failures, disabled_until) VALUES(?,?,?)
-                    ON CONFLICT(name) DO UPDATE SET failures=?, disabled_until=?""",
-                 (name, fails, disabled_until, fails, disabled_until))
-    conn.commit()
+    _health[name] = [fails, disabled_until]
+    until_s = disabled_until.isoformat() if disabled_until else None
+    WRITER.execute("""INSERT INTO sources(name, failures, disabled_until) VALUES(?,?,?)
+                      ON CONFLICT(name) DO UPDATE SET failures=?, disabled_until=?""",
+                   (name, fails, until_s, fails, until_s))
+
+# ====== HTTP: عميل مشترك (keep-alive + ضغط + حد لكل موقع) مع إعادة المحاولة ======
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+HTTP_PER_HOST = max(1, int(os.getenv("HTTP_PER_HOST", "4")))
+
+def _read_capped(resp, max_bytes: int, sink=None) -> bytes:
+    # sink(chunk): كتابة متدفقة بدل تجميع الجسم في الذاكرة (يرمي استثناء ليوقف التنزيل)
+    if sink is not None:
+        for chunk in resp.iter_content(64 * 1024): sink(chunk)
+        return b""
+    buf = bytearray()
+    for chunk in resp.iter_content(64 * 1024):
+        buf += chunk
+        if max_bytes and len(buf) >= max_bytes:
+            logger.warning(f"[HTTP] body capped at {max_bytes} bytes: {resp.url}")
+            return bytes(buf[:max_bytes])
+    return bytes(buf)
+
+def _retry_after(resp) -> float:
+    try: return float(resp.headers.get("Retry-After", ""))
+    except Exception: return 0.0
+
+# ====== قاطع دائرة لكل موقع: closed → open (تبريد أُسّي) → half_open (طلب تجريبي واحد) → closed ======
+BREAKER_WINDOW = max(1, int(os.getenv("BREAKER_WINDOW", "20")))
+BREAKER_MIN_CALLS = max(1, int(os.getenv("BREAKER_MIN_CALLS", "5")))
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+BREAKER_SLOW_SECONDS = float(os.getenv("BREAKER_SLOW_SECONDS", "10"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "60"))
+BREAKER_MAX_COOLDOWN = float(os.getenv("BREAKER_MAX_COOLDOWN", "3600"))
+
+class CircuitOpen(Exception):
+    pass
+
+class HostBreakers:
+    # الحالة (state/cooldown/open_until) تُحفظ في host_breakers عند كل انتقال فتبقى بعد إعادة التشغيل؛
+    # نافذة النتائج في الذاكرة فقط
+    STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hosts = {}
+
+    def _get(self, host: str) -> dict:
+        b = self.hosts.get(host)
+        if b is None:
+            b = self.hosts[host] = {"state": "closed", "cooldown": 0.0, "open_until": 0.0, "trips": 0,
+                                    "window": deque(maxlen=BREAKER_WINDOW), "probing": False}
+        return b
+
+    def load(self):
+        with db_lock:
+            rows = conn.execute("SELECT host, state, cooldown, open_until, trips FROM host_breakers").fetchall()
+        with self.lock:
+            for host, state, cooldown, until, trips in rows:
+                b = self._get(host)
+                b.update(state=state or "closed", cooldown=cooldown or 0.0, open_until=until or 0.0, trips=trips or 0)
+                if b["state"] == "half_open": b["state"] = "open"  # التجربة انقطعت مع العملية السابقة
+
+    def _save(self, host: str, b: dict):
+        if WRITER is None: return
+        WRITER.execute("""INSERT INTO host_breakers(host, state, cooldown, open_until, trips, updated_at) VALUES(?,?,?,?,?,?)
+                          ON CONFLICT(host) DO UPDATE SET state=excluded.state, cooldown=excluded.cooldown,
+                          open_until=excluded.open_until, trips=excluded.trips, updated_at=excluded.updated_at""",
+                       (host, b["state"], b["cooldown"], b["open_until"], b["trips"], time.time()))
+        WRITER.flush()  # يُستدعى من وسط طلب HTTP: لا تبقى معاملة مفتوحة أثناء التنزيل
+
+    def allow(self, host: str) -> bool:
+        with self.lock:
+            b = self._get(host)
+            if b["state"] == "closed": return True
+            if b["state"] == "open" and time.time() >= b["open_until"]:
+                b["state"] = "half_open"; b["probing"] = False
+            if b["state"] == "half_open" and not b["probing"]:
+                b["probing"] = True
+                logger.info(f"[BREAKER] {host}: half-open, probing")
+                return True
+        METRICS.inc("breaker_rejected_total", host=host)
+        return False
+
+    def record(self, host: str, ok: bool, seconds: float):
+        ok = ok and seconds < BREAKER_SLOW_SECONDS
+        with self.lock:
+            b = self._get(host)
+            if b["state"] == "half_open":
+                if ok:
+                    b.update(state="closed", cooldown=0.0, open_until=0.0, probing=False); b["window"].clear()
+                    logger.info(f"[BREAKER] {host}: closed after successful probe")
+                    self._save(host, b)
+                else:
+                    self._trip(host, b)
+                return
+            w = b["window"]; w.append(ok)
+            if b["state"] == "closed" and len(w) >= BREAKER_MIN_CALLS and w.count(False) / len(w) >= BREAKER_ERROR_RATE:
+                self._trip(host, b)
+
+    def _trip(self, host: str, b: dict):
+        b["cooldown"] = min(BREAKER_MAX_COOLDOWN, b["cooldown"] * 2 if b["cooldown"] else BREAKER_COOLDOWN)
+        wait = b["cooldown"] * random.uniform(0.8, 1.2)  # تذبذب: لا تعود كل المواقع في نفس اللحظة
+        b.update(state="open", open_until=time.time() + wait, probing=False, trips=b["trips"] + 1)
+        b["window"].clear()
+        METRICS.inc("breaker_trips_total", host=host)
+        logger.warning(f"[BREAKER] {host}: open for {wait:.0f}s (trip #{b['trips']})")
+        self._save(host, b)
 
-# ====== HTTP مع إعادة المحاولة ======
+    def state_rows(self) -> list:
+        # للـ gauge: 0 closed / 1 half_open / 2 open (المواقع غير المغلقة فقط)
+        with self.lock:
+            return [({"host": h}, self.STATES[b["state"]]) for h, b in self.hosts.items() if b["state"] != "closed"]
+
+BREAKERS = HostBreakers()
+
+class HttpClient:
+    # جلسة واحدة لكل البوت: مجمع اتصالات لكل موقع يُعاد استخدامه بدل TCP+TLS جديد لكل طلب
+    RETRY_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+    def __init__(self, pool_size: int = HTTP_POOL_SIZE, per_host: int = HTTP_PER_HOST):
+        self.pool_size, self.per_host = pool_size, per_host
+        self._session = None
+        self._sems = {}; self._sems_lock = threading.Lock()
+
+    @property
+    def session(self):
+        # الجلسة (واستيراد requests) عند أول طلب فقط
+        if self._session is None:
+            with self._sems_lock:
+                if self._session is None:
+                    sess = requests.Session()
+                    adapter = requests.adapters.HTTPAdapter(pool_connections=64, pool_maxsize=self.pool_size, max_retries=0)
+                    sess.mount("http://", adapter); sess.mount("https://", adapter)
+                    # brotli: يكفي وجوده ليفك urllib3 ضغط br
+                    sess.headers["Accept-Encoding"] = "gzip, deflate, br" if _has("brotli") else "gzip, deflate"
+                    self._session = sess
+        return self._session
+
+    def _host_sem(self, url: str):
+        host = urlparse(url).netloc
+        with self._sems_lock:
+            if host not in self._sems:
+                self._sems[host] = threading.BoundedSemaphore(self.per_host)
+            return self._sems[host]
+
+    def request(self, method: str, url: str, tries: int = 3, timeout: float = FETCH_TIMEOUT,
+                headers: dict = None, max_bytes: int = 0, check: bool = True, sink=None, **kw):
+        # يعيد Response مقروء الجسم؛ يُعاد المحاولة على أخطاء الشبكة و 429/5xx فقط مع تراجع أُسّي.
+        # القاطع على GET فقط (RSS/مقالات/صور)؛ POST لتيليجرام والذكاء الاصطناعي لها حدودها الخاصة
+        last = None
+        host = urlparse(url).netloc
+        breaker = method == "GET"
+        streamed = [0]
+        def counted(chunk):
+            streamed[0] += len(chunk); sink(chunk)
+        for i in range(tries):
+            if breaker and not BREAKERS.allow(host):
+                raise CircuitOpen(f"circuit open for {host}" + (f" (last: {last})" if last else ""))
+            hdrs = {"User-Agent": random.choice(USER_AGENTS)}
+            hdrs.update(headers or {})
+            wait = 0.0
+            t0 = time.perf_counter()
+            try:
+                with self._host_sem(url):
+                    with self.session.request(method, url, headers=hdrs, timeout=timeout, stream=True, **kw) as resp:
+                        ok_body = resp.status_code < 300 or sink is None
+                        resp._content = _read_capped(resp, max_bytes, counted if ok_body and sink else None) if resp.status_code != 304 else b""
+                METRICS.observe("http_request_seconds", time.perf_counter() - t0, host=host)
+                METRICS.inc("http_requests_total", host=host, code=resp.status_code)
+                METRICS.inc("http_bytes_total", len(resp._content) + streamed[0], host=host)
+                if breaker: BREAKERS.record(host, resp.status_code not in self.RETRY_STATUS, time.perf_counter() - t0)
+                if resp.status_code not in self.RETRY_STATUS or i == tries - 1:
+                    if check and resp.status_code != 304: resp.raise_for_status()
+                    return resp
+                last = requests.HTTPError(f"{resp.status_code} for {url}", response=resp)
+                wait = _retry_after(resp)
+            except requests.HTTPError:
+                raise
+            except Exception as ex:
+                METRICS.inc("http_requests_total", host=host, code="error")
+                # وصلت بايتات = الموقع يستجيب (الخطأ من sink: صورة كبيرة/ليست صورة)
+                if breaker: BREAKERS.record(host, bool(streamed[0]), time.perf_counter() - t0)
+                last = ex
+            if i < tries - 1:
+                time.sleep(min(30, max(wait, 2 ** i + random.random())))
+        raise last
+
+    def get(self, url: str, **kw):
+        return self.request("GET", url, **kw)
+
+    def post(self, url: str, **kw):
+        return self.request("POST", url, **kw)
+
+HTTP = HttpClient()
+
+def http_fetch(url: str, tries: int = 3, timeout: int = FETCH_TIMEOUT, headers: dict = None, max_bytes: int = 0):
+    # يعيد Response كاملًا (الحالة + الترويسات)؛ 304 يُعاد كما هو بدون جسم
+    return HTTP.get(url, tries=tries, timeout=timeout, headers=headers, max_bytes=max_bytes)
+
+@timed()
 def http_get(url: str, tries: int = 3, timeout: int = FETCH_TIMEOUT) -> str:
-    last = None
-    for i in range(tries):
-        try:
-            ua = random.choice(USER_AGENTS)
-            resp = requests.get(url, headers={"User-Agent": ua}, timeout=timeout)
-            resp.raise_for_status()
-            return resp.text
-        except Exception as ex:
-            last = ex
-            time.sleep(min(5, 1.5 ** i + random.random()))
-    raise last
+    return http_fetch(url, tries=tries, timeout=timeout).text
+
+# ====== GET شرطي للـ RSS (ETag / Last-Modified) ======
+def feed_validators(url: str):
+    with db_lock:
+        row = conn.execute("SELECT etag, last_modified FROM feed_state WHERE url=?", (url,)).fetchone()
+    return row or (None, None)
+
+def feed_validators_save(url: str, etag, last_modified):
+    WRITER.execute("""INSERT INTO feed_state(url, etag, last_modified, checked_at) VALUES(?,?,?,?)
+                      ON CONFLICT(url) DO UPDATE SET etag=excluded.etag, last_modified=excluded.last_modified,
+                                                     checked_at=excluded.checked_at""",
+                   (url, etag, last_modified, datetime.now(TZ).isoformat()))
 
 # ====== جلب من RSS/Scrape ======
+@timed()
 def fetch_rss(src: dict):
+    # يعيد None إذا لم يتغير الملف منذ آخر جلب (304)
+    etag, last_modified = feed_validators(src["url"])
+    cond = {}
+    if etag: cond["If-None-Match"] = etag
+    if last_modified: cond["If-Modified-Since"] = last_modified
+    resp = http_fetch(src["url"], headers=cond, max_bytes=FEED_MAX_BYTES)
+    if resp.status_code == 304:
+        return None
+    parsed = feedparser.parse(resp.content, response_headers={k.lower(): v for k, v in resp.headers.items()})
+    feed_validators_save(src["url"], resp.headers.get("ETag"), resp.headers.get("Last-Modified"))
+    websub_discover(src, parsed)
+    return feed_items(src, parsed)
+
+def feed_items(src: dict, parsed, observe: bool = True) -> list:
+    # عناصر ملف RSS/Atom محلَّل (جلب دوري أو دفع من hub)؛ observe=False للدفع: لا يؤثر في تقدير الجدولة
     items = []
-    parsed = feedparser.parse(src["url"])
-    for e in parsed.entries[:MAX_ITEMS_PER_SOURCE]:
+    name = src["name"]
+    entries = parsed.entries[:MAX_ITEMS_PER_SOURCE]
+    stamps = [_entry_ts(e) for e in entries]
+    mark = hwm_load(name)
+    # ملف مرتب زمنيًا (الأحدث أولًا): أول معرّف مرئي أو خبر قديم يعني أن الباقي كذلك،
+    # إلا إن بقيت أخبار تنتظر إعادة المحاولة (قد تكون بعد أول مرئي)
+    ordered = len(entries) > 1 and all(stamps) and all(a >= b for a, b in zip(stamps, stamps[1:])) and not mark["pending"]
+    cutoff = time.time() - FEED_MAX_AGE_HOURS * 3600 if FEED_MAX_AGE_HOURS else 0
+    fresh, expired, seen, old = [], [], 0, 0
+    for e, ts in zip(entries, stamps):
+        gid = _guid_key(e)
+        if gid in mark["guids"] or (ts and ts < cutoff):
+            if gid in mark["guids"]: seen += 1
+            else: old += 1
+            if ordered: break
+            continue
+        if hwm_expired(name, mark, gid, e.get("link")):
+            expired.append(gid); continue
+        fresh.append((gid, ts))
         title = norm_title(e.get("title","").strip())
         link = canonical_url(e.get("link","").strip())
         published = parse_time(e.get("published") or e.get("updated"))
         summary = clean_text(e.get("summary",""))
-        # محاولة جلب نص المقال الكامل
-        full = ""
-        if HAS_TRAF and link:
-            try:
-                downloaded = trafilatura.fetch_url(link, timeout=15)
-                if downloaded:
-                    ext = trafilatura.extract(downloaded, include_comments=False, include_images=False) or ""
-                    if len((ext or "").strip()) > 200:
-                        full = clean_text(ext)
-            except Exception:
-                pass
+        # النص الكامل يُجلب لاحقًا (extract_item) للأخبار التي تجتاز الفلترة فقط
         items.append({
             "source": src["name"],
             "title": title,
             "url": link,
             "published_at": published.isoformat() if published else "",
-            "summary": (full or summary)[:1500]
+            "summary": summary[:1500],
+            "_gid": gid,
         })
+    hwm_save(name, mark, fresh, expired)
+    if observe: sched_observe(name, len(entries), [t for t in stamps if t], hwm_new(mark, fresh))
+    METRICS.inc("feed_entries_total", len(fresh), source=name, kind="new")
+    if seen: METRICS.inc("feed_entries_total", seen, source=name, kind="seen")
+    if old: METRICS.inc("feed_entries_total", old, source=name, kind="old")
+    if seen or old:
+        logger.info(f"{name}: {len(fresh)} new, {seen} seen, {old} old{' (stopped early)' if ordered else ''}")
     return items
 
+@timed()
 def fetch_scrape(src: dict):
     html_text = http_get(src["url"])
-    soup = BeautifulSoup(html_text, PARSER)
     items = []
-    for a in soup.select(src.get("list_selector","a"))[:MAX_ITEMS_PER_SOURCE]:
-        href = a.get("href"); 
-        if not href: continue
-        link = canonical_url(urljoin(src["url"], href))
-        title = norm_title(a.get_text(" "))
-        content = ""
-        try:
-            art_html = http_get(link)
-            art = BeautifulSoup(art_html, PARSER)
-            node = art.select_one(src.get("content_selector","article")) or art
-            content = clean_text(node.get_text(" "))
-        except Exception as ex:
-            logger.warning(f"Content fetch failed for {link}: {ex}")
+    links = EXTRACTOR.run(scrape_links, html_text, src["url"], src.get("list_selector","a"), MAX_ITEMS_PER_SOURCE)
+    # صفحات القوائم غير مرتبة زمنيًا: نتخطى الروابط المرئية ولا نتوقف عندها
+    mark = hwm_load(src["name"]); fresh, expired = [], []
+    for href, text in links:
+        link = canonical_url(href)
+        gid = _guid_key({"link": link})
+        if gid in mark["guids"]: continue
+        if hwm_expired(src["name"], mark, gid, link):
+            expired.append(gid); continue
+        fresh.append((gid, None))
+        title = norm_title(text)
         items.append({
             "source": src["name"], "title": title, "url": link,
-            "published_at":"", "summary": content[:1500]
+            "published_at":"", "summary": "",
+            "content_selector": src.get("content_selector","article"),
+            "_gid": gid,
         })
+    hwm_save(src["name"], mark, fresh, expired)
+    sched_observe(src["name"], len(links), [], hwm_new(mark, fresh))
     return items
 
+# ====== علامة آخر ما رُئي لكل مصدر (High-water mark) ======
+# معرّفات آخر HWM_GUIDS خبرًا لكل مصدر: الخبر المرئي لا يُطبَّع ولا يُبصم ولا يُفحص تكراره مرة أخرى
+FEED_MAX_AGE_HOURS = float(os.getenv("FEED_MAX_AGE_HOURS", str(DEDUP_WINDOW_HOURS)))
+HWM_GUIDS = int(os.getenv("HWM_GUIDS", "300"))
+
+def _entry_ts(e):
+    t = e.get("published_parsed") or e.get("updated_parsed")
+    try: return calendar.timegm(t) if t else None
+    except Exception: return None
+
+def _guid_key(e) -> str:
+    gid = e.get("id") or e.get("link") or e.get("title") or ""
+    return hashlib.blake2b(gid.strip().encode("utf-8"), digest_size=8).hexdigest()
+
+HWM_RETRIES = 5  # مرات جلب خبر لم يُحكم عليه (فشل تنزيل، خطأ، توقف العملية) قبل اعتباره مرئيًا
+
+def hwm_load(name: str) -> dict:
+    with db_lock:
+        row = conn.execute("SELECT last_guid, last_published, guids, retry FROM source_hwm WHERE name=?", (name,)).fetchone()
+    if not row: return {"last_guid": None, "last_published": None, "order": [], "guids": set(), "retry": {}, "pending": set()}
+    order = json.loads(row[2] or "[]"); retry = json.loads(row[3] or "{}")
+    guids = set(order)
+    return {"last_guid": row[0], "last_published": row[1], "order": order, "guids": guids,
+            "retry": retry, "pending": {g for g in retry if g not in guids}}
+
+def hwm_expired(name: str, mark: dict, gid: str, url: str) -> bool:
+    n = mark["retry"].get(gid, 0) if gid in mark["pending"] else 0
+    if n < HWM_RETRIES: return False
+    logger.warning(f"[HWM] {name}: giving up after {n} undecided fetches: {url}")
+    METRICS.inc("feed_entries_total", source=name, kind="expired")
+    return True
+
+def hwm_new(mark: dict, fresh: list) -> int:
+    # ما ظهر أول مرة في هذا الجلب (المعلّق المُعاد ليس نشرًا جديدًا للمصدر)
+    return sum(1 for g, _ in fresh if g not in mark["pending"])
+
+def hwm_save(name: str, mark: dict, fresh: list, expired: list = ()):
+    # وقت الجلب: الجديد (fresh: [(gid, ts)] الأحدث أولًا) "معلّق" في retry {gid: مرات جلبه} لا مرئي؛
+    # يصير مرئيًا بعد الحكم عليه (hwm_commit). expired: معلّقة استنفدت HWM_RETRIES فتُعتبر مرئية
+    if not fresh and not expired and not mark["pending"]: return
+    with db_lock:
+        cur = hwm_load(name)  # قد يكون حُكم على أخبار منذ hwm_load في المستدعي
+        # المعلّق الذي لم يعد جديدًا في هذا الجلب (اختفى من الملف، قديم، أو حُكم عليه) لا يُتابَع
+        retry = {g: cur["retry"].get(g, 0) + 1 for g, _ in fresh}
+        gone = set(expired)
+        order = (list(expired) + [g for g in cur["order"] if g not in gone])[:HWM_GUIDS]
+        newest = max([t for _, t in fresh if t] + [cur["last_published"] or 0]) or None
+        WRITER.execute("""INSERT INTO source_hwm(name, last_guid, last_published, guids, retry, updated_at) VALUES(?,?,?,?,?,?)
+                          ON CONFLICT(name) DO UPDATE SET last_guid=excluded.last_guid, last_published=excluded.last_published,
+                              guids=excluded.guids, retry=excluded.retry, updated_at=excluded.updated_at""",
+                       (name, fresh[0][0] if fresh else cur["last_guid"], newest, json.dumps(order), json.dumps(retry), time.time()))
+
+_hwm_done = defaultdict(list)  # name -> معرّفات حُكم عليها (رُفضت/مكررة) ولم تُكتب بعد
+
+def hwm_done(it: dict):
+    # الخبر رُفض أو كان مكررًا: يُكتب مرئيًا مع الحجز التالي أو في نهاية المصدر/الدورة
+    # (ضياعه عند توقف العملية يعني إعادة فحصه فقط)
+    if it.get("_gid"):
+        with db_lock: _hwm_done[it.get("source","")].append(it["_gid"])
+
+def hwm_commit(name: str = None):
+    # ينقل المحكوم عليه من المعلّق إلى المرئي؛ claim_item يستدعيها داخل معاملة الحجز فيُثبَّتان معًا
+    with db_lock:
+        for n in ([name] if name is not None else list(_hwm_done)):
+            gids = _hwm_done.pop(n, None)
+            if not gids: continue
+            mark = hwm_load(n); done = set(gids)
+            order = (list(dict.fromkeys(reversed(gids))) + [g for g in mark["order"] if g not in done])[:HWM_GUIDS]
+            retry = {g: c for g, c in mark["retry"].items() if g not in done}
+            WRITER.execute("UPDATE source_hwm SET guids=?, retry=? WHERE name=?", (json.dumps(order), json.dumps(retry), n))
+
+# ====== كاش صفحات المقالات (LRU على القرص) ======
+PAGE_CACHE_DB = os.getenv("PAGE_CACHE_DB", "news_cache.db")
+PAGE_CACHE_TTL = int(os.getenv("PAGE_CACHE_TTL", "86400"))
+PAGE_CACHE_MB = float(os.getenv("PAGE_CACHE_MB", "200"))
+
+class PageCache:
+    # ملف SQLite منفصل (فقدانه لا يضر): HTML مضغوط zlib + النص المستخرج، بمفتاح canonical_url
+    def __init__(self, path: str = PAGE_CACHE_DB):
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL;")
+        self.conn.execute("PRAGMA synchronous=OFF;")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS pages (
+                                 url TEXT PRIMARY KEY, html BLOB, text TEXT, size INTEGER,
+                                 fetched_at REAL, used_at REAL)""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_pages_used ON pages(used_at);")
+        self.conn.commit()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "bytes_saved": 0}
+
+    def get(self, url: str):
+        # يعيد (html, text) أو None؛ text = None إن لم يُستخرج بعد
+        key = canonical_url(url)
+        with self.lock:
+            row = self.conn.execute("SELECT html, text, size, fetched_at FROM pages WHERE url=?", (key,)).fetchone()
+            if not row or time.time() - row[3] > PAGE_CACHE_TTL:
+                self.stats["misses"] += 1
+                return None
+            self.conn.execute("UPDATE pages SET used_at=? WHERE url=?", (time.time(), key))
+            self.conn.commit()
+            self.stats["hits"] += 1; self.stats["bytes_saved"] += row[2] or 0
+        return zlib.decompress(row[0]).decode("utf-8", "replace"), row[1]
+
+    def put(self, url: str, page: str, text: str = None):
+        raw = (page or "").encode("utf-8", "replace")
+        now = time.time()
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO pages(url, html, text, size, fetched_at, used_at) VALUES(?,?,?,?,?,?)",
+                              (canonical_url(url), zlib.compress(raw, 6), text, len(raw), now, now))
+            self.conn.commit()
+
+    def set_text(self, url: str, text: str):
+        with self.lock:
+            self.conn.execute("UPDATE pages SET text=? WHERE url=?", (text, canonical_url(url)))
+            self.conn.commit()
+
+    def evict(self):
+        budget = int(PAGE_CACHE_MB * 1024 * 1024)
+        with self.lock:
+            self.conn.execute("DELETE FROM pages WHERE fetched_at < ?", (time.time() - PAGE_CACHE_TTL,))
+            total = self.conn.execute("SELECT COALESCE(SUM(LENGTH(html)),0) FROM pages").fetchone()[0]
+            if total > budget:
+                # الأقدم استخدامًا أولًا حتى ينزل الحجم تحت الميزانية
+                drop, freed = [], 0
+                for url, n in self.conn.execute("SELECT url, LENGTH(html) FROM pages ORDER BY used_at"):
+                    if total - freed <= budget: break
+                    drop.append((url,)); freed += n
+                self.conn.executemany("DELETE FROM pages WHERE url=?", drop)
+            self.conn.commit()
+
+    def log_stats(self):
+        st = self.stats; total = st["hits"] + st["misses"]
+        ratio = st["hits"] / total if total else 0.0
+        logger.info(f"[CACHE] pages hits={st['hits']} misses={st['misses']} hit_ratio={ratio:.0%} "
+                    f"saved={st['bytes_saved']/1024/1024:.1f}MB")
+
+PAGES = None  # يُنشأ في Bot.start
+
+def get_page(url: str) -> str:
+    # قراءة عبر الكاش لكل مسارات جلب المقالات
+    hit = PAGES.get(url)
+    if hit: return hit[0]
+    page = http_get(url)
+    PAGES.put(url, page)
+    return page
+
+# ====== الاستخراج في مجمع عمليات (CPU: trafilatura + BeautifulSoup على كل الأنوية) ======
+_cpus = os.cpu_count() or 1
+def extract_procs(workers: int = 1) -> int:
+    # EXTRACT_PROCS ميزانية للجهاز: كل عامل (--workers) يأخذ حصته؛ تلقائيًا الأنوية التي لا يشغلها العمال أنفسهم
+    n = int(os.getenv("EXTRACT_PROCS", "0"))
+    if n < 0: return -1
+    share = (n or _cpus - workers) // workers
+    return share if share > 0 else -1
+
+EXTRACT_PROCS = extract_procs()
+EXTRACT_TIMEOUT = float(os.getenv("EXTRACT_TIMEOUT", "30"))
+EXTRACT_MAX_TASKS = int(os.getenv("EXTRACT_MAX_TASKS", "200"))
+
+def _uniq(urls) -> list:
+    uniq, seen = [], set()
+    for u in urls:
+        if u and u not in seen:
+            seen.add(u); uniq.append(u)
+    return uniq
+
+def _og_images(soup, page_url: str) -> list:
+    imgs = []
+    for tag in soup.select('meta[property="og:image"], meta[name="og:image"]'):
+        u = tag.get("content"); 
+        if u: imgs.append(urljoin(page_url, u.strip()))
+    for tag in soup.select('meta[name="twitter:image"], meta[property="twitter:image"]'):
+        u = tag.get("content"); 
+        if u: imgs.append(urljoin(page_url, u.strip()))
+    art = soup.select_one("article") or soup
+    for im in art.select("img"):
+        u = im.get("src") or im.get("data-src")
+        if u and not u.startswith("data:"):
+            imgs.append(urljoin(page_url, u.strip()))
+    return _uniq(imgs)
+
+# ====== تحليل مباشر بـ lxml (بدون شجرة BeautifulSoup): محددات CSS مُجمّعة مرة واحدة ======
+# يتطلب lxml + cssselect؛ بدونهما يبقى مسار BeautifulSoup أعلاه بنفس النتائج
+_OG_XP = ("//meta[@property='og:image' or @name='og:image']/@content",
+          "//meta[@name='twitter:image' or @property='twitter:image']/@content")
+
+def has_lxml() -> bool:
+    return _has("lxml") and _has("cssselect")
+
+@functools.lru_cache(maxsize=256)
+def css(selector: str):
+    # محددات المصادر (list_selector/content_selector) تُترجم إلى XPath مرة واحدة لكل عملية
+    from lxml.cssselect import CSSSelector
+    return CSSSelector(selector, translator="html")
+
+def _lxml_doc(page):
+    import lxml.html
+    if isinstance(page, str): page = page.encode("utf-8")
+    parser = lxml.html.HTMLParser(encoding="utf-8", remove_comments=True)
+    return lxml.html.document_fromstring(page, parser=parser)
+
+_NO_TEXT = ("script", "style", "noscript")
+
+def _text(node) -> str:
+    # مثل get_text(" ") في BeautifulSoup: بلا محتوى script/style/noscript (كود تتبع، CSS)
+    for bad in [el for el in node.iter(*_NO_TEXT) if el is not node]:
+        bad.drop_tree()
+    return " ".join(node.itertext())
+
+def _lxml_meta(doc, page_url: str):
+    og = doc.xpath("//meta[@property='og:title']/@content")
+    t = doc.find(".//title")
+    title = norm_title((og[0] if og else "") or (_text(t) if t is not None else ""))
+    imgs = [urljoin(page_url, u.strip()) for xp in _OG_XP for u in doc.xpath(xp) if u]
+    art = doc.find(".//article")
+    for im in (art if art is not None else doc).iter("img"):
+        u = im.get("src") or im.get("data-src")
+        if u and not u.startswith("data:"):
+            imgs.append(urljoin(page_url, u.strip()))
+    return title, _uniq(imgs)
+
+def head_meta(page, page_url: str, want: int = 1):
+    # قراءة تدريجية تتوقف عند نهاية <head> (السكربتات الضخمة في body لا تُحلَّل)؛
+    # يعيد (title, images) إن وُجد في head صور og/twitter بعدد want وإلا None (يلزم تحليل كامل لصور المقال)
+    from lxml import etree
+    if isinstance(page, str): page = page.encode("utf-8")
+    parser = etree.HTMLPullParser(events=("end",), tag=("meta", "title", "head"), encoding="utf-8")
+    og, tw, title, og_title = [], [], "", ""
+    for i in range(0, len(page), 65536):
+        parser.feed(page[i:i + 65536])
+        for _, el in parser.read_events():
+            if el.tag == "title" and not title: title = _text(el)
+            elif el.tag == "meta":
+                key, val = el.get("property") or el.get("name") or "", (el.get("content") or "").strip()
+                if not val: continue
+                if key == "og:image": og.append(urljoin(page_url, val))
+                elif key == "twitter:image": tw.append(urljoin(page_url, val))
+                elif key == "og:title" and not og_title: og_title = val
+            elif el.tag == "head":
+                imgs = _uniq(og + tw)
+                return (norm_title(og_title or title), imgs) if len(imgs) >= want else None
+    return None
+
+def extract_html(page, url: str = "", selector: str = None, meta: bool = True) -> dict:
+    # دالة نقية (بلا قاعدة/شبكة) لتعمل داخل عملية المجمع. meta: العنوان وصور og.
+    # مع lxml: تحليل واحد للصفحة يخدم المحدد والبيانات الوصفية وtrafilatura (تستقبل الشجرة نفسها)
+    if isinstance(page, bytes): page = page.decode("utf-8", "replace")
+    text, title, images = "", "", []
+    if has_lxml():
+        try: doc = _lxml_doc(page)
+        except Exception: doc = None  # صفحة فارغة/تالفة
+        if doc is not None:
+            if meta: title, images = _lxml_meta(doc, url)  # قبل trafilatura لأنها تعدّل الشجرة
+            if selector:
+                found = css(selector)(doc)
+                text = clean_text(_text(found[0] if found else doc))
+            elif has_trafilatura():
+                ext = trafilatura.extract(doc, include_comments=False, include_images=False) or ""
+                if len(ext.strip()) > 200:
+                    text = clean_text(ext)
+        return {"text": text, "title": title, "images": images, "hash": text_hash(text) if text else ""}
+    soup = None
+    if selector:
+        soup = BeautifulSoup(page)
+        node = soup.select_one(selector) or soup
+        for bad in node.select(", ".join(_NO_TEXT)): bad.decompose()
+        text = clean_text(node.get_text(" "))
+    elif has_trafilatura():
+        ext = trafilatura.extract(page, include_comments=False, include_images=False) or ""
+        if len(ext.strip()) > 200:
+            text = clean_text(ext)
+    if meta:
+        soup = soup or BeautifulSoup(page)
+        og = soup.select_one('meta[property="og:title"]')
+        title = norm_title((og.get("content") if og else "") or (soup.title.get_text(" ") if soup.title else ""))
+        images = _og_images(soup, url)
+    return {"text": text, "title": title, "images": images, "hash": text_hash(text) if text else ""}
+
+def page_images(page, page_url: str, want: int = 1) -> list:
+    # صور og فقط (النص مخزّن مسبقًا): يكفي <head> غالبًا
+    if has_lxml():
+        got = head_meta(page, page_url, want)
+        if got is not None: return got[1]
+    return extract_html(page, page_url, None, True)["images"]
+
+def scrape_links(page, base_url: str, selector: str, limit: int) -> list:
+    # صفحة قائمة (fetch_scrape) → [(href مطلق, نص الرابط)]
+    out = []
+    if has_lxml():
+        try: nodes = css(selector or "a")(_lxml_doc(page))
+        except Exception: nodes = []
+        texts = ((a.get("href"), _text(a)) for a in nodes[:limit])
+    else:
+        texts = ((a.get("href"), a.get_text(" ")) for a in BeautifulSoup(page).select(selector or "a")[:limit])
+    for href, text in texts:
+        if href: out.append((urljoin(base_url, href), text))
+    return out
+
+def _extract_pool_init():
+    import signal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C للعملية الرئيسية فقط
+
+class ExtractPool:
+    # multiprocessing.Pool (spawn: لا fork لعملية فيها خيوط وقاعدة مفتوحة) مع:
+    # - مهلة لكل مهمة: عند تجاوزها تُنهى كل العمليات ويُنشأ مجمع جديد (لا طريقة لقتل عملية واحدة عالقة)
+    # - المهام الجارية في المجمع المُنهى تُعاد مرة واحدة على الجديد
+    # - maxtasksperchild لتدوير العمليات
+    # - لا يُرسل للمجمع أكثر من procs مهمة: المهلة تبدأ والمهمة لها عملية فعلًا، لا وهي تنتظر في الطابور
+    def __init__(self, procs: int = EXTRACT_PROCS, timeout: float = EXTRACT_TIMEOUT, max_tasks: int = EXTRACT_MAX_TASKS):
+        self.procs, self.timeout, self.max_tasks = procs, timeout, max_tasks
+        self.lock = threading.Lock()
+        self.pool = None; self.gen = 0; self.slots = None
+        self.inflight = {}  # id(box) -> (gen, box, event)
+
+    @property
+    def enabled(self) -> bool:
+        return self.procs > 0
+
+    def _ensure(self):
+        if self.pool is None:
+            import multiprocessing
+            ctx = multiprocessing.get_context("spawn")
+            self.pool = ctx.Pool(self.procs, initializer=_extract_pool_init, maxtasksperchild=self.max_tasks or None)
+            logger.info(f"[EXTRACT] pool: {self.procs} processes")
+        return self.pool
+
+    def run(self, fn, *args):
+        if not self.enabled:
+            return fn(*args)
+        with self.lock:
+            if self.slots is None: self.slots = threading.BoundedSemaphore(self.procs)  # procs قد يُضبط بعد الإنشاء (--workers)
+        for attempt in range(2):
+            with self.slots:
+                r = self._attempt(fn, args)
+            if r is not self._RECYCLED: return r
+        raise TimeoutError(f"{fn.__name__}: extraction pool recycled twice")
+
+    _RECYCLED = object()
+
+    def _attempt(self, fn, args):
+        ev, box = threading.Event(), {}
+        def done(r, box=box, ev=ev): box["r"] = r; ev.set()
+        def fail(e, box=box, ev=ev): box["e"] = e; ev.set()
+        with self.lock:
+            gen = self.gen
+            self._ensure().apply_async(fn, args, callback=done, error_callback=fail)
+            self.inflight[id(box)] = (gen, box, ev)
+        try:
+            if not ev.wait(self.timeout):
+                METRICS.inc("extract_pool_total", result="timeout")
+                self._recycle(gen, f"{fn.__name__} exceeded {self.timeout:g}s")
+                raise TimeoutError(f"{fn.__name__} exceeded {self.timeout:g}s")
+        finally:
+            with self.lock: self.inflight.pop(id(box), None)
+        if box.get("recycled"):
+            METRICS.inc("extract_pool_total", result="recycled"); return self._RECYCLED
+        if "e" in box:
+            METRICS.inc("extract_pool_total", result="error"); raise box["e"]
+        METRICS.inc("extract_pool_total", result="ok")
+        return box["r"]
+
+    def _recycle(self, gen: int, why: str):
+        with self.lock:
+            if gen != self.gen or self.pool is None: return  # أُعيد إنشاؤه من مهمة أخرى
+            pool, self.pool = self.pool, None
+            self.gen += 1
+            for g, box, ev in self.inflight.values():
+                if g == gen: box["recycled"] = True; ev.set()
+        logger.warning(f"[EXTRACT] recycling pool: {why}")
+        pool.terminate()
+
+    def close(self):
+        with self.lock:
+            pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.close(); pool.join()
+
+EXTRACTOR = ExtractPool()
+
+# ====== استخراج النص الكامل (كسول) ======
+def fetch_article_text(it: dict) -> str:
+    link = it.get("url") or ""
+    hit = PAGES.get(link)
+    if hit:
+        it["_html"] = hit[0]
+        if hit[1] is not None: return hit[1]
+        page = hit[0]
+    else:
+        try:
+            page = http_get(link)
+        except CircuitOpen as ex:
+            logger.info(f"Content fetch skipped for {link}: {ex}")
+            it["_fetch_failed"] = True; return ""
+        except Exception as ex:
+            logger.warning(f"Content fetch failed for {link}: {ex}")
+            it["_fetch_failed"] = True; return ""
+        it["_html"] = page
+    text = None  # None في الكاش = يُعاد الاستخراج لاحقًا (مهلة المجمع ليست "صفحة بلا نص")
+    try:
+        # صور og تُستخرج في نفس التمرير عند الحاجة لها (FACEBOOK_MODE) فلا يُحلَّل المقال مرتين
+        res = EXTRACTOR.run(extract_html, page, link, it.get("content_selector"), FACEBOOK_MODE)
+        text = res["text"]
+        if FACEBOOK_MODE: it["_images"] = res["images"]
+    except Exception as ex:
+        logger.warning(f"extract failed for {link}: {ex}")
+        it["_fetch_failed"] = True
+    if hit: PAGES.set_text(link, text)
+    else: PAGES.put(link, page, text)
+    return text or ""
+
+# ====== فهرس التشابه (MinHash + LSH) ======
+# التوقيع: 60 دالة تجزئة على مقاطع من 3 أحرف؛ 20 حزمة × 3 صفوف تلتقط المرشحين بتشابه ≥ ~0.5
+# ثم يُتحقق من المرشحين بنفس مقياس is_similar فتبقى SIMILARITY_THRESH عتبة القبول
+MH_SHINGLE, MH_BANDS, MH_ROWS = 3, 20, 3
+_MH_PRIME = (1 << 61) - 1
+_mh_rng = random.Random(20240601)
+_MH_PERMS = [(_mh_rng.randrange(1, _MH_PRIME), _mh_rng.randrange(0, _MH_PRIME)) for _ in range(MH_BANDS * MH_ROWS)]
+
+def _nd_text(s: str) -> str:
+    s = _normalize_ar(s or "").lower()
+    return re.sub(r"\s+", " ", re.sub(r"[^\w\s]", " ", s)).strip()
+
+def minhash(text: str) -> list:
+    if len(text) <= MH_SHINGLE:
+        grams = {text}
+    else:
+        grams = {text[i:i+MH_SHINGLE] for i in range(len(text) - MH_SHINGLE + 1)}
+    hs = [int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size=8).digest(), "little") for g in grams]
+    return [min((a * h + b) % _MH_PRIME for h in hs) for a, b in _MH_PERMS]
+
+def lsh_keys(kind: str, sig: list) -> list:
+    keys = []
+    for band in range(MH_BANDS):
+        chunk = sig[band*MH_ROWS:(band+1)*MH_ROWS]
+        raw = f"{kind}:{band}:" + ",".join(map(str, chunk))
+        keys.append(int.from_bytes(hashlib.blake2b(raw.encode(), digest_size=8).digest(), "little", signed=True))
+    return keys
+
+def _nd_fields(title: str, body: str):
+    t = _nd_text(title); b = _nd_text(body)
+    if b == t or len(b) < 50: b = ""  # نص قصير/مكرر للعنوان لا يفيد المقارنة
+    return t, b
+
+def nd_signature(title: str, body: str):
+    # (t, b, مفاتيح t، مفاتيح b): تُحسب مرة للخبر وتُستعمل للبحث والإضافة في كل النطاقات
+    t, b = _nd_fields(title, body)
+    return t, b, (lsh_keys("t", minhash(t)) if t else []), (lsh_keys("b", minhash(b)) if b else [])
+
+def nd_similar_scopes(title: str, body: str, scopes=None, sig=None) -> dict:
+    # {scope: item_id} لأول خبر مشابه داخل النافذة الزمنية في كل نطاق (scopes=None = كل النطاقات)
+    t, b, tkeys, bkeys = sig or nd_signature(title, body)
+    cutoff = (datetime.now(TZ) - timedelta(hours=DEDUP_WINDOW_HOURS)).isoformat()
+    found = {}
+    for text, keys, col in ((t, tkeys, 0), (b, bkeys, 1)):
+        if not text: continue
+        with db_lock:
+            rows = conn.execute(f"""SELECT d.item_id, d.title, d.body, d.scope FROM nd_docs d
+                                    WHERE d.created_at >= ? AND d.item_id IN
+                                    (SELECT item_id FROM nd_bands WHERE band_key IN ({",".join("?"*len(keys))}))""",
+                                (cutoff, *keys)).fetchall()
+        for item_id, old_t, old_b, scope in rows:
+            scope = scope or ""
+            if scope in found or (scopes is not None and scope not in scopes): continue
+            old = (old_t, old_b)[col]
+            if old and is_similar(old, text):
+                found[scope] = item_id
+                if scopes is not None and len(found) == len(scopes): return found
+    return found
+
+def nd_find_similar(title: str, body: str, scope: str = None):
+    # يعيد item_id لأول خبر مشابه (في النطاق المحدد أو أي نطاق) أو None
+    found = nd_similar_scopes(title, body, None if scope is None else {scope})
+    return next(iter(found.values()), None)
+
+def nd_add(item_id: int, title: str, body: str, created_at: str = None, scope: str = "", sig=None):
+    t, b, tkeys, bkeys = sig or nd_signature(title, body)
+    WRITER.execute("INSERT OR REPLACE INTO nd_docs(item_id, title, body, created_at, scope) VALUES(?,?,?,?,?)",
+                   (item_id, t, b, created_at or datetime.now(TZ).isoformat(), scope))
+    WRITER.executemany("INSERT INTO nd_bands(band_key, item_id) VALUES(?,?)", [(k, item_id) for k in tkeys + bkeys])
+
+def nd_purge():
+    cutoff = (datetime.now(TZ) - timedelta(hours=DEDUP_WINDOW_HOURS)).isoformat()
+    WRITER.execute("DELETE FROM nd_bands WHERE item_id IN (SELECT item_id FROM nd_docs WHERE created_at < ?)", (cutoff,))
+    WRITER.execute("DELETE FROM nd_docs WHERE created_at < ?", (cutoff,))
+
+def nd_backfill():
+    # أول تشغيل بعد الترقية: فهرسة عناوين النافذة الزمنية من جدول items
+    with db_lock:
+        if conn.execute("SELECT 1 FROM nd_docs LIMIT 1").fetchone(): return
+        cutoff = (datetime.now(TZ) - timedelta(hours=DEDUP_WINDOW_HOURS)).isoformat()
+        rows = conn.execute("SELECT id, title, created_at, scope FROM items WHERE created_at >= ?", (cutoff,)).fetchall()
+        for item_id, title, created_at, scope in rows:
+            nd_add(item_id, title or "", "", created_at, scope or "")
+        WRITER.flush()
+    if rows: logger.info(f"[DEDUP] indexed {len(rows)} recent titles")
+
+# ====== مرشّح Bloom أمام جدول items (يُبنى عند التشغيل) ======
+DEDUP_BLOOM = os.getenv("DEDUP_BLOOM", "1") == "1"
+BLOOM_ERROR_RATE = float(os.getenv("BLOOM_ERROR_RATE", "0.01"))
+BLOOM_MIN_CAPACITY = 100_000
+
+class BloomFilter:
+    # "غير موجود" مؤكد؛ "موجود" قد يكون إيجابيًا كاذبًا بنسبة error_rate. لا حذف: يُعاد البناء بعد الأرشفة
+    def __init__(self, capacity: int, error_rate: float = BLOOM_ERROR_RATE):
+        self.capacity = max(1000, capacity)
+        # k ≤ 3 مع بتات أكثر قليلًا لكل مفتاح (~12 بدل ~10 عند 1%): إعادة البناء عند التشغيل أسرع بمرتين
+        self.k = max(1, min(3, round(-math.log2(error_rate))))
+        self.m = max(8192, int(-self.k * self.capacity / math.log(1 - error_rate ** (1 / self.k))))
+        self.bits = bytearray((self.m + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        # تجزئة مزدوجة (Kirsch–Mitzenmacher): k موضعًا من تجزئة واحدة
+        h = int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest(), "little")
+        a, b, m = h & 0xFFFFFFFFFFFFFFFF, (h >> 64) | 1, self.m
+        return [(a + i * b) % m for i in range(self.k)]
+
+    def add(self, key: str):
+        for p in self._positions(key):
+            self.bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    def add_many(self, keys):
+        # نفس add بدون استدعاء دالة لكل مفتاح (إعادة البناء تمر على كل الجدول)
+        bits, m, k, blake = self.bits, self.m, self.k, hashlib.blake2b
+        for key in keys:
+            h = int.from_bytes(blake(key.encode("utf-8"), digest_size=16).digest(), "little")
+            a, b = h & 0xFFFFFFFFFFFFFFFF, (h >> 64) | 1
+            for i in range(k):
+                p = (a + i * b) % m
+                bits[p >> 3] |= 1 << (p & 7)
+            self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+BLOOM = None
+
+def _bloom_keys(url: str, title_hash: str, content_hash: str) -> list:
+    return [f"u:{url}", f"t:{title_hash}", f"c:{content_hash}"]
+
+_bloom_lock = threading.Lock()
+
+def bloom_rebuild(background: bool = False):
+    # عامل آخر قد يضيف أخبارًا لا يراها المرشّح: "جديد" خاطئ يصطدم لاحقًا بقيد UNIQUE في claim_item.
+    # background: البناء في خيط؛ حتى ينتهي يُسأل SQLite مباشرة (BLOOM=None)
+    if not DEDUP_BLOOM: return
+    if background:
+        threading.Thread(target=bloom_rebuild, name="bloom", daemon=True).start(); return
+    global BLOOM
+    if not _bloom_lock.acquire(blocking=False): return  # بناء آخر جارٍ
+    try:
+        t0 = time.perf_counter()
+        with db_lock:
+            last, n = conn.execute("SELECT COALESCE(MAX(id), 0), COUNT(*) FROM items").fetchone()
+            rows = conn.execute("SELECT url, title_hash, content_hash FROM items WHERE id <= ?", (last,)).fetchall()
+        bloom = BloomFilter(max(BLOOM_MIN_CAPACITY, n * 3 * 2))
+        bloom.add_many(key for row in rows for key in _bloom_keys(*row))
+        del rows
+        with db_lock:  # ما أُضيف أثناء البناء
+            bloom.add_many(key for row in conn.execute("SELECT url, title_hash, content_hash FROM items WHERE id > ?", (last,))
+                           for key in _bloom_keys(*row))
+            BLOOM = bloom
+        logger.info(f"[DEDUP] bloom: {n} items, {len(bloom.bits) // 1024} KiB, k={bloom.k} "
+                    f"({(time.perf_counter() - t0) * 1000:.0f} ms)")
+    finally:
+        _bloom_lock.release()
+
+def bloom_add(url: str, title_hash: str, content_hash: str):
+    if BLOOM is None: return
+    for key in _bloom_keys(url, title_hash, content_hash): BLOOM.add(key)
+    if BLOOM.count > BLOOM.capacity: bloom_rebuild(background=True)  # امتلأ: تزيد الإيجابيات الكاذبة
+
 # ====== منع التكرار ======
-def is_duplicate(title: str, url: str, content: str) -> bool:
-    c = conn.cursor()
+@timed("is_duplicate")
+def duplicate_scopes(title: str, url: str, content: str, scopes) -> set:
+    # النطاقات (من scopes) التي سبق فيها نفس الخبر: بصمة مطابقة أو نص مشابه
     th = text_hash(title); ch = text_hash(content or title); cu = canonical_url(url)
-    if c.execute("SELECT 1 FROM items WHERE url=? OR title_hash=? OR content_hash=? LIMIT 1",(cu,th,ch)).fetchone():
-        return True
-    for (old_title,) in c.execute("SELECT title FROM items ORDER BY id DESC LIMIT 200").fetchall():
-        if is_similar(old_title or "", title or ""): return True
-    return False
+    if BLOOM is not None and not any(k in BLOOM for k in _bloom_keys(cu, th, ch)):
+        METRICS.inc("bloom_total", result="new"); dup = set()
+    else:
+        if BLOOM is not None: METRICS.inc("bloom_total", result="maybe")
+        with db_lock:
+            dup = {r[0] or "" for r in conn.execute("SELECT DISTINCT scope FROM items WHERE url=? OR title_hash=? OR content_hash=?",
+                                                    (cu, th, ch))} & set(scopes)
+    rest = set(scopes) - dup
+    if rest: dup |= set(nd_similar_scopes(title, content, rest))
+    return dup
 
-def save_item(it: dict):
-    conn.execute("""INSERT INTO items (source,title,url,published_at,title_hash,content_hash,created_at)
-                    VALUES (?,?,?,?,?,?,?)""",
-                 (it["source"], it["title"], canonical_url(it["url"]), it.get("published_at",""),
-                  text_hash(it["title"]), text_hash((it.get("summary") or it["title"])),
-                  datetime.now(TZ).isoformat()))
-    conn.commit()
+def is_duplicate(title: str, url: str, content: str, scope: str = "") -> bool:
+    return bool(duplicate_scopes(title, url, content, {scope}))
+
+def save_item(it: dict, scope: str = "", sig=None) -> bool:
+    # INSERT OR IGNORE على قيود UNIQUE: الإدراج نفسه هو فحص التكرار الدقيق (بدون قراءة ثم كتابة)
+    cu, th, ch = canonical_url(it["url"]), text_hash(it["title"]), text_hash((it.get("summary") or it["title"]))
+    with db_lock:
+        cur = WRITER.execute("""INSERT OR IGNORE INTO items (source,title,url,published_at,title_hash,content_hash,created_at,status,scope)
+                                VALUES (?,?,?,?,?,?,?,'pending',?)""",
+                             (it["source"], it["title"], cu, it.get("published_at",""), th, ch,
+                              datetime.now(TZ).isoformat(), scope))
+        if cur.rowcount == 0:
+            return False
+        bloom_add(cu, th, ch)
+        it.setdefault("_id", cur.lastrowid)
+        it.setdefault("_ids", {})[scope] = cur.lastrowid
+        nd_add(cur.lastrowid, it["title"], it.get("summary") or "", scope=scope, sig=sig)
+    return True
+
+def mark_item_status(it: dict, status: str, item_id: int = None):
+    if item_id or it.get("_id"):
+        WRITER.execute("UPDATE items SET status=? WHERE id=?", (status, item_id or it["_id"]))
+
+# ====== الاحتفاظ: أرشفة الأخبار القديمة + VACUUM دوري ======
+RETENTION_DAYS = float(os.getenv("RETENTION_DAYS", "0"))
+ARCHIVE_DB = os.getenv("ARCHIVE_DB", "news_archive.db")
+VACUUM_DAYS = float(os.getenv("VACUUM_DAYS", "0"))
+COMPACT_EVERY = 86400
+ITEM_COLS = "id, source, title, url, published_at, title_hash, content_hash, created_at, status, scope"
+
+def _meta_claim(key: str, every: float) -> bool:
+    # عامل واحد فقط يأخذ المهمة الدورية (نفس فكرة lease_acquire)
+    now = time.time()
+    with db_lock:
+        cur = conn.execute("""INSERT INTO meta(key, val) VALUES(?, ?)
+                              ON CONFLICT(key) DO UPDATE SET val=excluded.val WHERE CAST(meta.val AS REAL) <= ?""",
+                           (key, str(now), now - every))
+        conn.commit()
+    return cur.rowcount == 1
+
+def compact(force: bool = False):
+    if force: ok_compact = ok_vacuum = True
+    else:
+        ok_compact = RETENTION_DAYS > 0 and _meta_claim("compact_at", COMPACT_EVERY)
+        ok_vacuum = VACUUM_DAYS > 0 and _meta_claim("vacuum_at", VACUUM_DAYS * 86400)
+    if not (ok_compact or ok_vacuum): return
+    t0 = time.perf_counter(); before = os.path.getsize(DB_PATH) if os.path.exists(DB_PATH) else 0
+    if ok_compact and RETENTION_DAYS > 0:
+        # لا تُحذف أخبار ما زالت داخل نافذة التشابه أو عمر الخلاصات (وإلا عادت كأنها جديدة)
+        days = max(RETENTION_DAYS, DEDUP_WINDOW_HOURS / 24, FEED_MAX_AGE_HOURS / 24)
+        cutoff = (datetime.now(TZ) - timedelta(days=days)).isoformat()
+        with db_lock:
+            # flush داخل القفل: المعاملة التالية لا تحمل إلا كتابات هذه الدالة، فالتراجع عند الخطأ
+            # لا يُسقط ما أضافته الخيوط الأخرى للـ DbWriter (مثل 'sent' من صندوق الصادر)
+            WRITER.flush()
+            attached = False
+            try:
+                if ARCHIVE_DB:
+                    conn.execute("ATTACH DATABASE ? AS archive", (ARCHIVE_DB,)); attached = True
+                    conn.execute("""CREATE TABLE IF NOT EXISTS archive.items (id INTEGER PRIMARY KEY, source TEXT, title TEXT,
+                                    url TEXT, published_at TEXT, title_hash TEXT, content_hash TEXT, created_at TEXT,
+                                    status TEXT, scope TEXT)""")
+                    conn.execute(f"INSERT OR IGNORE INTO archive.items({ITEM_COLS}) SELECT {ITEM_COLS} FROM main.items WHERE created_at < ?", (cutoff,))
+                n = conn.execute("DELETE FROM main.items WHERE created_at < ?", (cutoff,)).rowcount
+                m = conn.execute("DELETE FROM main.outbox WHERE status IN ('sent','failed') AND created_ts < ?",
+                                 (time.time() - days * 86400,)).rowcount
+                conn.commit()
+            except Exception:
+                conn.rollback()  # إنهاء المعاملة قبل DETACH
+                raise
+            finally:
+                if attached: conn.execute("DETACH DATABASE archive")
+        METRICS.inc("compact_rows_total", n, table="items"); METRICS.inc("compact_rows_total", m, table="outbox")
+        logger.info(f"[COMPACT] archived {n} items older than {days:g} days{' → ' + ARCHIVE_DB if ARCHIVE_DB else ''}, "
+                    f"dropped {m} outbox rows")
+        if n: bloom_rebuild(background=True)
+    if ok_vacuum:
+        with db_lock:
+            WRITER.flush()  # VACUUM لا يعمل داخل معاملة
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.execute("VACUUM")
+            conn.execute("PRAGMA optimize")
+        after = os.path.getsize(DB_PATH) if os.path.exists(DB_PATH) else 0
+        logger.info(f"[COMPACT] VACUUM {before / 1e6:.1f} MB → {after / 1e6:.1f} MB "
+                    f"({(time.perf_counter() - t0) * 1000:.0f} ms)")
 
 # ====== فلترة الأنبار/الرمادي ======
+# جدول تطبيع واحد يُبنى مرة: حذف التشكيل + توحيد الألف/الياء/الواو/التاء المربوطة + الأرقام
+_AR_TABLE = {c: None for c in range(0x064B, 0x0660)}
+_AR_TABLE[0x0670] = None
+_AR_TABLE.update({ord(c): "ا" for c in "إأآ"})
+_AR_TABLE.update({ord("ى"): "ي", ord("ئ"): "ي", ord("ؤ"): "و", ord("ة"): "ه"})
+_AR_TABLE.update({ord(d): str(i) for i, d in enumerate("٠١٢٣٤٥٦٧٨٩")})
+
 def _normalize_ar(s: str) -> str:
     if not s: return ""
-    s = unicodedata.normalize("NFKC", s)
-    s = re.sub(r"[\u064B-\u065F\u0670]", "", s)
-    s = re.sub("[إأآا]", "ا", s)
-    s = s.replace("ى","ي").replace("ئ","ي").replace("ؤ","و").replace("ة","ه")
-    s = s.translate(str.maketrans("٠١٢٣٤٥٦٧٨٩","0123456789"))
-    return s
+    return unicodedata.normalize("NFKC", s).translate(_AR_TABLE)
 
-def is_relevant(text: str) -> bool:
-    if not ANBAR_FILTER: return True
-    t = _normalize_ar(text or "").lower()
-    found_kw = any((_normalize_ar(k).lower() in t) for k in REQUIRED_KEYWORDS if k)
-    if not found_kw: return False
+def _trie_regex(words) -> str:
+    # regex على شكل شجرة بادئات: الفروع المشتركة تُفحص مرة، والأطول يُفضَّل عند نفس الموضع
+    trie = {}
+    for w in words:
+        node = trie
+        for ch in w: node = node.setdefault(ch, {})
+        node[""] = {}
+    def walk(node):
+        alts = [re.escape(ch) + walk(sub) for ch, sub in sorted(node.items()) if ch]
+        if not alts: return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        return f"(?:{body})?" if "" in node else body
+    return walk(trie)
+
+# كل الكلمات (قبول + مدن) تُطبّع مرة وتُجمع في regex واحد؛ مسح واحد للنص يعيد كل الإصابات
+class KeywordMatcher:
+    def __init__(self, required, cities, default_locality="الأنبار"):
+        self.required = [(k, _normalize_ar(k).lower()) for k in required if k]
+        self.cities = [(c, _normalize_ar(c).lower()) for c in cities if c]
+        self.default_locality = default_locality
+        self.words = {n for _, n in self.required + self.cities if n}
+        self._regex = None  # يُبنى عند أول مسح (ملفات التوجيه تستعمل hits فقط)
+
+    def _compile(self):
+        words = self.words
+        # كلمة داخل كلمة أطول (رمادي ⊂ الرمادي) تُحتسب مع الأطول عند نفس الموضع
+        self.contains = {w: {v for v in words if v in w} for w in words}
+        self._regex = re.compile(f"(?=({_trie_regex(words)}))") if words else False
+
+    def find(self, text: str) -> set:
+        # الكلمات المُطبّعة الموجودة في النص
+        if self._regex is None: self._compile()
+        found = set()
+        if self._regex:
+            t = _normalize_ar(text or "").lower()
+            for m in self._regex.finditer(t):
+                found |= self.contains[m.group(1)]
+        return found
+
+    def hits(self, found: set) -> dict:
+        cities = [c for c, n in self.cities if n in found]
+        return {
+            "keywords": [k for k, n in self.required if n in found],
+            "cities": cities,
+            "locality": cities[0] if cities else self.default_locality,
+        }
+
+    def scan(self, text: str) -> dict:
+        return self.hits(self.find(text))
+
+MATCHER = KeywordMatcher(REQUIRED_KEYWORDS, CITY_ALIASES)
+
+# للاستخدام كمكتبة فقط (كلمات الأنبار الافتراضية): مسار الجمع يوجّه عبر ROUTER.route_text لكل الملفات
+def hits_relevant(hits: dict) -> bool:
+    if not hits["keywords"]: return False
     if STRICT_CITY_ONLY:
-        return any((_normalize_ar(c).lower() in t) for c in CITY_ALIASES if c)
+        return bool(hits["cities"])
     return True
 
+def is_relevant(text: str) -> bool:
+    if not ANBAR_FILTER: return True
+    return hits_relevant(MATCHER.scan(text))
+
 def detect_locality(text: str):
-    t = _normalize_ar(text or "").lower()
-    for c in CITY_ALIASES:
-        cc = _normalize_ar(c).lower()
-        if cc and cc in t:
-            return c
-    return "الأنبار"
+    return MATCHER.scan(text)["locality"]
+
+# ====== ملفات التوجيه (Profiles): كلمات + قناة + قالب فيسبوك + نطاق منع تكرار ======
+PROFILES_FILE = os.getenv("PROFILES_FILE", "profiles.json")
+
+class Profile:
+    def __init__(self, name: str, keywords=None, cities=None, chat_id: str = "", facebook_template: str = None,
+                 hashtags: str = None, dedup_scope: str = None, strict_city: bool = STRICT_CITY_ONLY,
+                 default_locality: str = None):
+        keywords = [k for k in (keywords or []) if k]
+        cities = [c for c in (cities or keywords) if c]
+        self.name = name
+        self.filtering = bool(keywords)  # بلا كلمات = يقبل كل الأخبار
+        self.matcher = KeywordMatcher(keywords, cities, default_locality or (cities[0] if cities else ""))
+        self.chat_id = str(chat_id or "")
+        self.facebook_template = (facebook_template or FACEBOOK_TEMPLATE).lower()
+        self.hashtags = hashtags
+        self.scope = name if dedup_scope is None else dedup_scope
+        self.strict_city = strict_city
+
+    @classmethod
+    def from_env(cls):
+        # السلوك القديم: ملف واحد من ANBAR_FILTER/REQUIRED_KEYWORDS/CITY_ALIASES/TG_CHAT_ID بنطاق ''
+        return cls("default", REQUIRED_KEYWORDS if ANBAR_FILTER else [], CITY_ALIASES, TG_CHAT_ID,
+                   dedup_scope="", default_locality="الأنبار")
+
+    def route(self, found: set):
+        # يعيد hits إن كان الخبر يخص هذا الملف وإلا None
+        if not self.filtering:
+            return {"keywords": [], "cities": [], "locality": ""}
+        hits = self.matcher.hits(found)
+        if not hits["keywords"]: return None
+        if self.strict_city and not hits["cities"]: return None
+        return hits
+
+class ProfileRouter:
+    # مسح واحد بـ regex يجمع كلمات كل الملفات، ثم تقاطع مجموعات رخيص لكل ملف
+    def __init__(self, profiles: list):
+        self.profiles = profiles
+        self.by_name = {p.name: p for p in profiles}
+        self.scopes = list(dict.fromkeys(p.scope for p in profiles))
+        self.scanner = KeywordMatcher([w for p in profiles for w, _ in p.matcher.required],
+                                      [c for p in profiles for c, _ in p.matcher.cities])
+        self.filtering = any(p.filtering for p in profiles)
+
+    @timed()
+    def route_text(self, text: str) -> dict:
+        # مسار الصلة الفعلي (filter_item + extract_item)
+        found = self.scanner.find(text) if self.filtering else set()
+        routes = {}
+        for p in self.profiles:
+            hits = p.route(found)
+            if hits is not None: routes[p.name] = hits
+        return routes
+
+def load_profiles() -> list:
+    path = os.path.join(os.getcwd(), PROFILES_FILE)
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                arr = json.load(f)
+            if isinstance(arr, list) and arr:
+                profiles = [Profile(**p) for p in arr]
+                logger.info(f"Loaded {len(profiles)} profiles from {PROFILES_FILE}: {', '.join(p.name for p in profiles)}")
+                return profiles
+        except Exception as ex:
+            logger.warning(f"{PROFILES_FILE} parsing failed: {ex}")
+    return [Profile.from_env()]
+
+ROUTER = None  # يُنشأ في Bot.start
 
 # ====== Telegram & Files ======
-def send_telegram(html_msg: str) -> bool:
-    if not TG_TOKEN or not TG_CHAT_ID:
-        return False
+def tg_enabled() -> bool:
+    chats = [p.chat_id for p in ROUTER.profiles] if ROUTER else []
+    return bool(TG_TOKEN and (TG_CHAT_ID or any(chats)))
+
+@timed()
+def tg_send(chat_id: str, html_msg: str):
+    # محاولة واحدة؛ يعيد (ok, retry_after, error, permanent)
     if DRY_RUN:
         logger.info("[DRY_RUN] Telegram send skipped")
-        return True
-    api = f"https://api.telegram.org/bot{TG_TOKEN}/sendMessage"
-    data = {"chat_id": TG_CHAT_ID, "text": html_msg, "parse_mode": "HTML", "disable_web_page_preview": False}
-    for i in range(4):
-        r = requests.post(api, data=data, timeout=FETCH_TIMEOUT)
-        if r.status_code == 200:
-            return True
-        try: j = r.json()
-        except Exception: j = {}
-        if r.status_code == 429:
-            retry_after = int(j.get('parameters', {}).get('retry_after', 2))
-            wait_s = min(30, retry_after + i * 2)
-            logger.warning(f"Telegram 429 — الانتظار {wait_s}s ثم إعادة…")
-            time.sleep(wait_s); continue
-        logger.error(f"Telegram error: {r.status_code} {r.text}")
-        time.sleep(1.5*(i+1))
-    return False
+        return True, 0, "", False
+    api = f"{TG_API_BASE}/bot{TG_TOKEN}/sendMessage"
+    data = {"chat_id": chat_id, "text": html_msg, "parse_mode": "HTML", "disable_web_page_preview": False}
+    try:
+        r = HTTP.post(api, data=data, tries=1, check=False)
+    except Exception as ex:
+        return False, 0, str(ex), False
+    if r.status_code == 200:
+        return True, 0, "", False
+    try: j = r.json()
+    except Exception: j = {}
+    if r.status_code == 429:
+        return False, float(j.get('parameters', {}).get('retry_after', 2)), "429", False
+    # 4xx غير 429 (نص HTML غير صالح، قناة خاطئة...) لا تنفع معه إعادة المحاولة
+    return False, 0, f"{r.status_code} {r.text[:200]}", 400 <= r.status_code < 500
 
 def save_to_md(it: dict):
     md_line = f"- **{it['title']}** — [{it['source']}]({it['url']})\n"
     with open(os.path.join(OUT_DIR, "latest.md"), "a", encoding="utf-8") as f:
         f.write(md_line)
 
+# ====== صندوق الصادر + مُرسِل بمعدل محدود (Token Bucket) ======
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate, self.burst = rate, burst
+        self.tokens, self.t = burst, time.monotonic()
+        self.blocked_until = 0.0
+
+    def wait(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.t) * self.rate); self.t = now
+        if now < self.blocked_until: return self.blocked_until - now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+def outbox_enqueue(it: dict, text: str, chat_id: str = None, item_id: int = None):
+    now = time.time()
+    WRITER.execute("""INSERT INTO outbox(item_id, chat_id, text, status, attempts, next_ts, created_ts)
+                      VALUES(?,?,?,'pending',0,?,?)""", (item_id or it.get("_id"), chat_id or TG_CHAT_ID, text, now, now))
+    DISPATCHER.notify()
+
+class OutboxDispatcher:
+    # يعمل في خيط مستقل: الجمع لا ينتظر 429 ولا حدود المعدل، والمعلّق يُستأنف بعد إعادة التشغيل
+    def __init__(self):
+        self.global_bucket = TokenBucket(TG_GLOBAL_PER_SEC, TG_GLOBAL_PER_SEC)
+        self.chat_buckets = {}
+        self.stats = {"sent": 0, "retries": 0, "failed": 0, "latency_ms": 0}
+        self._thread = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        # مع --workers يرسل عامل واحد فقط حتى لا تتضاعف حدود المعدل؛ على عدة أجهزة: OUTBOX_SENDER=0 على البقية
+        self.active = os.getenv("OUTBOX_SENDER", "1") == "1"
+
+    def _bucket(self, chat_id: str) -> TokenBucket:
+        if chat_id not in self.chat_buckets:
+            self.chat_buckets[chat_id] = TokenBucket(TG_CHAT_PER_MIN / 60.0, TG_CHAT_BURST)
+        return self.chat_buckets[chat_id]
+
+    def pending(self) -> int:
+        with db_lock:
+            return conn.execute("SELECT COUNT(*) FROM outbox WHERE status IN ('pending','sending')").fetchone()[0]
+
+    def step(self) -> float:
+        # يرسل كل ما تسمح به الحدود الآن؛ يعيد الثواني حتى الإجراء التالي
+        now = time.time()
+        with db_lock:
+            # 'sending' انتهت مهلة حجزها = مُرسِل توقف أثناء الإرسال
+            rows = conn.execute("""SELECT id, item_id, chat_id, text, attempts, created_ts FROM outbox
+                                   WHERE status IN ('pending','sending') AND next_ts<=? ORDER BY id LIMIT 50""", (now,)).fetchall()
+            nxt = conn.execute("SELECT MIN(next_ts) FROM outbox WHERE status='pending' AND next_ts>?", (now,)).fetchone()[0]
+        wait = (nxt - now) if nxt else 5.0
+        if not rows: return wait
+        sent_any = False
+        for row in rows:
+            bucket = self._bucket(row[2])
+            w = max(bucket.wait(), self.global_bucket.wait())
+            if w > 0:
+                wait = min(wait, w); continue
+            if not self._claim(row[0]): continue
+            bucket.take(); self.global_bucket.take()
+            self._deliver(row, bucket); sent_any = True
+        return 0.0 if sent_any else wait
+
+    def _claim(self, oid: int) -> bool:
+        # حجز ذري يُثبَّت فورًا: لو حجزها عامل آخر قبلنا فـ rowcount = 0
+        now = time.time()
+        with db_lock:
+            WRITER.flush()
+            cur = conn.execute("""UPDATE outbox SET status='sending', owner=?, next_ts=?
+                                  WHERE id=? AND (status='pending' OR status='sending') AND next_ts<=?""",
+                               (worker_id(), now + OUTBOX_CLAIM_SECONDS, oid, now))
+            conn.commit()
+        return cur.rowcount == 1
+
+    def _deliver(self, row, bucket: TokenBucket):
+        oid, item_id, chat_id, text, attempts, created_ts = row
+        with TIMINGS.time("send"):
+            ok, retry_after, err, permanent = tg_send(chat_id, text)
+        now = time.time()
+        if ok:
+            latency = int((now - created_ts) * 1000)
+            WRITER.execute("UPDATE outbox SET status='sent', sent_ts=?, latency_ms=?, attempts=? WHERE id=?",
+                           (now, latency, attempts + 1, oid))
+            WRITER.execute("UPDATE items SET status='sent' WHERE id=? OR digest_id=?", (item_id, item_id))
+            self.stats["sent"] += 1; self.stats["latency_ms"] += latency
+            METRICS.inc("telegram_messages_total", result="sent")
+            METRICS.observe("outbox_latency_seconds", latency / 1000)
+        elif retry_after:
+            # 429: نوقف هذه القناة فقط حتى retry_after ولا نحتسبها محاولة فاشلة
+            logger.warning(f"Telegram 429 — تأجيل {retry_after:.0f}s")
+            bucket.pause(retry_after)
+            WRITER.execute("UPDATE outbox SET status='pending', next_ts=?, last_error=? WHERE id=?", (now + retry_after, err, oid))
+            self.stats["retries"] += 1
+            METRICS.inc("telegram_messages_total", result="429")
+        elif permanent or attempts + 1 >= OUTBOX_MAX_ATTEMPTS:
+            logger.error(f"Telegram error: {err}")
+            WRITER.execute("UPDATE outbox SET status='failed', attempts=?, last_error=? WHERE id=?", (attempts + 1, err, oid))
+            WRITER.execute("UPDATE items SET status='md' WHERE id=? OR digest_id=?", (item_id, item_id))
+            with db_lock:
+                rows = conn.execute("SELECT title, source, url FROM items WHERE id=? OR digest_id=? ORDER BY id",
+                                    (item_id, item_id)).fetchall()
+            for row in rows: save_to_md({"title": row[0], "source": row[1], "url": row[2]})
+            self.stats["failed"] += 1
+            METRICS.inc("telegram_messages_total", result="failed")
+        else:
+            backoff = min(600, 5 * 2 ** attempts) * (0.8 + random.random() * 0.4)
+            logger.warning(f"Telegram error: {err} — إعادة بعد {backoff:.0f}s")
+            WRITER.execute("UPDATE outbox SET status='pending', attempts=?, next_ts=?, last_error=? WHERE id=?",
+                           (attempts + 1, now + backoff, err, oid))
+            self.stats["retries"] += 1
+            METRICS.inc("telegram_messages_total", result="error")
+        WRITER.flush()  # حالة الإرسال تُثبّت فورًا حتى لا تُعاد رسالة مُرسلة بعد انقطاع
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                wait = self.step()
+            except Exception as ex:
+                logger.warning(f"[OUTBOX] dispatcher error: {ex}"); wait = 5.0
+            if wait > 0:
+                self._wake.wait(timeout=min(wait, 5.0)); self._wake.clear()
+
+    def start(self):
+        if not tg_enabled() or not self.active or (self._thread and self._thread.is_alive()): return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="outbox", daemon=True)
+        self._thread.start()
+
+    def notify(self):
+        self._wake.set()
+
+    def drain(self, timeout: float = OUTBOX_DRAIN_SECONDS):
+        # للتشغيل --once: انتظر تفريغ الصادر حتى المهلة؛ المتبقي يُستأنف في التشغيل القادم
+        COALESCER.flush(force=True)  # المجموعات المنتظرة تُصاغ وتدخل الصادر قبل التفريغ
+        if not tg_enabled() or not self.active: return
+        self.start()
+        deadline = time.time() + timeout
+        while self.pending() and time.time() < deadline:
+            time.sleep(0.2)
+        self.stop()
+        left = self.pending()
+        if left: logger.warning(f"[OUTBOX] {left} رسالة معلّقة تُستأنف في التشغيل القادم")
+
+    def stop(self):
+        self._stop.set(); self.notify()
+        if self._thread: self._thread.join(timeout=5)
+
+    def log_stats(self):
+        st = self.stats
+        avg = st["latency_ms"] / st["sent"] if st["sent"] else 0
+        logger.info(f"[OUTBOX] sent={st['sent']} retries={st['retries']} failed={st['failed']} avg_latency={avg:.0f}ms")
+
+DISPATCHER = OutboxDispatcher()
+
 # ====== Facebook Composer + Image Grabber ======
 FACEBOOK_MODE = os.getenv("FACEBOOK_MODE","0") == "1"
 FACEBOOK_TEMPLATE = os.getenv("FACEBOOK_TEMPLATE","summary").lower()
 FACEBOOK_MAX_IMAGES = int(os.getenv("FACEBOOK_MAX_IMAGES","3"))
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(8 * 1024 * 1024)))
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(40_000_000)))
+IMAGE_CONCURRENCY = max(1, int(os.getenv("IMAGE_CONCURRENCY", "4")))
+IMAGE_STORE = os.path.join(OUT_DIR, "images", "store")
 
-def extract_og_images(page_url: str):
-    imgs = []
+def extract_og_images(page_url: str, html_text: str = None):
+    # html_text: صفحة المقال المُنزّلة سابقًا (extract_item) لتجنب تنزيلها مرة ثانية
     try:
-        html_text = http_get(page_url, tries=3)
-        soup = BeautifulSoup(html_text, PARSER)
-        for tag in soup.select('meta[property="og:image"], meta[name="og:image"]'):
-            u = tag.get("content"); 
-            if u: imgs.append(urljoin(page_url, u.strip()))
-        for tag in soup.select('meta[name="twitter:image"], meta[property="twitter:image"]'):
-            u = tag.get("content"); 
-            if u: imgs.append(urljoin(page_url, u.strip()))
-        art = soup.select_one("article") or soup
-        for im in art.select("img"):
-            u = im.get("src") or im.get("data-src")
-            if u and not u.startswith("data:"):
-                imgs.append(urljoin(page_url, u.strip()))
+        if html_text is None:
+            html_text = get_page(page_url)
+        return EXTRACTOR.run(page_images, html_text, page_url, FACEBOOK_MAX_IMAGES)
     except Exception as ex:
         logger.warning(f"extract_og_images failed: {ex}")
-    uniq, seen = [], set()
-    for u in imgs:
-        if u and u not in seen:
-            seen.add(u); uniq.append(u)
-    return uniq
+        return []
+
+# ====== تنزيل الصور: متوازٍ + متدفق + تمييز النوع بالبايتات + مخزن حسب المحتوى ======
+def sniff_image(head: bytes):
+    # يعيد (الامتداد، العرض، الارتفاع) من أول البايتات؛ الأبعاد None إن لم تُعرف بعد
+    if head[:8] == b"\x89PNG\r\n\x1a\n":
+        w, h = struct.unpack(">II", head[16:24]) if len(head) >= 24 else (None, None)
+        return ".png", w, h
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        w, h = struct.unpack("<HH", head[6:10]) if len(head) >= 10 else (None, None)
+        return ".gif", w, h
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        w = h = None
+        if head[12:16] == b"VP8X" and len(head) >= 30:
+            w = 1 + int.from_bytes(head[24:27], "little"); h = 1 + int.from_bytes(head[27:30], "little")
+        elif head[12:16] == b"VP8 " and len(head) >= 30:
+            w, h = (v & 0x3FFF for v in struct.unpack("<HH", head[26:30]))
+        elif head[12:16] == b"VP8L" and len(head) >= 25:
+            b = int.from_bytes(head[21:25], "little"); w = (b & 0x3FFF) + 1; h = ((b >> 14) & 0x3FFF) + 1
+        return ".webp", w, h
+    if head[:3] == b"\xff\xd8\xff":
+        i = 2
+        while i + 9 < len(head):
+            if head[i] != 0xFF: i += 1; continue
+            marker = head[i+1]
+            if marker in (0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF):
+                h, w = struct.unpack(">HH", head[i+5:i+9])
+                return ".jpg", w, h
+            if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7: i += 2; continue
+            i += 2 + int.from_bytes(head[i+2:i+4], "big")
+        return ".jpg", None, None
+    return None, None, None
+
+def fetch_image_to_store(url: str) -> str:
+    # تنزيل متدفق إلى ملف مؤقت مع sha256؛ الصورة نفسها من أكثر من موقع تُخزّن مرة واحدة
+    ensure_dir(IMAGE_STORE)
+    tmp = os.path.join(IMAGE_STORE, f".tmp-{os.getpid()}-{threading.get_ident()}-{random.randrange(1 << 30)}")
+    sha = hashlib.sha256(); state = {"n": 0, "head": b"", "ext": None}
+    try:
+        with open(tmp, "wb") as f:
+            def sink(chunk):
+                state["n"] += len(chunk)
+                if state["n"] > IMAGE_MAX_BYTES:
+                    raise ValueError(f"image larger than {IMAGE_MAX_BYTES} bytes")
+                if state["ext"] is None or len(state["head"]) < 65536:
+                    state["head"] = (state["head"] + chunk)[:65536]
+                    ext, w, h = sniff_image(state["head"])
+                    if ext is None and len(state["head"]) >= 16:
+                        raise ValueError("not an image")
+                    state["ext"] = ext
+                    if w and h and w * h > IMAGE_MAX_PIXELS:
+                        raise ValueError(f"image too large: {w}x{h}")
+                sha.update(chunk); f.write(chunk)
+            HTTP.get(url, tries=1, sink=sink)
+        if not state["ext"]:
+            raise ValueError("not an image")
+        digest = sha.hexdigest()
+        final = os.path.join(IMAGE_STORE, digest[:2], digest + state["ext"])
+        if os.path.exists(final):
+            os.remove(tmp)
+        else:
+            ensure_dir(os.path.dirname(final)); os.replace(tmp, final)
+        return final
+    finally:
+        if os.path.exists(tmp): os.remove(tmp)
+
+def _link_or_copy(src: str, dst: str):
+    if os.path.exists(dst): os.remove(dst)
+    try: os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
 
 def download_images(urls, base_dir, base_name, max_n=FACEBOOK_MAX_IMAGES):
     ensure_dir(base_dir); saved=[]
-    for i, u in enumerate(urls[:max_n], start=1):
-        try:
-            ua = random.choice(USER_AGENTS)
-            r = requests.get(u, headers={"User-Agent": ua}, timeout=FETCH_TIMEOUT)
-            r.raise_for_status()
-            ext = ".jpg"; ct = r.headers.get("Content-Type","").lower()
-            if "png" in ct: ext=".png"
-            elif "jpeg" in ct or "jpg" in ct: ext=".jpg"
-            elif "webp" in ct: ext=".webp"
-            out_path = os.path.join(base_dir, f"{base_name}_{i}{ext}")
-            with open(out_path,"wb") as f: f.write(r.content)
-            saved.append(out_path)
+    candidates = urls[:max_n * 2]  # احتياط للصور الفاشلة/المكررة
+    def get(u):
+        try: return fetch_image_to_store(u)
         except Exception as ex:
             logger.warning(f"download image failed for {u}: {ex}")
+            return None
+    with ThreadPoolExecutor(max_workers=min(IMAGE_CONCURRENCY, len(candidates) or 1)) as ex:
+        stored = list(ex.map(get, candidates))
+    seen = set()
+    for path in stored:
+        if not path or path in seen: continue
+        seen.add(path)
+        out_path = os.path.join(base_dir, f"{base_name}_{len(saved)+1}{os.path.splitext(path)[1]}")
+        _link_or_copy(path, out_path)
+        saved.append(out_path)
+        if len(saved) >= max_n: break
     return saved
 
-def compose_fb_text(it: dict, template: str = FACEBOOK_TEMPLATE) -> str:
+def compose_fb_text(it: dict, template: str = FACEBOOK_TEMPLATE, hashtags: str = None) -> str:
     title = it.get("title","").strip()
     src   = it.get("source","").strip()
     url   = it.get("url","").strip()
@@ -414,37 +2182,49 @@ def compose_fb_text(it: dict, template: str = FACEBOOK_TEMPLATE) -> str:
     if template == "short":
         return (f"📰 {title}\n"
                 f"المصدر: {src} | {when} (بغداد)\n"
-                f"🔗 {url}\n#أخبار_الأنبار #الرمادي")
+                f"🔗 {url}\n{hashtags or '#أخبار_الأنبار #الرمادي'}")
     if template == "summary":
         return (f"📰 {title}\n{short_sum}\n\n"
                 f"🌍 المصدر: {src}\n🕒 {when} (بغداد)\n"
-                f"🔗 {url}\n#أخبار_الأنبار #الرمادي")
+                f"🔗 {url}\n{hashtags or '#أخبار_الأنبار #الرمادي'}")
     if template == "qa":
         return (f"🗣️ {title}\nشنو تأثير الخبر محليًا؟\n\n"
                 f"المصدر: {src} | {when} (بغداد)\n"
-                f"🔗 {url}\n#أخبار_الأنبار #نقاش")
+                f"🔗 {url}\n{hashtags or '#أخبار_الأنبار'} #نقاش")
     if template == "bilingual":
         en = short_sum[:180]
         return (f"📰 {title}\n{short_sum}\n\n[EN] {en}\n\n"
                 f"Source: {src} | Baghdad Time: {when}\n"
-                f"🔗 {url}\n#Anbar #Ramadi")
+                f"🔗 {url}\n{hashtags or '#Anbar #Ramadi'}")
     return (f"📰 {title}\n{short_sum}\n\n🌍 {src}\n🕒 {when} (بغداد)\n🔗 {url}")
 
-def handle_facebook(it: dict):
+@timed()
+def handle_facebook(it: dict, profiles: list = None):
+    # الصور تُنزَّل مرة واحدة؛ نص المنشور لكل ملف بقالبه ووسومه (facebook/<profile>/<date> عند تعدد الملفات)
+    profiles = profiles or [None]
     date_dir = datetime.now(TZ).strftime("%Y-%m-%d")
-    fb_dir   = os.path.join(OUT_DIR,"facebook",date_dir)
     img_dir  = os.path.join(OUT_DIR,"images",  date_dir)
-    ensure_dir(fb_dir); ensure_dir(img_dir)
+    ensure_dir(img_dir)
     slug = slugify(it.get("title","post")) or "post"
-    text = compose_fb_text(it)
-    img_urls  = extract_og_images(it.get("url","")) if it.get("url") else []
+    img_urls  = it.get("_images")
+    if img_urls is None:
+        img_urls = extract_og_images(it.get("url",""), it.get("_html")) if it.get("url") else []
     saved_imgs = download_images(img_urls, img_dir, slug, max_n=FACEBOOK_MAX_IMAGES) if img_urls else []
-    post_path = os.path.join(fb_dir, f"{slug}.txt")
-    with open(post_path,"w",encoding="utf-8") as f:
-        if saved_imgs: f.write("📷 صور/تفاصيل أكثر بالداخل ⤵️\n")
-        f.write(text+"\n")
-    logger.info(f"Facebook post ready: {post_path} | images: {len(saved_imgs)}")
-    return post_path, saved_imgs
+    paths = []
+    for p in profiles:
+        if p is None or len(ROUTER.profiles) == 1:
+            fb_dir = os.path.join(OUT_DIR,"facebook",date_dir)
+        else:
+            fb_dir = os.path.join(OUT_DIR,"facebook",slugify(p.name) or "profile",date_dir)
+        ensure_dir(fb_dir)
+        text = compose_fb_text(it, p.facebook_template, p.hashtags) if p else compose_fb_text(it)
+        post_path = os.path.join(fb_dir, f"{slug}.txt")
+        with open(post_path,"w",encoding="utf-8") as f:
+            if saved_imgs: f.write("📷 صور/تفاصيل أكثر بالداخل ⤵️\n")
+            f.write(text+"\n")
+        logger.info(f"Facebook post ready: {post_path} | images: {len(saved_imgs)}")
+        paths.append(post_path)
+    return (paths[0] if len(paths) == 1 else paths), saved_imgs
 
 # ====== AI بوست جاهز للسوشيال ======
 AR_POST_SYSTEM = """أنت محرر أخبار بالعربية الفصيحة المقبولة عراقياً.
@@ -468,35 +2248,170 @@ AR_POST_USER_TMPL = """العنوان: {title}
 اكتب بالعربية الفصيحة البسيطة المقبولة للعراقي.
 """
 
+AR_DIGEST_USER_TMPL = """عدة أخبار متلاحقة عن نفس الحدث من مصادر مختلفة:
+{raw_text}
+
+اكتب منشورًا واحدًا لا يتجاوز {limit} حرفًا، يتضمن:
+1) سطر افتتاحي موجز يجمع الحدث.
+2) نقاط (•) بالوقائع من كل المصادر دون تكرار، مع ذكر المصدر عند الاختلاف.
+3) "لماذا يهم؟" بسطر واحد.
+4) المصادر: سطر لكل خبر بالشكل "المصدر | الرابط" والروابط كما هي.
+اكتب بالعربية الفصيحة البسيطة المقبولة للعراقي.
+"""
+
 MAX_POST_LEN = int(os.getenv("MAX_POST_LEN","900"))
 
-def llm_post(title: str, body: str, url: str, source: str) -> str:
-    backend = LLM_BACKEND
-    prompt = AR_POST_USER_TMPL.format(title=title, raw_text=body, limit=MAX_POST_LEN, url=url, source=source)
-    if backend == "openai" and OPENAI_API_KEY:
-        try:
-            from openai import OpenAI
-            client = OpenAI(api_key=OPENAI_API_KEY)
-            resp = client.responses.create(
+def template_post(title: str, body: str, url: str, source: str) -> str:
+    trimmed = (body or "")[:MAX_POST_LEN-100]
+    return f"📰 {title}\n• {trimmed}...\nالمصدر: {source} | {url}"
+
+def template_digest(items: list) -> str:
+    lines = [f"📰 {items[0].get('title') or ''}"]
+    for it in items:
+        lines.append(f"• {it.get('title') or ''}\n  {it.get('source','')} | {it.get('url') or ''}")
+    return "\n".join(lines)
+
+# ====== خدمة الصياغة: عميل واحد + كاش دائم + حد تزامن + ميزانية لكل دورة ======
+class LlmService:
+    def __init__(self, backend: str = LLM_BACKEND):
+        self.backend = backend
+        self.model = OPENAI_MODEL if backend == "openai" else OLLAMA_MODEL
+        self._client = None; self._client_lock = threading.Lock()
+        self._sem = threading.BoundedSemaphore(LLM_CONCURRENCY)
+        self._lock = threading.Lock()
+        self.stats = defaultdict(lambda: {"calls": 0, "errors": 0, "cache_hits": 0, "fallbacks": 0,
+                                          "seconds": 0.0, "tokens_in": 0, "tokens_out": 0})
+        self.reset_budget()
+
+    def enabled(self) -> bool:
+        return (self.backend == "openai" and bool(OPENAI_API_KEY)) or self.backend == "ollama"
+
+    def reset_budget(self):
+        with self._lock:
+            self.spent_seconds, self.spent_tokens = 0.0, 0
+
+    def budget_left(self) -> bool:
+        with self._lock:
+            if LLM_CYCLE_SECONDS and self.spent_seconds >= LLM_CYCLE_SECONDS: return False
+            if LLM_CYCLE_TOKENS and self.spent_tokens >= LLM_CYCLE_TOKENS: return False
+            return True
+
+    def client(self):
+        with self._client_lock:
+            if self._client is None:
+                from openai import OpenAI
+                self._client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL or None,
+                                      timeout=LLM_TIMEOUT, max_retries=1)
+            return self._client
+
+    def cache_key(self, title: str, body: str, tmpl: str = AR_POST_USER_TMPL, limit: int = MAX_POST_LEN) -> str:
+        # المصدر والرابط خارج المفتاح: نفس نص الوكالة من موقعين يُصاغ مرة واحدة
+        raw = "\x1f".join([self.backend, self.model, AR_POST_SYSTEM, tmpl, str(limit),
+                           _nd_text(title), _nd_text(body)])
+        return text_hash(raw)
+
+    def cache_get(self, key: str, url: str, source: str):
+        with db_lock:
+            row = conn.execute("SELECT text, source, url FROM llm_cache WHERE key=?", (key,)).fetchone()
+        if not row: return None
+        WRITER.execute("UPDATE llm_cache SET used_at=? WHERE key=?", (datetime.now(TZ).isoformat(), key))
+        text, old_source, old_url = row
+        if old_url and url: text = text.replace(old_url, url)
+        if old_source and source: text = text.replace(old_source, source)
+        return text
+
+    def cache_put(self, key: str, text: str, url: str, source: str):
+        now = datetime.now(TZ).isoformat()
+        WRITER.execute("INSERT OR REPLACE INTO llm_cache(key, text, source, url, created_at, used_at) VALUES(?,?,?,?,?,?)",
+                       (key, text, source, url, now, now))
+
+    def evict(self):
+        cutoff = (datetime.now(TZ) - timedelta(days=LLM_CACHE_DAYS)).isoformat()
+        WRITER.execute("DELETE FROM llm_cache WHERE used_at < ?", (cutoff,))
+        WRITER.execute("""DELETE FROM llm_cache WHERE key IN
+                          (SELECT key FROM llm_cache ORDER BY used_at DESC LIMIT -1 OFFSET ?)""", (LLM_CACHE_MAX,))
+
+    def _call(self, prompt: str):
+        # يعيد (النص، توكنات الإدخال، توكنات الإخراج)
+        if self.backend == "openai":
+            resp = self.client().responses.create(
                 model=OPENAI_MODEL,
                 input=[{"role":"system","content":AR_POST_SYSTEM},{"role":"user","content":prompt}],
                 temperature=0.4,
             )
-            return (resp.output_text or "").strip()
-        except Exception as ex:
-            logger.warning(f"OpenAI error: {ex}")
-    elif backend == "ollama":
+            usage = getattr(resp, "usage", None)
+            return ((resp.output_text or "").strip(), getattr(usage, "input_tokens", 0) or 0,
+                    getattr(usage, "output_tokens", 0) or 0)
+        r = HTTP.post(f"{OLLAMA_URL}/api/generate", tries=1, check=False, timeout=LLM_TIMEOUT,
+                      json={"model": OLLAMA_MODEL, "prompt": f"<<SYS>>{AR_POST_SYSTEM}\n<</SYS>>\n{prompt}", "stream": False, "options":{"temperature":0.3}})
+        r.raise_for_status()
+        j = r.json()
+        return (j.get("response") or "").strip(), j.get("prompt_eval_count") or 0, j.get("eval_count") or 0
+
+    def compose(self, title: str, body: str, url: str, source: str,
+                tmpl: str = AR_POST_USER_TMPL, limit: int = MAX_POST_LEN, fallback: str = None) -> str:
+        fallback = fallback or template_post(title, body, url, source)
+        if not self.enabled():
+            return fallback
+        st = self.stats[self.backend]
+        key = self.cache_key(title, body, tmpl, limit)
+        cached = self.cache_get(key, url, source)
+        if cached:
+            with self._lock: st["cache_hits"] += 1
+            return cached
+        if not self.budget_left():
+            with self._lock: st["fallbacks"] += 1
+            return fallback
+        prompt = tmpl.format(title=title, raw_text=body, limit=limit, url=url, source=source)
+        t0 = time.time()
         try:
-            r = requests.post("http://localhost:11434/api/generate",
-                              json={"model": OLLAMA_MODEL, "prompt": f"<<SYS>>{AR_POST_SYSTEM}\n<</SYS>>\n{prompt}", "stream": False, "options":{"temperature":0.3}},
-                              timeout=60)
-            if r.status_code == 200:
-                return (r.json().get("response") or "").strip()
+            with self._sem:
+                text, tin, tout = self._call(prompt)
         except Exception as ex:
-            logger.warning(f"Ollama error: {ex}")
-    # fallback
-    trimmed = (body or "")[:MAX_POST_LEN-100]
-    return f"📰 {title}\n• {trimmed}...\nالمصدر: {source} | {url}"
+            logger.warning(f"{self.backend} error: {ex}")
+            text, tin, tout = "", 0, 0
+            with self._lock: st["errors"] += 1
+        dt = time.time() - t0
+        with self._lock:
+            st["calls"] += 1; st["seconds"] += dt; st["tokens_in"] += tin; st["tokens_out"] += tout
+            self.spent_seconds += dt; self.spent_tokens += tin + tout
+        if not text:
+            with self._lock: st["fallbacks"] += 1
+            return fallback
+        self.cache_put(key, text, url, source)
+        return text
+
+    def compose_digest(self, items: list) -> str:
+        # عدة أخبار عن حدث واحد → طلب واحد؛ كل خبر كتلة: عنوان + مصدر | رابط + مقتطف
+        blocks = [f"{i}) {it.get('title') or ''}\n{it.get('source','')} | {it.get('url') or ''}\n{(it.get('summary') or '')[:600]}"
+                  for i, it in enumerate(items, 1)]
+        title = " | ".join(it.get("title") or "" for it in items)
+        urls = "\n".join(it.get("url") or "" for it in items)
+        sources = "، ".join(dict.fromkeys(it.get("source","") for it in items))
+        limit = min(3500, MAX_POST_LEN + 200 * (len(items) - 1))
+        return self.compose(title, "\n\n".join(blocks), urls, sources,
+                            tmpl=AR_DIGEST_USER_TMPL, limit=limit, fallback=template_digest(items))
+
+    def log_stats(self):
+        for backend, st in self.stats.items():
+            avg = st["seconds"] / st["calls"] if st["calls"] else 0.0
+            logger.info(f"[LLM] {backend}: calls={st['calls']} cache_hits={st['cache_hits']} errors={st['errors']} "
+                        f"fallbacks={st['fallbacks']} avg={avg:.2f}s tokens={st['tokens_in']}/{st['tokens_out']}")
+
+LLM = LlmService()
+
+@timed()
+def llm_post(title: str, body: str, url: str, source: str) -> str:
+    return LLM.compose(title, body, url, source)
+
+@timed()
+def llm_digest(items: list) -> str:
+    text = LLM.compose_digest(items)
+    # الرابط الذي أسقطته الصياغة يُلحق في الآخر: كل مصدر له رابطه في الرسالة
+    missing = [it for it in items if (it.get("url") or "") not in text]
+    if missing:
+        text += "\n" + "\n".join(f"🔗 {it.get('source','')} | {it.get('url') or ''}" for it in missing)
+    return text
 
 def tg_format_ai_post(ai_text: str, locality: str) -> str:
     if PREFIX_LOCALITY and locality:
@@ -528,80 +2443,973 @@ def load_sources():
             logger.warning(f"sources.json parsing failed: {ex}")
     return DEFAULT_SOURCES
 
-# ====== دورة الجمع/النشر ======
-def collect_once():
-    sources = load_sources()
-    total_new = 0
-    row = conn.execute("SELECT val FROM meta WHERE key='zero_streak'").fetchone()
-    zero_streak = int(row[0]) if row and str(row[0]).isdigit() else 0
+# ====== مراحل المعالجة (مشتركة بين الوضع التسلسلي والـ pipeline) ======
+def fetch_source(src: dict) -> list:
+    try:
+        return _fetch_source(src)
+    finally:
+        WRITER.flush()  # لا تبقى معاملة الكتابة مفتوحة أثناء تنزيل المقالات (تحجب العمال الآخرين)
+
+def _fetch_source(src: dict) -> list:
+    name = src.get("name","?")
+    if not lease_acquire(name):
+        METRICS.inc("source_fetch_total", source=name, result="leased")
+        logger.info(f"[LEASE] '{name}' مع عامل آخر"); return []
+    if source_is_disabled(name):
+        METRICS.inc("source_fetch_total", source=name, result="disabled")
+        logger.warning(f"[SKIP] '{name}' معطّل مؤقتًا"); return []
+    try:
+        with TIMINGS.time("fetch"):
+            items = fetch_rss(src) if src.get("type") == "rss" else fetch_scrape(src)
+        if items is None:
+            METRICS.inc("source_fetch_total", source=name, result="not_modified")
+            logger.info(f"{name}: not modified (304)")
+            sched_observe(name, 0, [])
+            source_mark_ok(name); return []
+        logger.info(f"{name}: fetched {len(items)} items")
+        METRICS.inc("source_items_total", len(items), source=name)
+        if not _cycle_fetch.get(name, (0,))[0]:  # ملف بلا عناصر أصلًا (لا "كلها مرئية")
+            METRICS.inc("source_fetch_total", source=name, result="empty")
+            source_mark_fail(name, cool_minutes=60); return []
+        METRICS.inc("source_fetch_total", source=name, result="ok")
+        source_mark_ok(name)
+        return items
+    except CircuitOpen as ex:
+        # عطل الموقع يعالجه القاطع؛ لا يُحتسب فشلًا للمصدر
+        METRICS.inc("source_fetch_total", source=name, result="breaker")
+        logger.warning(f"[SKIP] '{name}': {ex}"); return []
+    except Exception as ex:
+        METRICS.inc("source_fetch_total", source=name, result="error")
+        logger.error(f"Fetch failed for {name}: {ex}")
+        source_mark_fail(name); return []
+
+def _merge_routes(old: dict, new: dict) -> dict:
+    # بترتيب الملفات؛ نتائج النص الكامل أدق (المدينة) فتُقدَّم
+    return {p.name: new.get(p.name) or old[p.name] for p in ROUTER.profiles if p.name in new or p.name in old}
+
+def filter_item(it: dict) -> bool:
+    if _filter_item(it): return True
+    hwm_done(it); return False
+
+def _filter_item(it: dict) -> bool:
+    # المرور الرخيص: العنوان + ملخص RSS + الرابط فقط، قبل أي تنزيل للمقال
+    title = it.get("title") or ""; url = it.get("url") or ""; content = it.get("summary") or ""
+    if not title or not url: return False
+    # مسح واحد لكل الملفات؛ الملخص القصير لا يكفي للحكم فيبقى الخبر "معلّقًا" حتى الاستخراج
+    with TIMINGS.time("relevance"):
+        routes = ROUTER.route_text(f"{title}\n{content}")
+    if not routes:
+        if len(content) >= LAZY_MIN_SUMMARY:
+            return False
+        it["_undecided"] = True
+    # منع التكرار لكل نطاق: يُسقط الملفات التي نشرت الخبر سابقًا (المعلّق يُفحص على كل النطاقات)
+    scopes = {ROUTER.by_name[n].scope for n in routes} or set(ROUTER.scopes)
+    with TIMINGS.time("dedup"):
+        dup = duplicate_scopes(title, url, content, scopes)
+    routes = {n: h for n, h in routes.items() if ROUTER.by_name[n].scope not in dup}
+    if dup == scopes:
+        logger.info(f"[SKIP] duplicate/similar: {title}"); return False
+    it["_routes"] = routes
+    return True
+
+def extract_item(it: dict) -> bool:
+    # المرور المكلف: تنزيل المقال واستخراجه للناجين فقط
+    undecided = it.pop("_undecided", False)
+    if SKIP_EXTRACT_ON_MATCH and not undecided:
+        return True
+    WRITER.flush()  # لا معاملة مفتوحة أثناء التنزيل (تحجب حجوزات وعقود العمال الآخرين)
+    with TIMINGS.time("extract"):
+        full = fetch_article_text(it)
+    failed = it.pop("_fetch_failed", False)
+    if full:
+        it["summary"] = full[:1500]
+        if ROUTER.filtering:
+            with TIMINGS.time("relevance"):
+                it["_routes"] = _merge_routes(it.get("_routes") or {},
+                                              ROUTER.route_text(f"{it.get('title') or ''}\n{it['summary']}"))
+    if it.get("_routes"): return True
+    if not failed: hwm_done(it)  # فشل التنزيل قبل الحكم: يبقى معلّقًا ويُعاد في الجلب التالي
+    return False
+
+def claim_item(it: dict) -> bool:
+    # فحص التشابه ثم الحجز بـ INSERT OR IGNORE لكل نطاق؛ الحجز يمنع تكرار الخبر من مصدر آخر في نفس الدورة.
+    # BEGIN IMMEDIATE … COMMIT قصيرة لكل خبر: الحجز مُثبَّت قبل أي إرسال، وقفل الكتابة لا يُحمل أثناء تنزيل الخبر التالي
+    title = it.get("title") or ""; content = it.get("summary") or ""
+    routes = it.get("_routes") or {}
+    claims, taken = [], set()
+    sig = nd_signature(title, content)  # خارج القفل: حساب خالص
+    with db_lock, TIMINGS.time("dedup"):
+        WRITER.begin_immediate()
+        similar = nd_similar_scopes(title, content, {ROUTER.by_name[n].scope for n in routes}, sig)
+        for n in routes:
+            p = ROUTER.by_name[n]
+            # الملف الأول في نطاق مشترك يأخذ الخبر
+            if p.scope in taken or p.scope in similar: continue
+            taken.add(p.scope)
+            if save_item(it, p.scope, sig):
+                claims.append((p, it["_ids"][p.scope]))
+        hwm_done(it); hwm_commit(it.get("source",""))  # المعرّف مرئي في نفس معاملة الحجز
+        WRITER.flush()
+    if not claims:
+        logger.info(f"[SKIP] duplicate/similar: {title}"); return False
+    it["_claims"] = claims
+    METRICS.inc("source_claims_total", source=it.get("source",""))
+    return True
+
+def compose_item(it: dict) -> str:
+    # الصياغة مرة واحدة للخبر مهما كان عدد الملفات؛ سطر المنطقة يُضاف لكل ملف عند النشر
+    title = it.get("title") or ""; url = it.get("url") or ""; content = it.get("summary") or ""
+    with TIMINGS.time("llm"):
+        return llm_post(title, content, url, it.get("source",""))
+
+def publish_item(it: dict, ai_text: str):
+    # الإرسال الفعلي في DISPATCHER؛ هنا يُكتب في صندوق الصادر فقط
+    routes = it.get("_routes") or {}; md = False
+    for p, item_id in it.get("_claims") or []:
+        hits = routes.get(p.name) or {}
+        if TG_TOKEN and (p.chat_id or TG_CHAT_ID):
+            outbox_enqueue(it, tg_format_ai_post(ai_text, hits.get("locality") or ""), chat_id=p.chat_id, item_id=item_id)
+            mark_item_status(it, "queued", item_id)
+        else:  # بدون تيليجرام: احفظ لسجل (مرة واحدة للخبر)
+            if not md: save_to_md(it); md = True
+            mark_item_status(it, "md", item_id)
+        METRICS.inc("routed_items_total", profile=p.name)
+    WRITER.maybe_flush()
+    publish_facebook(it)
+
+def publish_facebook(it: dict):
+    if not FACEBOOK_MODE: return
+    try:
+        with TIMINGS.time("facebook"):
+            handle_facebook(it, [p for p, _ in it.get("_claims") or []])
+    except Exception as ex:
+        logger.warning(f"facebook compose failed: {ex}")
+
+def dispatch_item(it: dict):
+    # بعد الحجز: صياغة + صندوق الصادر فورًا، أو انتظار نافذة الدمج
+    if COALESCER.enabled():
+        COALESCER.add(it)
+    else:
+        publish_item(it, compose_item(it))
+
+# ====== دمج الأخبار المتلاحقة (Digest) ======
+# عند حدث واحد تنشر عدة مصادر خلال دقائق؛ بدل رسالة وصياغة لكل خبر: الأخبار المحجوزة تنتظر
+# COALESCE_WINDOW ثانية من أول خبر في مجموعتها، ثم صياغة واحدة ورسالة واحدة بروابط كل المصادر
+COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW", "0"))
+COALESCE_MAX = max(2, int(os.getenv("COALESCE_MAX", "6")))
+COALESCE_SIMILARITY = float(os.getenv("COALESCE_SIMILARITY", "0.2"))
+
+def _coalesce_words(it: dict) -> set:
+    text = _nd_text(f"{it.get('title') or ''} {(it.get('summary') or '')[:300]}")
+    return {w for w in text.split() if len(w) > 2}
+
+def _jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+def publish_digest(group: list, ai_text: str):
+    # رسالة واحدة لكل ملف باسم الخبر الأول؛ البقية تُربط به (digest_id) فتتبع حالته عند الإرسال/الفشل
+    lead = group[0]; routes = lead.get("_routes") or {}
+    tg = False
+    for p, item_id in lead.get("_claims") or []:
+        others = [i for it in group[1:] for q, i in it.get("_claims") or [] if q.name == p.name]
+        hits = routes.get(p.name) or {}
+        if TG_TOKEN and (p.chat_id or TG_CHAT_ID):
+            outbox_enqueue(lead, tg_format_ai_post(ai_text, hits.get("locality") or ""), chat_id=p.chat_id, item_id=item_id)
+            status = "queued"; tg = True
+        else:
+            status = "md"
+        mark_item_status(lead, status, item_id)
+        WRITER.executemany("UPDATE items SET status=?, digest_id=? WHERE id=?", [(status, item_id, i) for i in others])
+        METRICS.inc("routed_items_total", len(group), profile=p.name)
+    if not tg:
+        for it in group: save_to_md(it)
+    WRITER.maybe_flush()
+    for it in group: publish_facebook(it)
+
+class Coalescer:
+    # المجموعة = نفس الملفات + نفس المنطقة + تشابه كلمات ≥ COALESCE_SIMILARITY مع أحد أعضائها
+    def __init__(self, window: float = COALESCE_WINDOW):
+        self.window = window
+        self.groups = []  # {"key", "t0", "items", "words"}
+        self.stats = {"items": 0, "messages": 0}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def _key(self, it: dict):
+        names = tuple(p.name for p, _ in it.get("_claims") or [])
+        routes = it.get("_routes") or {}
+        return names, next(((routes.get(n) or {}).get("locality") or "" for n in names), "")
+
+    def add(self, it: dict):
+        key, words = self._key(it), _coalesce_words(it)
+        with self._lock:
+            for g in self.groups:
+                if g["key"] == key and len(g["items"]) < COALESCE_MAX \
+                        and any(_jaccard(words, w) >= COALESCE_SIMILARITY for w in g["words"]):
+                    g["items"].append(it); g["words"].append(words)
+                    full = len(g["items"]) >= COALESCE_MAX
+                    break
+            else:
+                self.groups.append({"key": key, "t0": time.time(), "items": [it], "words": [words]})
+                full = False
+        # held في القاعدة: لو توقفت العملية قبل الإرسال يعيده recover_claimed
+        for _, item_id in it.get("_claims") or []:
+            WRITER.execute("UPDATE items SET status='held' WHERE id=? AND status='pending'", (item_id,))
+        self.start()
+        if full: self._wake.set()
+
+    def flush(self, force: bool = False) -> int:
+        # المجموعات التي انتهت نافذتها (أو امتلأت) → صياغة + صندوق الصادر؛ يعيد عدد الرسائل
+        with self._flush_lock:
+            now = time.time()
+            with self._lock:
+                due = [g for g in self.groups
+                       if force or now - g["t0"] >= self.window or len(g["items"]) >= COALESCE_MAX]
+                self.groups = [g for g in self.groups if g not in due]
+            n_items, done, failed = 0, 0, []
+            for g in due:
+                group = g["items"]
+                try:
+                    if len(group) == 1:
+                        publish_item(group[0], compose_item(group[0]))
+                    else:
+                        with TIMINGS.time("llm"):
+                            text = llm_digest(group)
+                        publish_digest(group, text)
+                        logger.info(f"[COALESCE] {len(group)} أخبار → رسالة واحدة: {group[0].get('title')}")
+                except Exception as ex:
+                    # تبقى المجموعة (في الذاكرة و held في القاعدة) وتُعاد بعد نافذة أخرى
+                    logger.warning(f"[COALESCE] publish failed, retry in {self.window:.0f}s: {ex}")
+                    g["t0"] = time.time(); failed.append(g)
+                    continue
+                n_items += len(group); done += 1
+                METRICS.observe("coalesce_group_size", len(group))
+            if failed:
+                with self._lock: self.groups.extend(failed)
+            if not done: return 0
+            WRITER.flush()
+            self.stats["items"] += n_items; self.stats["messages"] += done
+            METRICS.inc("coalesce_items_total", n_items); METRICS.inc("coalesce_messages_total", done)
+            DISPATCHER.notify()
+            return done
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.flush()
+            except Exception as ex:
+                logger.warning(f"[COALESCE] flush error: {ex}")
+            with self._lock:
+                nxt = min((g["t0"] + self.window for g in self.groups), default=None)
+            wait = 5.0 if nxt is None else max(0.05, nxt - time.time())
+            self._wake.wait(timeout=min(wait, 5.0)); self._wake.clear()
+
+    def start(self):
+        if not self.enabled() or (self._thread and self._thread.is_alive()): return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="coalesce", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set(); self._wake.set()
+        if self._thread: self._thread.join(timeout=5)
+        self.flush(force=True)
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(len(g["items"]) for g in self.groups)
+
+    def held_ids(self) -> set:
+        with self._lock:
+            return {i for g in self.groups for it in g["items"] for _, i in it.get("_claims") or []}
+
+    def log_stats(self):
+        if not self.enabled(): return
+        st = self.stats
+        ratio = st["items"] / st["messages"] if st["messages"] else 0.0
+        logger.info(f"[COALESCE] items={st['items']} messages={st['messages']} ratio={ratio:.2f} waiting={self.pending()}")
+
+COALESCER = Coalescer()
+
+# ====== استعادة المحجوز غير المُرسل ======
+RECOVER_MAX_HOURS = 6  # أقدم من هذا لا يُنشر متأخرًا: يُحفظ في latest.md فقط
+
+def recover_claimed():
+    # خبر محجوز بلا رسالة في الصادر بعد مهلة عقد العامل = توقفت العملية بين الحجز والإرسال (أو في نافذة الدمج).
+    # عامل واحد كل LEASE_SECONDS؛ recovering يُعاد إن توقف من استعاده أيضًا
+    if not _meta_claim("recover_at", LEASE_SECONDS): return 0
+    now = datetime.now(TZ)
+    upper = (now - timedelta(seconds=LEASE_SECONDS + 2 * COALESCE_WINDOW)).isoformat()
+    lower = (now - timedelta(hours=RECOVER_MAX_HOURS)).isoformat()
+    held = COALESCER.held_ids()
+    with db_lock:
+        WRITER.flush()
+        rows = conn.execute("""SELECT id, source, title, url, published_at, scope, created_at FROM items i
+                               WHERE status IN ('pending','held','recovering') AND created_at < ?
+                                 AND NOT EXISTS (SELECT 1 FROM outbox o WHERE o.item_id = i.id)""", (upper,)).fetchall()
+        rows = [r for r in rows if r[0] not in held]
+        conn.executemany("UPDATE items SET status='recovering' WHERE id=?", [(r[0],) for r in rows])
+        conn.commit()
+    items = {}
+    for item_id, source, title, url, published_at, scope, created_at in rows:
+        p = next((p for p in ROUTER.profiles if p.scope == (scope or "")), None)
+        if created_at < lower or p is None:  # قديم أو نطاق لم يعد له ملف
+            WRITER.execute("UPDATE items SET status='md' WHERE id=?", (item_id,))
+            save_to_md({"title": title, "source": source, "url": url}); continue
+        it = items.setdefault(url, {"source": source, "title": title, "url": url, "published_at": published_at or "",
+                                    "summary": "", "_id": item_id, "_ids": {}, "_claims": [], "_routes": {}})
+        it["_ids"][scope or ""] = item_id; it["_claims"].append((p, item_id))
+    for it in items.values():
+        hit = PAGES.get(it["url"])
+        it["summary"] = ((hit[1] if hit else "") or "")[:1500]
+        logger.warning(f"[RECOVER] محجوز لم يُرسل: {it['title']}")
+        try:
+            dispatch_item(it)
+        except Exception as ex:
+            logger.warning(f"[RECOVER] failed for {it['url']}: {ex}")
+    WRITER.flush()
+    if rows: METRICS.inc("recovered_items_total", len(rows))
+    return len(items)
+
+# ====== الاستخراج الكسول ======
+LAZY_MIN_SUMMARY = int(os.getenv("LAZY_MIN_SUMMARY", "120"))
+SKIP_EXTRACT_ON_MATCH = os.getenv("SKIP_EXTRACT_ON_MATCH", "0") == "1"
+
+# ====== Pipeline: مراحل متوازية بطوابير محدودة ======
+PIPELINE = os.getenv("PIPELINE", "0") == "1"
+FETCH_CONCURRENCY = max(1, int(os.getenv("FETCH_CONCURRENCY", "8")))
+PER_HOST_CONCURRENCY = max(1, int(os.getenv("PER_HOST_CONCURRENCY", "2")))
+QUEUE_SIZE = max(1, int(os.getenv("QUEUE_SIZE", "50")))
+
+_DONE = object()
+
+async def _stage(name: str, inq, outq, fn, workers: int = 1, downstream: int = 1):
+    # fn(x) -> قائمة مخرجات؛ put على طابور ممتلئ ينتظر (ضغط عكسي على المرحلة السابقة)
+    async def worker():
+        while True:
+            x = await inq.get()
+            if x is _DONE:
+                return
+            try:
+                for y in await fn(x):
+                    if outq is not None: await outq.put(y)
+            except Exception as ex:
+                # الخبر يُسقط من هذه الدورة فقط: معرّفه لم يُعلَّم مرئيًا (hwm_done) فيُعاد في الجلب التالي
+                logger.warning(f"[PIPE] {name} failed: {ex}")
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    if outq is not None:
+        for _ in range(downstream): await outq.put(_DONE)
+
+async def collect_pipeline(sources: list) -> int:
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY + LLM_CONCURRENCY + 4))  # + نشر، فلترة، حجز
+    host_sems = defaultdict(lambda: asyncio.Semaphore(PER_HOST_CONCURRENCY))
+    q_src = asyncio.Queue()
+    for src in sources: q_src.put_nowait(src)
+    for _ in range(FETCH_CONCURRENCY): q_src.put_nowait(_DONE)
+    q_items, q_new, q_full, q_fresh, q_posts = (asyncio.Queue(QUEUE_SIZE) for _ in range(5))
+    sent = [0]
+
+    async def do_fetch(src):
+        async with host_sems[urlparse(src.get("url","")).netloc]:
+            return await asyncio.to_thread(fetch_source, src)
+
+    # الفلترة والحجز في خيوط: استعلامات SQLite وبصمات MinHash، وBEGIN IMMEDIATE قد ينتظر قفل عامل آخر
+    # (حتى مهلة sqlite) فلا تتجمد الحلقة وبقية المراحل معه
+    async def do_filter(it):
+        return [it] if await asyncio.to_thread(filter_item, it) else []
+
+    async def do_extract(it):
+        async with host_sems[urlparse(it.get("url","")).netloc]:
+            return [it] if await asyncio.to_thread(extract_item, it) else []
+
+    async def do_claim(it):
+        # الفحص + الحجز ذريّان تحت db_lock داخل claim_item، وهو يثبّت الحجز فورًا
+        return [it] if await asyncio.to_thread(claim_item, it) else []
+
+    async def do_compose(it):
+        if COALESCER.enabled():
+            COALESCER.add(it); sent[0] += 1
+            return []
+        return [(it, await asyncio.to_thread(compose_item, it))]
+
+    async def do_publish(job):
+        await asyncio.to_thread(publish_item, *job)
+        sent[0] += 1
+        return []
+
+    await asyncio.gather(
+        _stage("fetch",   q_src,   q_items, do_fetch,   FETCH_CONCURRENCY),
+        _stage("filter",  q_items, q_new,   do_filter,  downstream=FETCH_CONCURRENCY),
+        _stage("extract", q_new,   q_full,  do_extract, FETCH_CONCURRENCY),
+        _stage("dedup",   q_full,  q_fresh, do_claim,   downstream=LLM_CONCURRENCY),
+        _stage("compose", q_fresh, q_posts, do_compose, LLM_CONCURRENCY),
+        _stage("publish", q_posts, None,    do_publish),
+    )
+    return sent[0]
+
+# ====== جدولة تكيفية لكل مصدر ======
+ADAPTIVE_POLL = os.getenv("ADAPTIVE_POLL", "1") == "1"
+SCHED_MIN_SECONDS = float(os.getenv("SCHED_MIN_SECONDS", "120"))
+SCHED_MAX_SECONDS = float(os.getenv("SCHED_MAX_SECONDS", "21600"))
+SCHED_JITTER = float(os.getenv("SCHED_JITTER", "0.15"))
+SCHED_TARGET_RATIO = float(os.getenv("SCHED_TARGET_RATIO", "0.05"))
 
+_cycle_fetch = {}  # name -> (عدد عناصر آخر جلب، أزمنة نشرها، الجديد منها)؛ فارغة عند 304
+
+def sched_observe(name: str, count: int, stamps: list, new: int = 0):
+    # count = عناصر الملف كلها وأزمنة نشرها؛ new = معرّفات لم يرها HWM من قبل (معدل نشر المصدر،
+    # لا ما اجتاز فلتر الأنبار: مصدر لا يطابق الفلتر إلا نادرًا يبقى يُجلب بقدر ما ينشر)
+    _cycle_fetch[name] = (count, stamps, new)
+
+def sched_load() -> dict:
+    with db_lock:
+        return {n: d for n, d in conn.execute("SELECT name, next_due FROM source_sched")}
+
+def sched_due(sources: list, now: float = None) -> list:
+    now = now or time.time(); due = sched_load()
+    return [s for s in sources if due.get(s.get("name","?"), 0) <= now]
+
+def _publish_gap(stamps: list):
+    # الفاصل الوسيط بين أحدث المنشورات (ثوانٍ) = تقدير معدل نشر المصدر
+    stamps = sorted(stamps, reverse=True)[:10]
+    gaps = sorted(a - b for a, b in zip(stamps, stamps[1:]) if a > b)
+    return gaps[len(gaps) // 2] if gaps else None
+
+def sched_update(sources: list):
+    # بعد كل دورة: الفترة تتناسب مع نسبة الجديد في كل جلب (متوسط متحرك) وتميل نحو نصف فاصل النشر
+    now = time.time()
+    with db_lock:
+        rows = {r[0]: r[1:] for r in conn.execute("SELECT name, interval_s, new_ratio, pub_gap, fetches FROM source_sched")}
+    pushed = websub_active()
     for src in sources:
         name = src.get("name","?")
-        if source_is_disabled(name):
-            logger.warning(f"[SKIP] '{name}' معطّل مؤقتًا"); continue
+        interval, ratio, gap, fetches = rows.get(name, (POLL_SECONDS, 0.0, None, 0))
+        interval = interval or POLL_SECONDS
+        if name in _cycle_fetch:
+            fetched, stamps, new = _cycle_fetch[name]
+            cur = new / fetched if fetched else 0.0
+            ratio = cur if not fetches else 0.7 * (ratio or 0.0) + 0.3 * cur
+            g = _publish_gap(stamps)
+            if g: gap = g if not gap else 0.7 * gap + 0.3 * g
+            # ضعف النسبة المستهدفة = نجلب متأخرين → ×0.7؛ ربعها → ×1.4؛ بلا جديد → ×1.4
+            interval *= min(1.4, max(0.5, math.sqrt(SCHED_TARGET_RATIO / ratio))) if ratio > 0 else 1.4
+            if gap: interval = (interval + gap / 2) / 2
+            interval = min(SCHED_MAX_SECONDS, max(SCHED_MIN_SECONDS, interval))
+            fetches = (fetches or 0) + 1
+        # مصدر معطّل/فاشل يبقى على فترته الحالية حتى لا يُعاد اختياره فورًا
+        # مصدر عليه اشتراك WebSub فعّال: الجلب الدوري احتياط فقط
+        due_in = max(interval, WEBSUB_POLL_SECONDS) if name in pushed else interval
+        next_due = now + due_in * (1 + random.uniform(-SCHED_JITTER, SCHED_JITTER))
+        WRITER.execute("""INSERT INTO source_sched(name, interval_s, next_due, new_ratio, pub_gap, fetches, last_fetch)
+                          VALUES(?,?,?,?,?,?,?)
+                          ON CONFLICT(name) DO UPDATE SET interval_s=excluded.interval_s, next_due=excluded.next_due,
+                              new_ratio=excluded.new_ratio, pub_gap=excluded.pub_gap, fetches=excluded.fetches,
+                              last_fetch=excluded.last_fetch""",
+                       (name, interval, next_due, ratio, gap, fetches, now))
+    _cycle_fetch.clear()
+
+def run_scheduler():
+    # وضع الخدمة: طابور أولوية بمواعيد المصادر بدل جولة كاملة كل POLL_SECONDS
+    by_name, heap, loaded = {}, [], 0.0
+    while True:
+        if time.time() - loaded > POLL_SECONDS:
+            by_name = {s.get("name","?"): s for s in load_sources()}; loaded = time.time()
+            due = sched_load()
+            heap = [(due.get(n, 0.0), n) for n in by_name]; heapq.heapify(heap)
+        now = time.time(); batch = []
+        while heap and heap[0][0] <= now:
+            _, name = heapq.heappop(heap)
+            if name in by_name: batch.append(by_name[name])
+        if batch:
+            collect_once(batch)
+            due = sched_load(); now = time.time()
+            retry = lease_retry_at([s.get("name","?") for s in batch])
+            for src in batch:
+                name = src.get("name","?")
+                nxt = due.get(name, now + POLL_SECONDS)
+                if nxt <= now:  # العقد مع عامل آخر فلم يُحدَّث الموعد: لا نعيد المحاولة قبل أن يصبح أخذه ممكنًا
+                    nxt = max(retry.get(name, now + LEASE_REFETCH_SECONDS), now + 1.0)
+                heapq.heappush(heap, (nxt, name))
+        wait = heap[0][0] - time.time() if heap else POLL_SECONDS
+        time.sleep(min(max(wait, 1.0), 60.0))
+
+# ====== استقبال الدفع: WebSub + إشعارات POST (وضع --receiver) ======
+WEBSUB_PORT = int(os.getenv("WEBSUB_PORT", "8088"))
+WEBSUB_HOST = os.getenv("WEBSUB_HOST", "127.0.0.1")
+WEBSUB_CALLBACK = os.getenv("WEBSUB_CALLBACK", "").rstrip("/")
+WEBSUB_SECRET = os.getenv("WEBSUB_SECRET", "")
+WEBSUB_LEASE_SECONDS = int(os.getenv("WEBSUB_LEASE_SECONDS", "864000"))
+WEBSUB_POLL_SECONDS = float(os.getenv("WEBSUB_POLL_SECONDS", "10800"))
+WEBSUB_RENEW_EVERY = 600
+PUSH_QUEUE_SIZE = 1000
+_hubs_seen = set()
+_websub_wake = threading.Event()  # hub جديد: اشترك الآن بدل انتظار دورة التجديد
+_receiver_running = threading.Event()  # PushReceiver يعمل في هذه العملية (شرط إبطاء الجلب الدوري)
+
+def websub_discover(src: dict, parsed):
+    # <link rel="hub"> في الملف: يُسجَّل (discovered) ويشترك فيه المستقبِل لاحقًا
+    links = parsed.feed.get("links", []) if parsed.get("feed") else []
+    hub = next((l.get("href") for l in links if l.get("rel") == "hub" and l.get("href")), None)
+    if not hub: return
+    topic = next((l.get("href") for l in links if l.get("rel") == "self" and l.get("href")), None) or src["url"]
+    if topic in _hubs_seen: return
+    _hubs_seen.add(topic)
+    sid = hashlib.blake2b(topic.encode("utf-8"), digest_size=8).hexdigest()
+    WRITER.execute("""INSERT OR IGNORE INTO websub_subs(topic, source, hub, sid, secret, state, lease_until, updated_at)
+                      VALUES(?,?,?,?,?,'discovered',0,?)""", (topic, src.get("name","?"), hub, sid, secrets.token_hex(16), time.time()))
+    _websub_wake.set()
+
+def websub_active() -> set:
+    # الاشتراك يفيد فقط إن كان المستقبِل يعمل في هذه العملية؛ في --once/cron تبقى الجدولة العادية
+    if not _receiver_running.is_set(): return set()
+    with db_lock:
+        return {r[0] for r in conn.execute("SELECT source FROM websub_subs WHERE state='active' AND lease_until > ?", (time.time(),))}
+
+def websub_renew():
+    # اشتراك جديد، أو فعّال ينتهي خلال يوم، أو معلّق لم يُتحقق منه خلال ساعة
+    if not WEBSUB_CALLBACK: return
+    now = time.time()
+    with db_lock:
+        rows = conn.execute("""SELECT topic, hub, sid, secret FROM websub_subs
+                               WHERE state='discovered' OR (state='active' AND lease_until < ?)
+                                  OR (state IN ('pending','denied') AND updated_at < ?)""",
+                            (now + 86400, now - 3600)).fetchall()
+    for topic, hub, sid, secret in rows:
+        # pending قبل الطلب: الـ hub قد يرسل التحقق (GET) قبل أن يعود الرد
+        WRITER.execute("UPDATE websub_subs SET state=CASE WHEN state='active' THEN state ELSE 'pending' END, updated_at=? WHERE topic=?",
+                       (time.time(), topic))
+        WRITER.flush()
         try:
-            items = fetch_rss(src) if src.get("type") == "rss" else fetch_scrape(src)
-            logger.info(f"{name}: fetched {len(items)} items")
-            if not items:
-                source_mark_fail(name, cool_minutes=60); continue
-            source_mark_ok(name)
+            r = HTTP.post(hub, tries=2, check=False, data={
+                "hub.mode": "subscribe", "hub.topic": topic, "hub.callback": f"{WEBSUB_CALLBACK}/websub/{sid}",
+                "hub.secret": secret, "hub.lease_seconds": str(WEBSUB_LEASE_SECONDS)})
+            ok = r.status_code in (200, 202, 204)
+            logger.info(f"[WEBSUB] subscribe {topic} via {hub}: {r.status_code}")
         except Exception as ex:
-            logger.error(f"Fetch failed for {name}: {ex}")
-            source_mark_fail(name); continue
-
-        for it in items:
-            title = it.get("title") or ""; url = it.get("url") or ""; content = it.get("summary") or ""
-            if not title or not url: continue
-            # فلترة الأنبار/الرمادي
-            if ANBAR_FILTER:
-                combined = f"{title}\n{content}"
-                if not is_relevant(combined): 
-                    continue
-            if is_duplicate(title, url, content):
-                logger.info(f"[SKIP] duplicate/similar: {title}"); continue
+            ok = False; logger.warning(f"[WEBSUB] subscribe {topic} failed: {ex}")
+        # يبقى pending حتى يصل طلب التحقق من الـ hub؛ الفشل يُعاد بعد ساعة
+        if not ok:
+            WRITER.execute("UPDATE websub_subs SET state='denied', updated_at=? WHERE topic=? AND state='pending'",
+                           (time.time(), topic))
+    WRITER.flush()
 
-            # صياغة بوست AI
-            locality = detect_locality(f"{title}\n{content}") if ANBAR_FILTER else ""
-            ai_text = llm_post(title, content, url, it.get("source",""))
-            ai_text = tg_format_ai_post(ai_text, locality)
+def _hmac_ok(secret: str, body: bytes, header: str) -> bool:
+    # X-Hub-Signature: "sha1=..." أو "sha256=..." (WebSub يسمح بعدة خوارزميات)
+    algo, _, sig = (header or "").partition("=")
+    if algo not in ("sha1", "sha256", "sha384", "sha512") or not sig: return False
+    return hmac.compare_digest(hmac.new(secret.encode("utf-8"), body, algo).hexdigest(), sig.strip().lower())
 
-            # أرسل تيليجرام
-            ok = send_telegram(ai_text)
-            if not ok:  # لو فشل، احفظ لسجل
-                save_to_md(it)
+class PushReceiver:
+    # خادم HTTP (خيوط) يضع الإشعارات في طابور، وخيط واحد يمررها في نفس مسار الجمع لكل خبر
+    def __init__(self, host: str = WEBSUB_HOST, port: int = WEBSUB_PORT):
+        import queue
+        self.host, self.port = host, port
+        self.queue = queue.Queue(maxsize=PUSH_QUEUE_SIZE)
+        self.server = None
+        self._stop = threading.Event()
 
-            # حفظ في قاعدة البيانات بعد الإرسال/الحفظ
-            save_item(it)
+    def start(self):
+        import http.server
+        rx = self
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, *a): pass
+            def reply(self, code: int, body: bytes = b""):
+                self.send_response(code); self.send_header("Content-Length", str(len(body)))
+                self.end_headers(); self.wfile.write(body)
+            def do_GET(self):
+                code, body = rx.verify(self.path)
+                self.reply(code, body)
+            def do_POST(self):
+                # الحجم يُفحص قبل القراءة: الجسم كله في الذاكرة قبل التحقق من التوقيع/السر
+                try: n = int(self.headers.get("Content-Length") or "")
+                except ValueError: n = -1
+                if not 0 <= n <= FEED_MAX_BYTES:
+                    METRICS.inc("push_notifications_total", kind="notify" if self.path.startswith("/notify") else "websub",
+                                result="too_large" if n > 0 else "bad_length")
+                    self.close_connection = True  # الجسم لم يُقرأ
+                    return self.reply(413 if n > 0 else 400)
+                self.reply(rx.accept(self.path, self.headers, self.rfile.read(n)))
+        _receiver_running.set()
+        self.server = http.server.ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, name="websub", daemon=True).start()
+        threading.Thread(target=self._work, name="push", daemon=True).start()
+        threading.Thread(target=self._renew, name="websub-renew", daemon=True).start()
+        logger.info(f"[WEBSUB] receiver on http://{self.host}:{self.port} (callback: {WEBSUB_CALLBACK or '-'})")
+        return self
 
-            # فيسبوك
-            if FACEBOOK_MODE:
-                try:
-                    handle_facebook(it)
-                except Exception as ex:
-                    logger.warning(f"facebook compose failed: {ex}")
+    def stop(self):
+        self._stop.set(); _websub_wake.set(); _receiver_running.clear()
+        if self.server: self.server.shutdown(); self.server.server_close()
+
+    def _row(self, sid: str):
+        with db_lock:
+            return conn.execute("SELECT topic, source, secret, state FROM websub_subs WHERE sid=?", (sid,)).fetchone()
+
+    def verify(self, path: str):
+        # تحقق الـ hub من الاشتراك: يُعاد hub.challenge فقط لموضوع طلبناه
+        u = urlparse(path); q = {k: v[0] for k, v in parse_qs(u.query).items()}
+        parts = u.path.strip("/").split("/")
+        if len(parts) != 2 or parts[0] != "websub": return 404, b""
+        row = self._row(parts[1])
+        if not row or q.get("hub.topic") != row[0]: return 404, b""
+        mode = q.get("hub.mode")
+        if mode == "denied":
+            WRITER.execute("UPDATE websub_subs SET state='denied', updated_at=? WHERE sid=?", (time.time(), parts[1]))
+            WRITER.flush(); return 200, b""
+        if mode != "subscribe" or row[3] not in ("pending", "active"): return 404, b""
+        lease = float(q.get("hub.lease_seconds") or WEBSUB_LEASE_SECONDS)
+        WRITER.execute("UPDATE websub_subs SET state='active', lease_until=?, updated_at=? WHERE sid=?",
+                       (time.time() + lease, time.time(), parts[1]))
+        WRITER.flush()
+        logger.info(f"[WEBSUB] active: {row[1]} ({row[0]}) for {lease:.0f}s")
+        return 200, q.get("hub.challenge", "").encode("utf-8")
+
+    def accept(self, path: str, headers, body: bytes) -> int:
+        u = urlparse(path); parts = u.path.strip("/").split("/")
+        now = time.time()
+        if len(parts) == 2 and parts[0] == "websub":
+            row = self._row(parts[1])
+            if not row: return 404
+            # توقيع خاطئ: 2xx حسب المواصفة لكن يُتجاهل المحتوى
+            if not _hmac_ok(row[2], body, headers.get("X-Hub-Signature-256") or headers.get("X-Hub-Signature")):
+                METRICS.inc("push_notifications_total", kind="websub", result="bad_signature"); return 202
+            return self._put(("feed", row[1], body, now), "websub")
+        if parts == ["notify"]:
+            # بلا مفتاح لا يُقبل شيء: المحتوى يُنشر في القناة والروابط تُجلب (SSRF)
+            if not WEBSUB_SECRET or not _hmac_ok(WEBSUB_SECRET, body, headers.get("X-Hub-Signature-256") or headers.get("X-Hub-Signature")):
+                METRICS.inc("push_notifications_total", kind="notify", result="bad_signature"); return 403
+            q = {k: v[0] for k, v in parse_qs(u.query).items()}
+            if "json" in (headers.get("Content-Type") or ""):
+                try: j = json.loads(body or b"{}")
+                except ValueError: return 400
+                if j.get("url"): return self._put(("url", j.get("source") or urlparse(j["url"]).netloc, j, now), "notify")
+                if j.get("source"): return self._put(("source", j["source"], None, now), "notify")
+                return 400
+            if not q.get("source"): return 400
+            return self._put(("feed", q["source"], body, now), "notify")
+        return 404
+
+    def _put(self, job, kind: str) -> int:
+        try: self.queue.put_nowait(job)
+        except Exception:
+            METRICS.inc("push_notifications_total", kind=kind, result="queue_full"); return 503
+        METRICS.inc("push_notifications_total", kind=kind, result="queued")
+        return 202
+
+    def _renew(self):
+        while not self._stop.is_set():
+            try: websub_renew()
+            except Exception as ex: logger.warning(f"[WEBSUB] renew failed: {ex}")
+            _websub_wake.wait(WEBSUB_RENEW_EVERY); _websub_wake.clear()
+
+    def _work(self):
+        while not self._stop.is_set():
+            kind, name, payload, t0 = self.queue.get()
+            try:
+                self.ingest(self.items(kind, name, payload), t0)
+            except Exception as ex:
+                logger.error(f"[PUSH] {kind} {name} failed: {ex}")
+            finally:
+                self.queue.task_done()
+
+    def items(self, kind: str, name: str, payload) -> list:
+        src = next((s for s in load_sources() if s.get("name") == name), None)
+        if kind == "feed":
+            return feed_items(src or {"name": name, "url": ""}, feedparser.parse(payload), observe=False)
+        if kind == "source":
+            if not src: logger.warning(f"[PUSH] unknown source '{name}'"); return []
+            return (fetch_rss(src) if src.get("type") == "rss" else fetch_scrape(src)) or []
+        # رابط خبر مفرد: العنوان من الصفحة إن لم يُرسل
+        it = {"source": name, "url": canonical_url(payload["url"]), "title": norm_title(payload.get("title") or ""),
+              "published_at": payload.get("published_at") or "", "summary": clean_text(payload.get("summary") or "")[:1500]}
+        if src and src.get("content_selector"): it["content_selector"] = src["content_selector"]
+        if not it["title"]:
+            page = get_page(it["url"])
+            res = EXTRACTOR.run(extract_html, page, it["url"], it.get("content_selector"), True)
+            it["title"], it["summary"] = res["title"], res["text"][:1500]
+        return [it]
+
+    def ingest(self, items: list, t0: float) -> int:
+        # نفس مسار الجمع التسلسلي: فلترة → استخراج → حجز → صياغة → صندوق الصادر
+        fresh = [it for it in items if filter_item(it) and extract_item(it) and claim_item(it)]
+        hwm_commit()
+        WRITER.flush()
+        for it in fresh:
+            dispatch_item(it)
+            if not COALESCER.enabled(): METRICS.observe("push_to_outbox_seconds", time.time() - t0)
+        WRITER.flush()
+        if fresh:
+            DISPATCHER.start()
+            logger.info(f"[PUSH] {len(fresh)}/{len(items)} new from push in {time.time() - t0:.1f}s")
+        return len(fresh)
+
+# ====== عدة عمّال: عقود إيجار المصادر في SQLite ======
+# كل عامل يحجز المصدر قبل جلبه (صف واحد بمالك ومهلة)؛ الحجز والتحرير يُثبّتان فورًا خارج دفعات WRITER
+LEASE_SECONDS = float(os.getenv("LEASE_SECONDS", "900"))
+LEASE_REFETCH_SECONDS = float(os.getenv("LEASE_REFETCH_SECONDS", "60"))
+_leases = set()
+
+def worker_id() -> str:
+    return os.getenv("WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"
 
-            total_new += 1
-            time.sleep(0.5)
+def lease_acquire(name: str) -> bool:
+    now = time.time()
+    with db_lock:
+        WRITER.flush()
+        cur = conn.execute("""INSERT INTO source_leases(name, owner, expires) VALUES(?,?,?)
+                              ON CONFLICT(name) DO UPDATE SET owner=excluded.owner, expires=excluded.expires
+                              WHERE source_leases.owner=excluded.owner
+                                 OR (source_leases.expires < ? AND COALESCE(source_leases.done_at, 0) < ?)""",
+                           (name, worker_id(), now + LEASE_SECONDS, now, now - LEASE_REFETCH_SECONDS))
+        conn.commit()
+    if cur.rowcount != 1: return False
+    _leases.add(name)
+    return True
+
+def lease_retry_at(names: list) -> dict:
+    # مصادر يحملها عامل آخر: أقرب وقت يقبل فيه lease_acquire (انتهاء العقد أو done_at + LEASE_REFETCH_SECONDS)
+    if not names: return {}
+    with db_lock:
+        rows = conn.execute(f"""SELECT name, expires, done_at FROM source_leases
+                                WHERE owner != ? AND name IN ({",".join("?"*len(names))})""",
+                            (worker_id(), *names)).fetchall()
+    return {n: max(expires or 0, (done_at or 0) + LEASE_REFETCH_SECONDS) for n, expires, done_at in rows}
+
+def lease_release_all():
+    if not _leases: return
+    now = time.time()
+    with db_lock:
+        WRITER.flush()
+        conn.executemany("UPDATE source_leases SET expires=0, done_at=? WHERE name=? AND owner=?",
+                         [(now, n, worker_id()) for n in _leases])
+        conn.commit()
+    _leases.clear()
+
+def run_workers(n: int, once: bool):
+    # n عمليات مستقلة (اتصال SQLite لكل منها)؛ تتقاسم المصادر عبر العقود والصادر عبر حجز الرسائل
+    import multiprocessing
+    base = os.getenv("WORKER_ID") or socket.gethostname()
+    procs = []
+    for i in range(n):
+        p = multiprocessing.Process(target=_worker_main, args=(f"{base}:w{i}", once, i == 0, n), name=f"worker-{i}")
+        p.start(); procs.append(p)
+    for p in procs: p.join()
+
+def _worker_main(wid: str, once: bool, sender: bool, workers: int = 1):
+    os.environ["WORKER_ID"] = wid
+    random.seed()
+    DISPATCHER.active = DISPATCHER.active and sender
+    EXTRACTOR.procs = extract_procs(workers)  # المجمع يُنشأ عند أول استخدام
+    bot = Bot(Config.from_env()).start()
+    if once:
+        bot.collect_once()
+        DISPATCHER.drain()
+    else:
+        bot.run_forever()
+
+# ====== دورة الجمع/النشر ======
+def collect_once(sources: list = None):
+    if not PROFILE_CYCLE:
+        return _collect_once(sources)
+    import cProfile
+    prof = cProfile.Profile()
+    try:
+        return prof.runcall(_collect_once, sources)
+    finally:
+        profile_dump(prof)
+
+def _collect_once(sources: list = None):
+    if sources is None:
+        sources = load_sources()
+        if ADAPTIVE_POLL:
+            total = len(sources); sources = sched_due(sources)
+            logger.info(f"[SCHED] {len(sources)}/{total} sources due")
+    health_load()
+    with db_lock:
+        row = conn.execute("SELECT val FROM meta WHERE key='zero_streak'").fetchone()
+    zero_streak = int(row[0]) if row and str(row[0]).isdigit() else 0
+
+    nd_backfill()
+    LLM.reset_budget()
+    DISPATCHER.start()
+    recover_claimed()
+    since = METRICS.counter_values()
+    t0 = time.time()
+    if PIPELINE:
+        total_new = asyncio.run(collect_pipeline(sources))
+        hwm_commit()
+    else:
+        total_new = 0
+        for src in sources:
+            fresh = [it for it in fetch_source(src) if filter_item(it) and extract_item(it) and claim_item(it)]
+            for it in fresh:
+                dispatch_item(it)
+                total_new += 1
+            hwm_commit(src.get("name","?"))
+            WRITER.flush()
 
-    # تتبع حالات انعدام الأخبار
-    if total_new == 0: zero_streak += 1
+    sched_update([s for s in sources if s.get("name","?") in _leases])  # مصادر العمال الآخرين لا تُلمس
+    nd_purge()
+    LLM.evict()
+    LLM.log_stats()
+    COALESCER.log_stats()
+    DISPATCHER.log_stats()
+    PAGES.evict()
+    PAGES.log_stats()
+    # تتبع حالات انعدام الأخبار (دورة بلا مصادر مستحقة أو كلها مع عمال آخرين لا تُحتسب)
+    if not _leases: pass
+    elif total_new == 0: zero_streak += 1
     else: zero_streak = 0
-    conn.execute("""INSERT INTO meta(key,val) VALUES('zero_streak',?)
-                    ON CONFLICT(key) DO UPDATE SET val=?""",(str(zero_streak), str(zero_streak)))
-    conn.commit()
-    logger.info(f"New items sent/saved: {total_new}")
+    WRITER.execute("""INSERT INTO meta(key,val) VALUES('zero_streak',?)
+                      ON CONFLICT(key) DO UPDATE SET val=?""",(str(zero_streak), str(zero_streak)))
+    WRITER.flush()
+    lease_release_all()
+    compact()
+    elapsed = time.time() - t0
+    METRICS.inc("cycles_total"); METRICS.inc("new_items_total", total_new)
+    METRICS.observe("cycle_seconds", elapsed)
+    metrics_write_cycle(since, {"sources": len(sources), "new_items": total_new, "seconds": round(elapsed, 3)})
+    logger.info(f"New items sent/saved: {total_new} ({elapsed:.1f}s)")
+    return total_new
+
+# ====== التشغيل: إعداد + كائن البوت (كل الآثار الجانبية هنا لا عند الاستيراد) ======
+class Config:
+    def __init__(self, db_path: str = None, out_dir: str = None, page_cache_db: str = None,
+                 log_stdout: bool = True, log_file: bool = True, profiles: list = None):
+        self.db_path = db_path or DB_PATH
+        self.profiles = profiles  # قائمة Profile؛ None = profiles.json أو متغيرات البيئة
+        self.out_dir = out_dir or OUT_DIR
+        self.page_cache_db = page_cache_db or PAGE_CACHE_DB
+        self.log_stdout, self.log_file = log_stdout, log_file
+
+    @classmethod
+    def from_env(cls):
+        return cls(os.getenv("NEWS_DB"), os.getenv("OUT_DIR"), os.getenv("PAGE_CACHE_DB"))
+
+class Bot:
+    # يستخدمه main ويمكن استيراده كمكتبة: Bot(Config(...)).start().collect_once(sources)
+    def __init__(self, config: Config = None):
+        self.config = config or Config.from_env()
+        self.started = False
+        self.metrics_server = None
+
+    def start(self):
+        global conn, WRITER, PAGES, OUT_DIR, DB_PATH, IMAGE_STORE, ROUTER
+        if self.started: return self
+        cfg = self.config
+        OUT_DIR, DB_PATH = cfg.out_dir, cfg.db_path
+        IMAGE_STORE = os.path.join(OUT_DIR, "images", "store")
+        ensure_dir(OUT_DIR)
+        if not logger.handlers:
+            if cfg.log_stdout:
+                ch = logging.StreamHandler(sys.stdout); ch.setFormatter(fmt); logger.addHandler(ch)
+            if cfg.log_file:
+                fh = logging.FileHandler(os.path.join(OUT_DIR, 'bot.log'), encoding='utf-8'); fh.setFormatter(fmt); logger.addHandler(fh)
+        conn = init_db(DB_PATH)
+        WRITER = DbWriter(conn, db_lock)
+        PAGES = PageCache(cfg.page_cache_db)
+        ROUTER = ProfileRouter(cfg.profiles or load_profiles())
+        BREAKERS.load()
+        bloom_rebuild(background=True)
+        METRICS.gauge("outbox_pending", DISPATCHER.pending)
+        METRICS.gauge("llm", lambda: [({"backend": b, "stat": k}, v) for b, st in list(LLM.stats.items()) for k, v in st.items()])
+        METRICS.gauge("breaker_state", BREAKERS.state_rows)
+        METRICS.gauge("page_cache", lambda: [({"stat": k}, v) for k, v in PAGES.stats.items()])
+        if METRICS_PORT and not self.metrics_server:
+            self.metrics_server = metrics_serve()
+        self.started = True
+        return self
+
+    def collect_once(self, sources: list = None):
+        return collect_once(sources)
+
+    def run_forever(self):
+        if ADAPTIVE_POLL:
+            run_scheduler()
+        else:
+            while True:
+                collect_once()
+                time.sleep(POLL_SECONDS)
+
+    def close(self, drain: bool = True):
+        COALESCER.stop()
+        DISPATCHER.drain() if drain else DISPATCHER.stop()
+        EXTRACTOR.close()
+        WRITER.flush()
+        PAGES.conn.close(); conn.close()
+        if self.metrics_server:
+            self.metrics_server.shutdown(); self.metrics_server = None
+        self.started = False
+
+def extract_dir(path: str, out=None) -> int:
+    # تعبئة/قياس دون اتصال: كل ملف .html في المجلد → سطر JSON (نص، عنوان، صور og، بصمة)
+    if not logger.handlers:
+        ch = logging.StreamHandler(sys.stderr); ch.setFormatter(fmt); logger.addHandler(ch)
+    files = sorted(os.path.join(root, f) for root, _, names in os.walk(path)
+                   for f in names if f.lower().endswith((".html", ".htm")))
+    out = out or sys.stdout
+    def one(fp):
+        t0 = time.perf_counter()
+        with open(fp, "rb") as f: raw = f.read()
+        try:
+            res = EXTRACTOR.run(extract_html, raw, "file://" + os.path.abspath(fp), None, True)
+        except Exception as ex:
+            res = {"error": f"{type(ex).__name__}: {ex}"}
+        return dict(res, file=fp, bytes=len(raw), ms=round((time.perf_counter() - t0) * 1000, 1))
+    t0 = time.perf_counter(); n_bytes = errors = 0
+    # خيوط بعدد العمليات + 1: كل عملية مشغولة دائمًا (وبدون مجمع: تسلسلي)
+    with ThreadPoolExecutor(max_workers=max(1, EXTRACTOR.procs + 1)) as ex:
+        for res in ex.map(one, files):
+            n_bytes += res["bytes"]; errors += "error" in res
+            out.write(json.dumps(res, ensure_ascii=False) + "\n")
+    elapsed = time.perf_counter() - t0
+    EXTRACTOR.close()
+    logger.info(f"[EXTRACT] {len(files)} pages, {n_bytes / 1e6:.1f} MB, {errors} errors in {elapsed:.2f}s "
+                f"({len(files) / elapsed if elapsed else 0:.1f} pages/s, procs={max(0, EXTRACTOR.procs)})")
+    return len(files)
 
 def main():
     import argparse
     ap = argparse.ArgumentParser()
     ap.add_argument("--once", action="store_true", help="تشغيل مرة واحدة والخروج")
+    ap.add_argument("--workers", type=int, default=1, help="عدد العمليات المتوازية (تتقاسم المصادر)")
+    ap.add_argument("--receiver", action="store_true", help="خادم دائم يستقبل WebSub/POST مع الجلب الدوري كاحتياط")
+    ap.add_argument("--compact", action="store_true", help="أرشفة الأخبار القديمة (RETENTION_DAYS) ثم VACUUM والخروج")
+    ap.add_argument("--extract-dir", metavar="DIR", help="استخراج صفحات HTML محفوظة في مجلد إلى JSONL والخروج")
+    ap.add_argument("--extract-out", metavar="FILE", help="ملف JSONL لـ --extract-dir (افتراضيًا stdout)")
     args = ap.parse_args()
-    if args.once:
-        collect_once()
+    if args.extract_dir:
+        if args.extract_out:
+            with open(args.extract_out, "w", encoding="utf-8") as f: extract_dir(args.extract_dir, f)
+        else:
+            extract_dir(args.extract_dir)
+        return
+    if args.compact:
+        bot = Bot(Config.from_env()).start()
+        compact(force=True); bot.close(drain=False)
+        return
+    if args.workers > 1:
+        return run_workers(args.workers, args.once)
+    bot = Bot(Config.from_env()).start()
+    logger.info(f"[STARTUP] ready in {(time.perf_counter() - _T_START) * 1000:.0f} ms")
+    if args.receiver:
+        PushReceiver().start()
+        DISPATCHER.start()
+        bot.run_forever()
+    elif args.once:
+        bot.collect_once()
+        DISPATCHER.drain()
     else:
-        while True:
-            collect_once()
-            time.sleep(POLL_SECONDS)
+        bot.run_forever()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# مجمع الاستخراج: الانتظار في الطابور لا يُحسب من مهلة المهمة
+import os, sys, time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.update({"AUTO_PIP": "0", "LLM_BACKEND": "none"})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+import news_bot as nb
+
+def slow(x):
+    time.sleep(0.8)
+    return x
+
+def stuck(x):
+    time.sleep(30)
+    return x
+
+@pytest.fixture()
+def pool():
+    p = nb.ExtractPool(procs=1, timeout=2, max_tasks=0)
+    p.run(slow, -1)  # تشغيل العملية (spawn) قبل القياس
+    yield p
+    p.close()
+
+def test_burst_waits_without_timeout(pool):
+    with ThreadPoolExecutor(5) as ex:
+        got = list(ex.map(lambda i: pool.run(slow, i), range(5)))
+    assert got == list(range(5))
+    assert pool.gen == 0  # لم يُعَد إنشاء المجمع
+
+def test_stuck_task_still_times_out(pool):
+    t0 = time.time()
+    with pytest.raises(TimeoutError):
+        pool.run(stuck, 1)
+    assert time.time() - t0 < 10 and pool.gen == 1
+    assert pool.run(slow, 2) == 2
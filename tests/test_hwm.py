@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+# علامة آخر ما رُئي (HWM): الخبر لا يصير مرئيًا قبل الحكم عليه، فتوقف العملية أو خطأ في مرحلة لا يُفقده
+import os, sys, time, json, threading, http.server
+from email.utils import formatdate
+
+os.environ.update({"AUTO_PIP": "0", "LLM_BACKEND": "none", "DRY_RUN": "0", "FACEBOOK_MODE": "0", "ADAPTIVE_POLL": "0"})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+import news_bot as nb
+
+BODY = "نص الخبر الكامل عن افتتاح مشروع جديد للطرق والجسور في المحافظة بحضور المسؤولين والأهالي. "
+
+class Site:
+    def __init__(self, n: int):
+        site = self
+        class H(http.server.BaseHTTPRequestHandler):
+            def log_message(self, *a): pass
+            def do_GET(self):
+                if self.path == "/feed.xml":
+                    now = time.time()
+                    rows = "".join(f"<item><title>خبر رقم {i}</title><link>{site.base}/a/{i}.html</link>"
+                                   f"<description>ملخص {i}</description><pubDate>{formatdate(now - i * 60)}</pubDate></item>"
+                                   for i in range(n))
+                    body = f'<rss version="2.0"><channel><title>t</title>{rows}</channel></rss>'.encode()
+                else:
+                    i = self.path.rsplit("/", 1)[-1]
+                    words = " ".join(f"ك{j}{i}x{j * 7}" for j in range(80))  # نص مختلف لكل خبر (لا تشابه)
+                    body = f"<html><body><article><p>{BODY} {words}</p></article></body></html>".encode()
+                self.send_response(200); self.send_header("Content-Length", str(len(body))); self.end_headers()
+                self.wfile.write(body)
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), H)
+        self.base = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.src = {"name": "hwmsrc", "type": "rss", "url": f"{self.base}/feed.xml"}
+
+@pytest.fixture()
+def bot(tmp_path, monkeypatch):
+    b = nb.Bot(nb.Config(db_path=str(tmp_path / "news.db"), out_dir=str(tmp_path / "out"),
+                         page_cache_db=str(tmp_path / "cache.db"), log_stdout=False, log_file=False,
+                         profiles=[nb.Profile("all", chat_id="-100")])).start()
+    monkeypatch.setattr(nb, "TG_TOKEN", "test")
+    monkeypatch.setattr(nb.DISPATCHER, "active", False)
+    yield b
+    b.close(drain=False)
+
+def claimed() -> int:
+    with nb.db_lock:
+        return nb.conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+
+def hwm_row(name: str):
+    with nb.db_lock:
+        guids, retry = nb.conn.execute("SELECT guids, retry FROM source_hwm WHERE name=?", (name,)).fetchone()
+    return json.loads(guids or "[]"), json.loads(retry or "{}")
+
+def test_fetched_but_undecided_items_come_back(bot):
+    site = Site(3)
+    # العملية "تتوقف" بعد الجلب وقبل الحجز
+    assert len(nb.fetch_source(site.src)) == 3
+    guids, retry = hwm_row("hwmsrc")
+    assert guids == [] and len(retry) == 3
+
+    bot.collect_once([site.src])
+    assert claimed() == 3
+    guids, retry = hwm_row("hwmsrc")
+    assert len(guids) == 3 and retry == {}
+
+    # الدورة التالية: كل شيء مرئي
+    assert nb.fetch_source(site.src) == []
+
+def test_stage_error_does_not_mark_seen(bot, monkeypatch):
+    site = Site(2)
+    real = nb.claim_item
+    def broken(it):
+        if it["url"].endswith("/0.html"): raise RuntimeError("boom")
+        return real(it)
+    monkeypatch.setattr(nb, "claim_item", broken)
+    monkeypatch.setattr(nb, "PIPELINE", True)
+    bot.collect_once([site.src])
+    assert claimed() == 1
+    monkeypatch.setattr(nb, "claim_item", real)
+    bot.collect_once([site.src])
+    assert claimed() == 2
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+# hub WebSub محلي: اكتشاف ← اشتراك ← تحقق (challenge) ← دفع موقّع ← صندوق الصادر
+import os, sys, time, hmac, hashlib, threading, urllib.request, http.server
+from email.utils import formatdate
+from urllib.parse import urlparse, parse_qs, urlencode
+
+os.environ.update({"AUTO_PIP": "0", "LLM_BACKEND": "none", "DRY_RUN": "0", "FACEBOOK_MODE": "0"})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+import news_bot as nb
+
+def rss(base: str, items: list) -> bytes:
+    rows = "".join(f"<item><title>{t}</title><link>{base}/a/{i}.html</link><guid>{base}/a/{i}.html</guid>"
+                   f"<description>{d}</description><pubDate>{formatdate(time.time())}</pubDate></item>"
+                   for i, t, d in items)
+    return (f'<?xml version="1.0" encoding="utf-8"?><rss version="2.0" xmlns:atom="http://www.w3.org/2005/Atom">'
+            f'<channel><title>hub test</title><atom:link rel="hub" href="{base}/hub"/>'
+            f'<atom:link rel="self" href="{base}/feed.xml"/>{rows}</channel></rss>').encode("utf-8")
+
+BODY = "نص الخبر الكامل عن افتتاح مشروع جديد للطرق والجسور في المحافظة بحضور المسؤولين والأهالي. " * 3
+
+class Hub:
+    # hub + موقع الأخبار في خادم واحد؛ يتحقق من المشترك كما في مواصفة WebSub
+    def __init__(self):
+        self.subs, self.verified = {}, threading.Event()
+        hub = self
+        class H(http.server.BaseHTTPRequestHandler):
+            def log_message(self, *a): pass
+            def reply(self, code, body=b"", ctype="text/html; charset=utf-8"):
+                self.send_response(code); self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(body))); self.end_headers(); self.wfile.write(body)
+            def do_GET(self):
+                if self.path == "/feed.xml":
+                    return self.reply(200, rss(hub.base, [(1, "خبر أول", BODY)]), "application/rss+xml")
+                if self.path.startswith("/a/"):
+                    return self.reply(200, f"<html><body><article><p>{BODY}</p></article></body></html>".encode())
+                self.reply(404)
+            def do_POST(self):
+                form = {k: v[0] for k, v in parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode()).items()}
+                threading.Thread(target=hub.verify, args=(form,), daemon=True).start()
+                self.reply(202)
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), H)
+        self.base = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def verify(self, form: dict):
+        q = urlencode({"hub.mode": "subscribe", "hub.topic": form["hub.topic"], "hub.challenge": "c123",
+                       "hub.lease_seconds": "3600"})
+        with urllib.request.urlopen(f"{form['hub.callback']}?{q}", timeout=5) as r:
+            if r.read() == b"c123":
+                self.subs[form["hub.topic"]] = (form["hub.callback"], form["hub.secret"]); self.verified.set()
+
+    def publish(self, topic: str, body: bytes):
+        callback, secret = self.subs[topic]
+        sig = "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+        return post(callback, body, {"Content-Type": "application/rss+xml", "X-Hub-Signature-256": sig})
+
+def post(url: str, body: bytes, headers: dict) -> int:
+    req = urllib.request.Request(url, data=body, headers=headers, method="POST")
+    try:
+        with urllib.request.urlopen(req, timeout=5) as r: return r.status
+    except urllib.error.HTTPError as ex:
+        return ex.code
+
+def wait_for(fn, timeout: float = 15.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        v = fn()
+        if v: return v
+        time.sleep(0.05)
+    return fn()
+
+@pytest.fixture()
+def receiver(tmp_path, monkeypatch):
+    bot = nb.Bot(nb.Config(db_path=str(tmp_path / "news.db"), out_dir=str(tmp_path / "out"),
+                           page_cache_db=str(tmp_path / "cache.db"), log_stdout=False, log_file=False,
+                           profiles=[nb.Profile("all", chat_id="-100")])).start()
+    monkeypatch.setattr(nb, "TG_TOKEN", "test")
+    monkeypatch.setattr(nb.DISPATCHER, "active", False)  # الرسائل تبقى في الصادر
+    rx = nb.PushReceiver(host="127.0.0.1", port=0).start()
+    monkeypatch.setattr(nb, "WEBSUB_CALLBACK", f"http://127.0.0.1:{rx.port}")
+    yield rx
+    rx.stop(); bot.close(drain=False)
+
+def outbox_for(url: str):
+    with nb.db_lock:
+        return nb.conn.execute("""SELECT o.status, o.text FROM outbox o JOIN items i ON i.id = o.item_id
+                                  WHERE i.url = ?""", (nb.canonical_url(url),)).fetchall()
+
+def test_verify_signed_push_reaches_outbox(receiver):
+    hub = Hub()
+    topic = f"{hub.base}/feed.xml"
+    assert len(nb.fetch_rss({"name": "hubsrc", "type": "rss", "url": topic})) == 1
+    assert hub.verified.wait(10), "hub did not verify the subscription"
+    assert wait_for(lambda: "hubsrc" in nb.websub_active(), 5)
+
+    # توقيع خاطئ: 202 ولا شيء يُنشر
+    url2 = f"{hub.base}/a/2.html"
+    callback, _ = hub.subs[topic]
+    body = rss(hub.base, [(2, "خبر مدفوع جديد", BODY)])
+    assert post(callback, body, {"X-Hub-Signature-256": "sha256=00"}) == 202
+    assert hub.publish(topic, body) == 202
+    rows = wait_for(lambda: outbox_for(url2))
+    assert rows and rows[0][0] == "pending" and url2 in rows[0][1]
+    assert len(outbox_for(url2)) == 1
+
+    # بعد إيقاف المستقبِل لا يُبطَّأ الجلب الدوري للمصدر
+    receiver.stop()
+    assert nb.websub_active() == set()
+
+def test_notify_refused_without_secret(receiver, monkeypatch):
+    monkeypatch.setattr(nb, "WEBSUB_SECRET", "")
+    url = f"http://127.0.0.1:{receiver.port}/notify"
+    body = b'{"url": "http://127.0.0.1:9/x.html", "title": "fake"}'
+    assert post(url, body, {"Content-Type": "application/json"}) == 403
+    monkeypatch.setattr(nb, "WEBSUB_SECRET", "k")
+    sig = "sha256=" + hmac.new(b"k", body, hashlib.sha256).hexdigest()
+    assert post(url, body, {"Content-Type": "application/json", "X-Hub-Signature-256": "sha256=00"}) == 403
+    assert post(url, body, {"Content-Type": "application/json", "X-Hub-Signature-256": sig}) == 202
+
+def test_body_size_checked_before_read(receiver, monkeypatch):
+    import http.client
+    monkeypatch.setattr(nb, "FEED_MAX_BYTES", 1000)
+    def send(headers: dict, body: bytes = b"") -> int:
+        c = http.client.HTTPConnection("127.0.0.1", receiver.port, timeout=5)
+        c.putrequest("POST", "/notify"); [c.putheader(k, v) for k, v in headers.items()]; c.endheaders()
+        if body: c.send(body)
+        status = c.getresponse().status; c.close()
+        return status
+    assert send({"Content-Length": str(10 ** 9)}) == 413  # يُرفض دون انتظار الجسم
+    assert send({"Content-Length": "abc"}) == 400
+    assert send({}) == 400
+    assert send({"Content-Length": "2"}, b"{}") == 403  # حجم مقبول: يصل إلى فحص السر